@@ -1,6 +1,7 @@
 from controllers.users_controller import update_user, create_new_user, get_existing_user, delete_user, \
-    delete_transactions, delete_category
-from controllers.ocr_controller import process_receipt
+    delete_transactions, delete_category, get_transactions, get_deletion_job, \
+    patch_user
+from controllers.ocr_controller import process_receipt, process_receipts, process_receipt_async, get_receipt_job
 from flask import Flask, jsonify, request
 import os
 import sys
@@ -40,16 +41,31 @@ def update_user_route():
     return update_user(request)
 
 
+@app.route('/user/update', methods=['PATCH'])
+def patch_user_route():
+    return patch_user(request)
+
+
 @app.route('/user/get', methods=['GET'])
 def get_user():
     return get_existing_user(request)
 
 
+@app.route('/user/transactions', methods=['GET'])
+def get_transactions_route():
+    return get_transactions(request)
+
+
 @app.route('/user/delete', methods=['DELETE'])
 def delete_user_route():
     return delete_user(request)
 
 
+@app.route('/user/delete_jobs/<job_id>', methods=['GET'])
+def get_deletion_job_route(job_id):
+    return get_deletion_job(job_id)
+
+
 @app.route('/transactions/delete', methods=['DELETE'])
 def delete_transactions_route():
     return delete_transactions(request)
@@ -65,6 +81,21 @@ def process_receipt_route():
     return process_receipt(request)
 
 
+@app.route('/receipt_jobs/<job_id>', methods=['GET'])
+def get_receipt_job_route(job_id):
+    return get_receipt_job(job_id)
+
+
+@app.route('/process_receipt_async', methods=['POST'])
+def process_receipt_async_route():
+    return process_receipt_async(request)
+
+
+@app.route('/process_receipts', methods=['POST'])
+def process_receipts_route():
+    return process_receipts(request)
+
+
 # Start the Flask app
 if __name__ == '__main__':
     app.run(ssl_context=('fullchain.pem', 'privkey.pem'), port=5001)
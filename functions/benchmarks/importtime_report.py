@@ -0,0 +1,120 @@
+"""Reports what importing the Flask app costs, to keep cold starts small.
+
+Runs `python -X importtime -c "import app"` in a fresh interpreter, prints the slowest
+top-level imports and fails if startup goes over budget or pulls in a module that is
+supposed to load on first use.
+
+Run from the functions folder:
+
+    python -m benchmarks.importtime_report --budget-ms 1500
+"""
+import argparse
+import os
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+# SDKs that must only be imported by the request or warm up that needs them.
+DEFAULT_FORBIDDEN = [
+    "nltk",
+    "openai",
+    "PIL",
+    "google.cloud.vision",
+    "google.cloud.pubsub_v1",
+    "google.cloud.firestore",
+]
+
+
+def run_importtime(module: str) -> str:
+    """
+    Imports a module in a new interpreter with -X importtime.
+
+    Args:
+        module (str): The module to import.
+
+    Returns:
+        str: The importtime report written to stderr.
+    """
+    functions_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=functions_dir,
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        lines = [line for line in result.stderr.splitlines() if not line.startswith("import time:")]
+        raise RuntimeError(f"import {module} failed:\n" + "\n".join(lines))
+    return result.stderr
+
+
+def parse_importtime(report: str) -> List[Tuple[str, int, int, int]]:
+    """
+    Parses an importtime report.
+
+    Args:
+        report (str): The stderr of `python -X importtime`.
+
+    Returns:
+        List[Tuple[str, int, int, int]]: (module, self us, cumulative us, depth) per import.
+    """
+    rows = []
+    for line in report.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        depth = (len(name) - len(name.lstrip())) // 2
+        rows.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return rows
+
+
+def summarize(rows: List[Tuple[str, int, int, int]], top: int) -> Dict[str, object]:
+    """
+    Totals an importtime report and picks the slowest top-level imports.
+
+    Args:
+        rows (List[Tuple[str, int, int, int]]): The parsed report.
+        top (int): How many imports to list.
+
+    Returns:
+        Dict[str, object]: `total_ms`, `modules` and `slowest` as (module, ms) pairs.
+    """
+    roots = [row for row in rows if row[3] <= 1]
+    slowest = sorted(roots, key=lambda row: row[2], reverse=True)[:top]
+    return {
+        "total_ms": sum(row[1] for row in rows) / 1000,
+        "modules": {row[0] for row in rows},
+        "slowest": [(row[0], row[2] / 1000) for row in slowest],
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--module", default="app")
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--budget-ms", type=float, default=None,
+                        help="Fail if importing the module takes longer than this.")
+    parser.add_argument("--forbid", action="append", default=None,
+                        help="Module that must not be imported at startup. Repeatable.")
+    args = parser.parse_args()
+
+    summary = summarize(parse_importtime(run_importtime(args.module)), args.top)
+    print(f"import {args.module}: {summary['total_ms']:.1f} ms, {len(summary['modules'])} modules")
+    for name, ms in summary["slowest"]:
+        print(f"  {ms:9.1f} ms  {name}")
+
+    failed = False
+    forbidden = args.forbid or DEFAULT_FORBIDDEN
+    loaded = sorted(name for name in summary["modules"]
+                    if any(name == f or name.startswith(f + ".") for f in forbidden))
+    if loaded:
+        print(f"Loaded at startup but should load on first use: {', '.join(loaded)}")
+        failed = True
+    if args.budget_ms is not None and summary["total_ms"] > args.budget_ms:
+        print(f"Over budget: {summary['total_ms']:.1f} ms > {args.budget_ms:.1f} ms")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,129 @@
+"""Compares concurrent-upload throughput of the sync and async receipt pipelines.
+
+Vision and OpenAI are replaced with stubs that only sleep for a fixed latency, so the
+numbers show how many receipts one worker can keep in flight, not real API speed.
+
+Run from the functions folder:
+
+    python -m benchmarks.receipt_pipeline_benchmark --uploads 50 --sync-workers 4
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+# Keep the benchmark away from the real disk caches. The stub images aren't real images,
+# so preprocessing is switched off.
+os.environ.setdefault("CACHE_DIR", os.path.join("/tmp", f"simplitrac-benchmark-{os.getpid()}"))
+os.environ.setdefault("PREPROCESS_ENABLED", "false")
+
+from services import ocr_service
+from services.async_ocr_service import AsyncReceiptPipeline
+from services.clients import client_manager
+
+
+def _vision_response(image_data: bytes):
+    annotation = SimpleNamespace(description=f"STORE {ocr_service.hash_image(image_data)}\nTOTAL 12.34")
+    return SimpleNamespace(text_annotations=[annotation], error=SimpleNamespace(message=""))
+
+
+def _completion():
+    content = json.dumps({"vendor": "store", "created_at": "2024-01-01", "amount": "12.34", "category_name": "Meals"})
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+
+class StubVision:
+    def __init__(self, latency: float):
+        self.latency = latency
+
+    def text_detection(self, image, **kwargs):
+        time.sleep(self.latency)
+        return _vision_response(image.content)
+
+    def batch_annotate_images(self, requests, **kwargs):
+        time.sleep(self.latency)
+        return SimpleNamespace(responses=[_vision_response(r.image.content) for r in requests])
+
+
+class StubOpenAI:
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, model, messages, **kwargs):
+        time.sleep(self.latency)
+        return _completion()
+
+
+class StubAsyncVision:
+    def __init__(self, latency: float):
+        self.latency = latency
+
+    async def batch_annotate_images(self, requests, **kwargs):
+        await asyncio.sleep(self.latency)
+        return SimpleNamespace(responses=[_vision_response(r.image.content) for r in requests])
+
+
+class StubAsyncOpenAI:
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    async def create(self, model, messages, **kwargs):
+        await asyncio.sleep(self.latency)
+        return _completion()
+
+
+def run_sync(images, workers: int) -> float:
+    """Runs the uploads through the sync pipeline, `workers` at a time like gunicorn sync workers."""
+    def handle(image_data):
+        text = ocr_service.extract_text(image_data)
+        return ocr_service.parse_receipt(text)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(handle, images))
+    return time.perf_counter() - start
+
+
+def run_async(images, vision_latency: float, openai_latency: float) -> float:
+    """Runs the uploads through one async pipeline, all in flight at once."""
+    async def main():
+        pipeline = AsyncReceiptPipeline(StubAsyncVision(vision_latency), StubAsyncOpenAI(openai_latency))
+        start = time.perf_counter()
+        results = await pipeline.process_many(images)
+        errors = [r for r in results if isinstance(r, Exception)]
+        if errors:
+            raise errors[0]
+        return time.perf_counter() - start
+
+    return asyncio.run(main())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--uploads", type=int, default=50)
+    parser.add_argument("--sync-workers", type=int, default=4, help="Matches gunicorn -w")
+    parser.add_argument("--vision-latency", type=float, default=0.5)
+    parser.add_argument("--openai-latency", type=float, default=1.5)
+    args = parser.parse_args()
+
+    client_manager.install(StubVision(args.vision_latency), StubOpenAI(args.openai_latency))
+
+    # Distinct images (and so distinct OCR text) for each run, so no upload hits a cache.
+    sync_images = [f"sync-{i}".encode() for i in range(args.uploads)]
+    async_images = [f"async-{i}".encode() for i in range(args.uploads)]
+
+    sync_seconds = run_sync(sync_images, args.sync_workers)
+    async_seconds = run_async(async_images, args.vision_latency, args.openai_latency)
+
+    print(f"{args.uploads} uploads, Vision {args.vision_latency}s, OpenAI {args.openai_latency}s")
+    print(f"sync  ({args.sync_workers} workers): {sync_seconds:7.2f}s  {args.uploads / sync_seconds:7.2f} receipts/s")
+    print(f"async (1 worker):  {async_seconds:7.2f}s  {args.uploads / async_seconds:7.2f} receipts/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,3 @@
-import base64
 import os
 
 from models.transaction import Transaction
@@ -8,13 +7,22 @@ import io
 import json
 import logging
 from firebase_functions import https_fn
-from services.ocr_service import process_receipt_image, extract_text
+from services.ocr_service import parse_receipt, extract_text, hash_image, extract_texts, parse_receipts
+from services.async_ocr_service import run_receipt_pipeline
+from services import receipt_jobs
+from services.resilience import Deadline, DeadlineExceeded, UpstreamUnavailable, RECEIPT_BATCH_DEADLINE_SECONDS
+from services.upload_ingestion import MAX_UPLOAD_BYTES, UploadTooLarge, InvalidUpload, check_content_length, read_file, \
+    decode_base64_stream
 import tempfile
+from urllib.parse import parse_qs
 from functools import wraps
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 
+# Maximum number of files accepted by /process_receipts in one request.
+MAX_BATCH_FILES = int(os.getenv("MAX_BATCH_FILES", "50"))
+
 
 def cors_enabled_function(func):
     """Decorator for enabling Cross-Origin Resource Sharing (CORS) on Firebase HTTP functions.
@@ -50,37 +58,37 @@ def cors_enabled_function(func):
 # @cors_enabled_function
 # @https_fn.on_request()
 def process_receipt(req: https_fn.Request) -> https_fn.Response:
+    """Processes one receipt image.
+
+    With `?mode=job` the receipt is queued instead, and the response is `202` with a
+    `job_id` to poll at `/receipt_jobs/<job_id>`. Otherwise Vision and OpenAI must answer
+    within the request deadline (RECEIPT_DEADLINE_SECONDS) or the response is `504`.
+    """
+    # The deadline covers the whole request, reading the upload included.
+    deadline = Deadline()
     try:
+        image_data, error_response = _read_upload(req)
+        if error_response:
+            return error_response
 
-        # data = req.data
-        #
-        # # Decode the bytes object to string
-        # base64_string = data.decode('utf-8')
-        #
-        # if base64_string.startswith("data:image/png;base64,"):
-        #     base64_string = base64_string[len("data:image/png;base64,"):]
-        #
-        # # Decode the base64 string
-        # image_data = base64.b64decode(base64_string)
-        # print(image_data)
-        #
-        # # base64_string = data.get("imageData")
-        # # image = base64.b64decode(base64_string)
-        # # image_data = image
-        # # print(image_data)
-        if 'file' not in req.files:
-            logging.warning("No file found in request")
-            return https_fn.Response(json.dumps({"error": "Image file is required"}), status=400, content_type='application/json')
-
-        file = req.files['file']
-        if file.filename == '':
-            logging.warning("Empty filename received")
-            return https_fn.Response(json.dumps({"error": "No selected file"}), status=400, content_type='application/json')
-
-        logging.info(f"Received file: {file.filename}")
-
-        # Read the file content
-        image_data = file.read()
+        image_sha256 = hash_image(image_data)
+
+        if _get_query_param(req, 'mode') == 'job':
+            # Hand the work to the job queue and answer right away; the client polls for the result.
+            try:
+                job_id = receipt_jobs.submit_job(image_data, image_sha256, _get_user_id(req))
+            except UploadTooLarge as e:
+                logging.warning(f"Rejected upload: {str(e)}")
+                return https_fn.Response(json.dumps({"error": str(e)}), status=413, content_type='application/json')
+            except Exception as e:
+                logging.error(f"Failed to queue receipt job: {str(e)}", exc_info=True)
+                return https_fn.Response(json.dumps({
+                    "error": "Service unavailable",
+                    "message": "The receipt could not be queued, please try again shortly"
+                }), status=503, content_type='application/json')
+            status_url = f"/receipt_jobs/{job_id}"
+            return https_fn.Response(json.dumps({"job_id": job_id, "status": receipt_jobs.QUEUED, "status_url": status_url}),
+                                     status=202, content_type='application/json', headers={'Location': status_url})
 
         # # Save the image data to a temporary file
         # with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg') as temp_file:
@@ -90,7 +98,7 @@ def process_receipt(req: https_fn.Request) -> https_fn.Response:
         try:
             # Extract text using OCR service
             logging.info("Extracting text from image...")
-            extracted_text = extract_text(image_data)
+            extracted_text = extract_text(image_data, image_sha256, deadline)
 
             if not extracted_text:
                 logging.warning("No text detected in the image")
@@ -100,17 +108,256 @@ def process_receipt(req: https_fn.Request) -> https_fn.Response:
                 }), status=400, content_type='application/json')
             
             logging.info("Parsing extracted text...")
-            parsed_data = process_receipt_image(extracted_text)
-            logging.info(f"Parsed data: {parsed_data}")
+            parsed_data, from_cache = parse_receipt(extracted_text, user_id=_get_user_id(req), deadline=deadline)
+            logging.info(f"Parsed data: {parsed_data} (from cache: {from_cache})")
             
             # Prepare the response data
-            transaction = Transaction(parsed_data)
-            
-            return https_fn.Response(json.dumps(transaction.serialize()), status=200, content_type='application/json')
+            return _transaction_response(parsed_data, from_cache)
+        except DeadlineExceeded as e:
+            logging.error(f"Receipt not processed within {deadline.seconds}s: {str(e)}")
+            return https_fn.Response(json.dumps({
+                "error": "Timed out",
+                "message": "Processing the receipt took too long, please try again"
+            }), status=504, content_type='application/json')
+        except UpstreamUnavailable as e:
+            return _unavailable_response(e)
         except Exception as processing_error:
             logging.error(f"Error processing image: {str(processing_error)}", exc_info=True)
             return https_fn.Response(json.dumps({"error": "Error processing image"}), status=400, content_type='application/json')
 
     except Exception as e:
         logging.error(f"Error in process_receipt: {str(e)}", exc_info=True)
-        return https_fn.Response(json.dumps({"error": str(e)}), status=500, content_type='application/json')
\ No newline at end of file
+        return https_fn.Response(json.dumps({"error": str(e)}), status=500, content_type='application/json')
+
+
+def process_receipt_async(req: https_fn.Request) -> https_fn.Response:
+    """Processes one receipt image through the async pipeline.
+
+    Same contract as `process_receipt`, but the OCR and OpenAI calls run on the worker's
+    shared event loop, so the request thread only waits and many uploads can be in
+    flight at once. Needs a threaded worker (see gunicorn.conf.py).
+
+    Args:
+        req (https_fn.Request): The HTTP request containing the image file.
+
+    Returns:
+        https_fn.Response: The serialized transaction, or an error.
+    """
+    # The deadline covers the whole request, reading the upload included.
+    deadline = Deadline()
+    try:
+        image_data, error_response = _read_upload(req)
+        if error_response:
+            return error_response
+
+        try:
+            extracted_text, parsed_data, from_cache = run_receipt_pipeline(image_data, hash_image(image_data),
+                                                                           _get_user_id(req), deadline)
+            if not extracted_text:
+                logging.warning("No text detected in the image")
+                return https_fn.Response(json.dumps({
+                    "error": "No text detected",
+                    "message": "No text detected in the image, please try again"
+                }), status=400, content_type='application/json')
+
+            return _transaction_response(parsed_data, from_cache)
+        except DeadlineExceeded as e:
+            logging.error(f"Receipt not processed within {deadline.seconds}s: {str(e)}")
+            return https_fn.Response(json.dumps({
+                "error": "Timed out",
+                "message": "Processing the receipt took too long, please try again"
+            }), status=504, content_type='application/json')
+        except UpstreamUnavailable as e:
+            return _unavailable_response(e)
+        except Exception as processing_error:
+            logging.error(f"Error processing image: {str(processing_error)}", exc_info=True)
+            return https_fn.Response(json.dumps({"error": "Error processing image"}), status=400, content_type='application/json')
+
+    except Exception as e:
+        logging.error(f"Error in process_receipt_async: {str(e)}", exc_info=True)
+        return https_fn.Response(json.dumps({"error": str(e)}), status=500, content_type='application/json')
+
+
+def get_receipt_job(job_id: str) -> https_fn.Response:
+    """Gets the status of a receipt job started with `/process_receipt?mode=job`.
+
+    Args:
+        job_id (str): The job id returned when the job was queued.
+
+    Returns:
+        https_fn.Response: The job status. Finished jobs include `result` (the serialized
+            transaction) or `error`.
+    """
+    try:
+        job = receipt_jobs.get_job(job_id)
+    except Exception as e:
+        logging.error(f"Error reading receipt job {job_id}: {str(e)}", exc_info=True)
+        return https_fn.Response(json.dumps({"error": str(e)}), status=500, content_type='application/json')
+
+    if not job:
+        return https_fn.Response(json.dumps({"error": f"Job {job_id} not found"}), status=404, content_type='application/json')
+
+    return https_fn.Response(json.dumps(job, default=str), status=200, content_type='application/json')
+
+
+def process_receipts(req: https_fn.Request) -> https_fn.Response:
+    """Processes many receipt images sent in one multipart request.
+
+    Every file sent under the `file` or `files` field is run through OCR in Vision batches,
+    then parsed concurrently, all within RECEIPT_BATCH_DEADLINE_SECONDS. Files the deadline
+    leaves no time for get a "Timed out" error.
+
+    Args:
+        req (https_fn.Request): The HTTP request containing the image files.
+
+    Returns:
+        https_fn.Response: A JSON list with one entry per file, in the order they were sent:
+            the serialized transaction, or an object with an `error` key.
+    """
+    deadline = Deadline(RECEIPT_BATCH_DEADLINE_SECONDS)
+    try:
+        try:
+            check_content_length(req.content_length, MAX_UPLOAD_BYTES * MAX_BATCH_FILES)
+        except UploadTooLarge as e:
+            return https_fn.Response(json.dumps({"error": str(e)}), status=413, content_type='application/json')
+
+        files = req.files.getlist('files') + req.files.getlist('file')
+        if not files:
+            logging.warning("No files found in request")
+            return https_fn.Response(json.dumps({"error": "At least one image file is required"}), status=400, content_type='application/json')
+
+        if len(files) > MAX_BATCH_FILES:
+            return https_fn.Response(json.dumps({"error": f"At most {MAX_BATCH_FILES} files can be sent at once"}), status=413, content_type='application/json')
+
+        logging.info(f"Received {len(files)} files")
+
+        results = [None] * len(files)
+        images = []
+        image_hashes = []
+        positions = []
+        for i, file in enumerate(files):
+            if file.filename == '':
+                results[i] = {"error": "No selected file", "filename": file.filename}
+                continue
+            try:
+                image_data = read_file(file.stream)
+            except UploadTooLarge as e:
+                results[i] = {"error": str(e), "filename": file.filename}
+                continue
+            images.append(image_data)
+            image_hashes.append(hash_image(image_data))
+            positions.append(i)
+
+        texts = extract_texts(images, image_hashes, deadline)
+
+        to_parse = []
+        for i, text in zip(positions, texts):
+            if isinstance(text, DeadlineExceeded):
+                results[i] = {"error": "Timed out", "filename": files[i].filename}
+            elif isinstance(text, Exception):
+                logging.error(f"Error extracting text from {files[i].filename}: {str(text)}")
+                results[i] = {"error": "Error processing image", "filename": files[i].filename}
+            elif not text:
+                results[i] = {"error": "No text detected", "filename": files[i].filename}
+            else:
+                to_parse.append((i, text))
+
+        parsed = parse_receipts([text for _, text in to_parse], user_id=_get_user_id(req), deadline=deadline)
+
+        for (i, _), outcome in zip(to_parse, parsed):
+            if isinstance(outcome, DeadlineExceeded):
+                results[i] = {"error": "Timed out", "filename": files[i].filename}
+                continue
+            if isinstance(outcome, Exception):
+                logging.error(f"Error parsing {files[i].filename}: {str(outcome)}")
+                results[i] = {"error": "Error processing image", "filename": files[i].filename}
+                continue
+            parsed_data, from_cache = outcome
+            try:
+                response_data = Transaction(parsed_data).serialize()
+            except Exception as e:
+                logging.error(f"Error building transaction for {files[i].filename}: {str(e)}")
+                results[i] = {"error": "Error processing image", "filename": files[i].filename}
+                continue
+            response_data['parsed_from_cache'] = from_cache
+            response_data['filename'] = files[i].filename
+            results[i] = response_data
+
+        return https_fn.Response(json.dumps(results), status=200, content_type='application/json')
+
+    except Exception as e:
+        logging.error(f"Error in process_receipts: {str(e)}", exc_info=True)
+        return https_fn.Response(json.dumps({"error": str(e)}), status=500, content_type='application/json')
+
+
+def _read_upload(req: https_fn.Request):
+    """Reads the receipt image from a request without unbounded buffering.
+
+    The image can be sent as the `file` field of a multipart form, or as the whole body
+    in base64, optionally as a `data:image/...;base64,` URL. Oversized bodies are rejected
+    from their Content-Length before anything is read.
+
+    Returns:
+        Tuple: The image as a memoryview and None, or None and the error response to send back.
+    """
+    content_type = req.headers.get('Content-Type', '')
+    is_multipart = content_type.startswith('multipart/form-data')
+    try:
+        check_content_length(req.content_length, base64_body=not is_multipart)
+
+        if not is_multipart:
+            if not req.content_length and not req.headers.get('Transfer-Encoding'):
+                logging.warning("No file found in request")
+                return None, https_fn.Response(json.dumps({"error": "Image file is required"}), status=400, content_type='application/json')
+            image_data = decode_base64_stream(req.stream, size_hint=req.content_length)
+        else:
+            if 'file' not in req.files:
+                logging.warning("No file found in request")
+                return None, https_fn.Response(json.dumps({"error": "Image file is required"}), status=400, content_type='application/json')
+
+            file = req.files['file']
+            if file.filename == '':
+                logging.warning("Empty filename received")
+                return None, https_fn.Response(json.dumps({"error": "No selected file"}), status=400, content_type='application/json')
+
+            logging.info(f"Received file: {file.filename}")
+            image_data = read_file(file.stream)
+
+    except UploadTooLarge as e:
+        logging.warning(f"Rejected upload: {str(e)}")
+        return None, https_fn.Response(json.dumps({"error": str(e)}), status=413, content_type='application/json')
+    except InvalidUpload as e:
+        logging.warning(f"Rejected upload: {str(e)}")
+        return None, https_fn.Response(json.dumps({"error": str(e)}), status=400, content_type='application/json')
+
+    if not len(image_data):
+        return None, https_fn.Response(json.dumps({"error": "Image file is required"}), status=400, content_type='application/json')
+
+    return image_data, None
+
+
+def _get_user_id(req: https_fn.Request):
+    """Gets the optional `user_id` query parameter used to pick the user's own categories."""
+    return _get_query_param(req, 'user_id')
+
+
+def _get_query_param(req: https_fn.Request, name: str):
+    return parse_qs(req.query_string.decode()).get(name, [None])[0]
+
+
+def _unavailable_response(error: UpstreamUnavailable) -> https_fn.Response:
+    """Builds the fast-fail response for when Vision or OpenAI is known to be down or saturated."""
+    logging.warning(f"Receipt rejected without calling upstream: {str(error)}")
+    return https_fn.Response(json.dumps({
+        "error": "Service unavailable",
+        "message": "Receipt scanning is temporarily unavailable, please try again shortly"
+    }), status=503, content_type='application/json', headers={'Retry-After': str(int(error.retry_after + 0.5))})
+
+
+def _transaction_response(parsed_data, from_cache: bool) -> https_fn.Response:
+    """Builds the response for a parsed receipt."""
+    transaction = Transaction(parsed_data)
+    response_data = transaction.serialize()
+    response_data['parsed_from_cache'] = from_cache
+
+    return https_fn.Response(json.dumps(response_data), status=200, content_type='application/json')
@@ -1,12 +1,17 @@
 from firebase_functions import https_fn
 from models import user
-from models.transaction import Transaction
+from models.transaction import Transaction, PUBLIC_TRANSACTION_FIELDS
 from services import users_service
 from models.response import Response
 from urllib.parse import parse_qs
 from typing import Union
+import hashlib
 import json
 from functools import wraps
+
+# Query parameters of /user/transactions that filter the results.
+TRANSACTION_FILTERS = ['created_from', 'created_to', 'category', 'vendor', 'min_amount', 'max_amount']
+
 #
 #
 # def cors_enabled_function(func):
@@ -104,20 +109,41 @@ def create_new_user(req: https_fn.Request) -> https_fn.Response:
 def get_existing_user(req: https_fn.Request) -> https_fn.Response:
     """Retrieves an existing user from the database.
 
+    Only the transaction fields returned to clients are read from Firestore. An optional
+    `transaction_fields` query parameter (comma separated) narrows them further.
+
+    The response has an ETag built from the user's version. A request whose If-None-Match
+    has the current ETag gets a 304 before the user is loaded.
+
     Args:
         req (https_fn.Request): The HTTP request object containing the `user_id` in the query string.
 
     Returns:
-        https_fn.Response: An HTTP response containing the serialized user data or an error message
-                           if the user is not found.
+        https_fn.Response: An HTTP response containing the serialized user data, 304 if it didn't
+                           change, or an error message if the user is not found.
     """
-    user_id = parse_qs(req.query_string.decode()).get('user_id', [None])[0]
+    query = parse_qs(req.query_string.decode())
+    user_id = query.get('user_id', [None])[0]
 
     if not user_id:
         return generate_http_response('user_id parameter is required', 400)
+
+    transaction_fields = PUBLIC_TRANSACTION_FIELDS
+    if query.get('transaction_fields'):
+        requested = query['transaction_fields'][0].split(',')
+        transaction_fields = [f for f in PUBLIC_TRANSACTION_FIELDS if f in requested]
+        if not transaction_fields:
+            return generate_http_response(f"transaction_fields must be some of {', '.join(PUBLIC_TRANSACTION_FIELDS)}", 400)
     
+    if_none_match = req.headers.get('If-None-Match')
     try:
-        user_instance = user.User(user_id)
+        if if_none_match:
+            # Only the version is read, so an unchanged user costs one small read or none.
+            version = users_service.get_user_version(user_id)
+            if version is not None and _etag_matches(if_none_match, user_etag(version, transaction_fields)):
+                return https_fn.Response(status=304, headers={'ETag': user_etag(version, transaction_fields)})
+
+        user_instance = user.User(user_id, transaction_fields=transaction_fields)
 
     except Exception as e:  # Catch general exceptions for get_existing_user and User creation
         return generate_http_response(str(e), 500)  # 500 Internal Server Error if unexpected
@@ -126,10 +152,115 @@ def get_existing_user(req: https_fn.Request) -> https_fn.Response:
         return generate_http_response(f"User {user_id} not found", 400)
 
     # return https_fn.Response(f"{user_instance.create_json_string(True)}", 200)
-    return https_fn.Response(json.dumps(user_instance.serialize(True)), 200)
+    # update_time lets the client make a conditional PATCH based on what it read.
+    return https_fn.Response(json.dumps({**user_instance.serialize(True), 'update_time': user_instance.update_time}), 200,
+                             headers={'ETag': user_etag(user_instance.version, transaction_fields)})
+
+
+def user_etag(version: int, transaction_fields: list) -> str:
+    """Builds the ETag of a /user/get response from the user's version and the fields it returns.
+
+    Args:
+        version (int): The user's version.
+        transaction_fields (list): The transaction fields in the response.
+
+    Returns:
+        str: The quoted ETag.
+    """
+    fields = hashlib.sha1(','.join(transaction_fields).encode()).hexdigest()[:8]
+    return f'"{version}-{fields}"'
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    # If-None-Match may list several tags, or weak ones, and "*" matches any.
+    tags = [tag.strip() for tag in if_none_match.split(',')]
+    return '*' in tags or etag in [tag[2:] if tag.startswith('W/') else tag for tag in tags]
         
 
 
+# @cors_enabled_function
+# @https_fn.on_request()
+def get_transactions(req: https_fn.Request) -> https_fn.Response:
+    """Retrieves one page of a user's transactions, newest first, or biggest first when
+    `min_amount` or `max_amount` is given.
+
+    The query string takes `user_id`, the optional filters `created_from`, `created_to`,
+    `category`, `vendor`, `min_amount` and `max_amount`, plus `page_size` and the
+    `page_token` returned with the previous page.
+
+    Args:
+        req (https_fn.Request): The HTTP request object.
+
+    Returns:
+        https_fn.Response: An HTTP response containing `transactions` and `next_page_token`,
+                           or an error message if a parameter is invalid.
+    """
+    query = parse_qs(req.query_string.decode())
+    user_id = query.get('user_id', [None])[0]
+
+    if not user_id:
+        return generate_http_response('user_id parameter is required', 400)
+
+    filters = {name: query[name][0] for name in TRANSACTION_FILTERS if query.get(name)}
+    try:
+        page_size = int(query['page_size'][0]) if query.get('page_size') else None
+    except ValueError:
+        return generate_http_response('page_size must be a number', 400)
+
+    try:
+        result = users_service.list_transactions(user_id, filters, page_size, query.get('page_token', [None])[0])
+    except Exception as e:
+        return generate_http_response(str(e), 500)
+
+    if not result.is_successful():
+        return generate_http_response(result.get_errors(), 400)
+    return https_fn.Response(json.dumps(result.get_payload()), 200)
+
+
+# @cors_enabled_function
+# @https_fn.on_request()
+def patch_user(req: https_fn.Request) -> https_fn.Response:
+    """Changes some fields of a user without reading it.
+
+    The JSON body holds only the fields to change. An `update_time` from a previous read
+    or patch in the body makes the write fail with 412 if the user changed since then.
+
+    Args:
+        req (https_fn.Request): The HTTP request object containing `user_id` in the query string.
+
+    Returns:
+        https_fn.Response: An HTTP response with the changed fields and the new `update_time`,
+                           404 if the user doesn't exist or 412 if it changed.
+    """
+    try:
+        data = req.get_json()
+        if not data or not isinstance(data, dict):
+            return generate_http_response('Request body must contain valid JSON data', 400)
+    except Exception as e:
+        return generate_http_response(f'Invalid JSON: {e}', 400)
+
+    user_id = parse_qs(req.query_string.decode()).get('user_id', [None])[0]
+    if not user_id:
+        return generate_http_response('user_id parameter is required', 400)
+    if data.get('user_id', user_id) != user_id:
+        return generate_http_response("user_id in query and body do not match", 400)
+
+    update_time = data.get('update_time')
+    changes = {k: v for k, v in data.items() if k not in ('user_id', 'update_time')}
+    try:
+        patch_result = users_service.patch_user(user_id, changes, update_time)
+    except user.UserNotFound as e:
+        return generate_http_response(str(e), 404)
+    except user.UserUpdateConflict as e:
+        return generate_http_response(str(e), 412)
+    except Exception as e:
+        return generate_http_response(str(e), 500)
+
+    if patch_result.is_successful():
+        return https_fn.Response(json.dumps(patch_result.get_payload()), 200)
+    return generate_http_response(patch_result.get_errors(), 400)
+
+
 # @cors_enabled_function
 # @https_fn.on_request()
 def update_user(req: https_fn.Request) -> https_fn.Response:
@@ -165,9 +296,11 @@ def update_user(req: https_fn.Request) -> https_fn.Response:
         return generate_http_response(f'Invalid user_id: {e}', 400)
 
     try:
-        user_dict = user.User(user_id).serialize(True)
-        user_dict.update(data)  # Update the dictionary
-        user_instance = user.User(user_dict)
+        # Apply the edit onto the loaded user so only what changed is written back. Profile
+        # edits read only the user document; transactions and categories are read when edited.
+        user_instance = user.User(user_id, lazy=True)
+        if user_instance.user_id == user_id:
+            user_instance.apply_changes(data)
 
     except Exception as e:  # Catch general exceptions for get_existing_user and User creation
         return generate_http_response(str(e), 500)  # 500 Internal Server Error if unexpected
@@ -195,15 +328,19 @@ def delete_transactions(req: https_fn.Request) -> https_fn.Response:
     """
     Deletes transactions from the database.
 
+    The JSON body has the `user_id` and one of:
+        - `transaction_ids`: the transactions to delete.
+        - `filters`: `created_from`, `created_to`, `category`, `vendor`, `min_amount` or
+          `max_amount` of the transactions to delete.
+        - `transactions`: the user's transactions to keep; every other one is deleted.
+
     Args:
-        req (https_fn.Request): The HTTP request object containing the `user_id` in the query string.
+        req (https_fn.Request): The HTTP request object.
 
     Returns:
-        https_fn.Response: An HTTP response indicating success or failure of the deletion.
+        https_fn.Response: An HTTP response with the `deleted_transaction_ids`, or an error message.
     """
     data = None
-    access_token = None
-    user_instance = user.User()
     try:
         data = req.get_json()
         if not data:  # Check for empty JSON
@@ -211,19 +348,23 @@ def delete_transactions(req: https_fn.Request) -> https_fn.Response:
     except Exception as e:  # Catch specific JSON decoding errors
         return generate_http_response(f'Invalid JSON: {e}', 400)
 
-    try:
-        user_instance = user.User(data)
-
-    except Exception as e:  # Catch general exceptions for get_existing_user and User creation
-        return generate_http_response(str(e), 500)  # 500 Internal Server Error if unexpected
-
-    if not user_instance.user_id:  # Check if user found in database
-        return generate_http_response(f"User {user_id} not found.", 400)
+    user_id = data.get('user_id')
+    if not user_id:
+        return generate_http_response('user_id is required', 400)
 
-    if user_instance:
-        access_token = user_instance.access_token
+    transaction_ids = data.get('transaction_ids')
+    if transaction_ids is not None and not isinstance(transaction_ids, list):
+        return generate_http_response('transaction_ids must be a list', 400)
+    filters = data.get('filters')
+    if filters is not None:
+        if not isinstance(filters, dict) or set(filters) - set(TRANSACTION_FILTERS):
+            return generate_http_response(f"filters must be some of {', '.join(TRANSACTION_FILTERS)}", 400)
 
-    edit_result = users_service.delete_transactions(user_instance)
+    try:
+        keep = user.User(data) if transaction_ids is None and filters is None else None
+        edit_result = users_service.delete_transactions(user_id, transaction_ids, filters, keep)
+    except Exception as e:  # Catch general exceptions for User creation and Firestore errors
+        return generate_http_response(str(e), 500)  # 500 Internal Server Error if unexpected
 
     if edit_result.is_successful():
         return https_fn.Response(json.dumps(edit_result.get_payload()), 200)
@@ -235,13 +376,14 @@ def delete_transactions(req: https_fn.Request) -> https_fn.Response:
 # @https_fn.on_request()
 def delete_category(req: https_fn.Request) -> https_fn.Response:
     """
-    Deletes transactions from the database.
+    Deletes a category from the database.
 
     Args:
-        req (https_fn.Request): The HTTP request object containing the `user_id` and `category_id` in the query string.
+        req (https_fn.Request): The HTTP request object containing the `user_id` and `category_id` in the JSON body.
 
     Returns:
-        https_fn.Response: An HTTP response indicating success or failure of the deletion.
+        https_fn.Response: `{"deleted_category_id": ...}` on success. This endpoint used to
+            answer with the whole serialized user; clients that need it should re-fetch the user.
     """
     data = None
     try:
@@ -254,7 +396,7 @@ def delete_category(req: https_fn.Request) -> https_fn.Response:
     delete_result = users_service.delete_category(dict(data))
 
     if delete_result.is_successful():
-        return https_fn.Response(json.dumps(delete_result.get_payload().serialize(True)), 200)
+        return https_fn.Response(json.dumps(delete_result.get_payload()), 200)
     else:
         return generate_http_response(delete_result.get_errors(), 400)
 
@@ -265,6 +407,9 @@ def delete_category(req: https_fn.Request) -> https_fn.Response:
 def delete_user(req: https_fn.Request) -> https_fn.Response:
     """Deletes a user from the database.
 
+    With `background=true` in the query string the deletion runs as a job and the response
+    is a 202 with the `job_id` to poll at `/user/delete_jobs/<job_id>`.
+
     Args:
         req (https_fn.Request): The HTTP request object containing the `user_id` in the query string.
 
@@ -272,13 +417,20 @@ def delete_user(req: https_fn.Request) -> https_fn.Response:
         https_fn.Response: An HTTP response indicating success or failure of the deletion.
     """
     try:
-        user_id = parse_qs(req.query_string.decode()).get('user_id', [None])[0]
+        query = parse_qs(req.query_string.decode())
+        user_id = query.get('user_id', [None])[0]
         if not user_id:  # Explicitly check for missing user_id
             return generate_http_response('user_id parameter is required', 400)
 
     except ValueError as e:
         return generate_http_response(f'Invalid user_id: {e}', 400)
 
+    if query.get('background', [''])[0].lower() in ('1', 'true', 'yes'):
+        job_result = users_service.delete_user_in_background(user_id)
+        if not job_result.is_successful():
+            return generate_http_response(job_result.get_errors(), 400)
+        return https_fn.Response(json.dumps(job_result.get_payload()), 202)
+
     get_result = users_service.delete_user(user_id)
     
     if get_result.is_successful():
@@ -287,6 +439,27 @@ def delete_user(req: https_fn.Request) -> https_fn.Response:
         return generate_http_response(get_result.get_errors(), 400)
 
 
+def get_deletion_job(job_id: str) -> https_fn.Response:
+    """Gets the progress of a user deletion started with `/user/delete?background=true`.
+
+    A job whose worker died is resumed when it is polled.
+
+    Args:
+        job_id (str): The job id returned when the deletion was started.
+
+    Returns:
+        https_fn.Response: The job status with the number of documents `deleted` so far.
+    """
+    try:
+        job = users_service.get_deletion_job(job_id)
+    except Exception as e:
+        return generate_http_response(str(e), 500)
+
+    if not job:
+        return generate_http_response(f"Job {job_id} not found", 404)
+    return https_fn.Response(json.dumps(job, default=str), 200)
+
+
 def generate_http_response(message: Union[str, list], code: int) -> https_fn.Response:
     """Generates an HTTP response with a JSON-formatted error message.
 
@@ -1,5 +1,9 @@
 import base64
 
+# Multiple of 3 so every chunk encodes to base64 without padding in the middle.
+CHUNK_SIZE = 3 * 64 * 1024
+
+
 def convert_image_to_base64(image_path):
     with open(image_path, "rb") as image_file:
         base64_string = base64.b64encode(image_file.read()).decode('utf-8')
@@ -9,11 +13,17 @@ def save_base64_to_file(base64_string, output_path):
     with open(output_path, "w") as output_file:
         output_file.write(base64_string)
 
+def save_image_as_base64(image_path, output_path, data_url_prefix=""):
+    """Streams an image into a base64 file chunk by chunk, never holding the whole string."""
+    with open(image_path, "rb") as image_file, open(output_path, "wb") as output_file:
+        output_file.write(data_url_prefix.encode('utf-8'))
+        while chunk := image_file.read(CHUNK_SIZE):
+            output_file.write(base64.b64encode(chunk))
+
 if __name__ == "__main__":
     image_path = "/Users/eddiaz/Desktop/SimpliTrac/functions/services/R3.jpg"
     output_path = "/Users/eddiaz/Desktop/SimpliTrac/functions/services/R3_base64.txt"
     
-    base64_image = convert_image_to_base64(image_path)
-    save_base64_to_file(base64_image, output_path)
+    save_image_as_base64(image_path, output_path)
     
     print(f"Base64 string saved to {output_path}")
@@ -0,0 +1,26 @@
+# Gunicorn settings for the Flask app in app.py.
+# Run with: gunicorn -c gunicorn.conf.py app:app
+import os
+
+# Threaded workers let /process_receipt_async park many requests on the worker's
+# pipeline event loop instead of holding one process per in-flight receipt.
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS", "32"))
+
+
+def post_fork(server, worker):
+    """Builds the Firestore and OCR pipeline clients in each worker before it accepts requests."""
+    from models.database import get_db
+    from services import image_preprocessing
+    from services.clients import client_manager
+
+    # Starts the pool processes now rather than on the first upload. They come from the
+    # forkserver, so they never inherit this worker's threads or gRPC channels.
+    image_preprocessing.start_pool()
+
+    try:
+        get_db()
+    except Exception as e:
+        server.log.warning(f"Firestore warm up failed: {str(e)}")
+    client_manager.warm_up()
+    server.log.info(f"Warmed up clients in worker {worker.pid}")
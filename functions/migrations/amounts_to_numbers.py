@@ -0,0 +1,81 @@
+"""Rewrites transaction amounts stored as strings, e.g. "12.50", as numbers.
+
+Receipts used to be saved with the amount as OpenAI or the local parser returned it, a
+string. Firestore compares values of different types by type before value, so those
+transactions are left out of min_amount and max_amount filters and sort apart from the
+numeric ones. New transactions are always stored as numbers.
+
+Pages through every transactions subcollection by document id, reading the amount only,
+and can be stopped and run again. Amounts that aren't numbers at all are removed.
+
+Run from the functions folder:
+
+    python -m migrations.amounts_to_numbers --dry-run
+"""
+import argparse
+import logging
+import sys
+from typing import Set
+
+from models.database import db, commit_in_batches
+from models.transaction import Transaction, to_amount
+from models.user import record_user_write
+
+
+def migrate(page_size: int = 500, dry_run: bool = False) -> int:
+    """
+    Rewrites every string amount as a number.
+
+    Args:
+        page_size (int): The transactions read and written per page.
+        dry_run (bool): Only count the transactions that would change.
+
+    Returns:
+        int: The transactions that were (or would be) changed.
+    """
+    from google.cloud.firestore_v1 import DELETE_FIELD
+    from google.cloud.firestore_v1.field_path import FieldPath
+
+    query = (db.collection_group(Transaction.class_name).select(['amount'])
+             .order_by(FieldPath.document_id()).limit(page_size))
+    changed = 0
+    users: Set[str] = set()
+    last = None
+    while True:
+        docs = list((query.start_after(last) if last else query).stream())
+        writes = []
+        for doc in docs:
+            amount = (doc.to_dict() or {}).get('amount')
+            if isinstance(amount, str):
+                number = to_amount(amount)
+                writes.append((doc.reference, {'amount': number if number is not None else DELETE_FIELD}, True))
+                # transactions live at Users/{user_id}/transactions/{transaction_id}.
+                users.add(doc.reference.parent.parent.id)
+        changed += len(writes)
+        if writes and not dry_run:
+            for paths, error in commit_in_batches(writes):
+                logging.error(f"Failed to migrate {len(paths)} amounts: {str(error)}")
+        if len(docs) < page_size:
+            break
+        last = docs[-1]
+
+    if not dry_run:
+        # Changes what /user/get returns, so clients must not be told it is unchanged.
+        for user_id in users:
+            record_user_write(user_id)
+    return changed
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--page-size", type=int, default=500)
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    changed = migrate(args.page_size, args.dry_run)
+    print(f"{'Would change' if args.dry_run else 'Changed'} {changed} transaction amounts")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,7 +1,31 @@
+from functools import lru_cache
 from typing import Optional, Dict, Any
 import uuid
 from protocols.category_protocol import CategoryProtocol
 
+# Namespace for category ids derived from their names.
+CATEGORY_NAMESPACE = uuid.uuid5(uuid.NAMESPACE_DNS, "categories.simplitracapp")
+
+
+def normalize_category_name(name: str) -> str:
+    """Normalizes a category name the way Category stores it."""
+    return " ".join(name.split()).lower()
+
+
+@lru_cache(maxsize=4096)
+def category_id_for_name(name: str) -> str:
+    """
+    Gets the id for a category name: a uuid5 of the normalized name, so the same name
+    always gets the same id without looking anything up.
+
+    Args:
+        name (str): The category name.
+
+    Returns:
+        str: The category id.
+    """
+    return str(uuid.uuid5(CATEGORY_NAMESPACE, normalize_category_name(name)))
+
 
 class Category(CategoryProtocol):
     """
@@ -24,6 +48,8 @@ class Category(CategoryProtocol):
         Args:
             data (Optional[Dict[str, Any]]): The data to initialize the category, typically from a dictionary.
         """
+        # What Firestore holds for this category, or None if it was never saved.
+        self._persisted: Optional[Dict[str, Any]] = None
         if data:
             self._category_id = data.get('category_id')
             self._category_name = data.get('category_name').strip().replace("  ", " ").lower() if data.get('category_name') else None
@@ -68,8 +94,34 @@ class Category(CategoryProtocol):
         """
         self._category_name = value.strip().replace("  ", " ").lower()
 
+    def mark_persisted(self) -> None:
+        """
+        Records the current values as what Firestore holds, e.g. after loading or saving.
+        """
+        self._persisted = self.serialize()
+
+    @property
+    def is_new(self) -> bool:
+        """Checks whether the category was never loaded from or saved to Firestore."""
+        return self._persisted is None
+
+    def changed_fields(self) -> Dict[str, Any]:
+        """
+        Gets the fields that differ from what Firestore holds.
+
+        Returns:
+            Dict[str, Any]: The changed fields and their new values; every field for a new category.
+        """
+        current = self.serialize()
+        if self._persisted is None:
+            return current
+        return {k: v for k, v in current.items() if self._persisted.get(k) != v}
+
     def serialize(self) -> dict:
+        # Assign the id once so every later save writes the same document.
+        if not self._category_id:
+            self._category_id = category_id_for_name(self._category_name) if self._category_name else str(uuid.uuid4())
         return {
-                    'category_id': str(self.category_id) if self.category_id else str(uuid.uuid4()),
+                    'category_id': str(self.category_id),
                     'category_name': self.category_name.strip().replace("  ", " ").lower() if self._category_name else None
                 }
\ No newline at end of file
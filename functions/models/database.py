@@ -0,0 +1,246 @@
+import json
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# Load environment variables
+from dotenv import load_dotenv
+env_path = os.path.join(os.path.dirname(__file__), '../.env')
+load_dotenv(env_path)
+
+# Firestore rejects batches with more than 500 writes.
+FIRESTORE_BATCH_LIMIT = 500
+# Batches of one save that are committed at the same time, and reads of one load that
+# run at the same time.
+FIRESTORE_BATCH_WORKERS = int(os.getenv("FIRESTORE_BATCH_WORKERS", "8"))
+
+# Documents listed per page when deleting a document tree, and the most deletes per
+# second BulkWriter ramps up to.
+FIRESTORE_DELETE_PAGE_SIZE = int(os.getenv("FIRESTORE_DELETE_PAGE_SIZE", "500"))
+FIRESTORE_DELETE_MAX_OPS = int(os.getenv("FIRESTORE_DELETE_MAX_OPS", "2000"))
+# Attempts per delete before it is reported as failed.
+FIRESTORE_DELETE_MAX_ATTEMPTS = int(os.getenv("FIRESTORE_DELETE_MAX_ATTEMPTS", "5"))
+
+_lock = threading.Lock()
+_app = None
+_db = None
+_db_pid = None
+
+
+def get_app():
+    """
+    Initializes the Firebase app from the SECRET_KEY_FOR_FIREBASE service account on first use.
+
+    Importing firebase_admin and parsing the secret are deferred to here so that importing
+    the models costs nothing until the first request that needs Firebase.
+
+    Returns:
+        firebase_admin.App: The default Firebase app.
+    """
+    global _app
+    with _lock:
+        if _app is None:
+            import firebase_admin
+            from firebase_admin import credentials
+
+            firebase_service_account = os.getenv('SECRET_KEY_FOR_FIREBASE')
+            firebase_config = json.loads(firebase_service_account)
+            cred = credentials.Certificate(firebase_config)
+            _app = firebase_admin.initialize_app(cred)
+        return _app
+
+
+def get_db():
+    """
+    Gets the Firestore client, creating it in this process on first use.
+
+    gRPC channels don't survive a fork, so a worker never reuses a client created by the
+    process it was forked from.
+
+    Returns:
+        google.cloud.firestore.Client: The Firestore client.
+    """
+    global _db, _db_pid
+    if _db is not None and _db_pid == os.getpid():
+        return _db
+    app = get_app()
+    with _lock:
+        if _db is None or _db_pid != os.getpid():
+            from firebase_admin import firestore
+            _db = firestore.client(app)
+            _db_pid = os.getpid()
+        return _db
+
+
+class _LazyFirestore:
+    """
+    Stands in for the Firestore client and creates it on first attribute access, so
+    existing `db.collection(...)` call sites stay unchanged.
+    """
+
+    def __getattr__(self, name):
+        return getattr(get_db(), name)
+
+
+db = _LazyFirestore()
+
+
+_batch_pool = None
+_batch_pool_pid = None
+
+
+def _get_pool() -> ThreadPoolExecutor:
+    global _batch_pool, _batch_pool_pid
+    with _lock:
+        if _batch_pool is None or _batch_pool_pid != os.getpid():
+            _batch_pool = ThreadPoolExecutor(max_workers=FIRESTORE_BATCH_WORKERS, thread_name_prefix="firestore")
+            _batch_pool_pid = os.getpid()
+        return _batch_pool
+
+
+def run_in_parallel(*calls: Callable[[], Any]) -> List[Any]:
+    """
+    Runs independent Firestore calls at the same time, the last one on the calling thread.
+
+    Args:
+        *calls (Callable[[], Any]): The calls to make.
+
+    Returns:
+        List[Any]: What each call returned, in order.
+
+    Raises:
+        Exception: An error raised by any of the calls.
+    """
+    futures = [_get_pool().submit(call) for call in calls[:-1]]
+    last = calls[-1]() if calls else None
+    results = [future.result() for future in futures]
+    return results + [last] if calls else []
+
+
+def _commit_batch(writes: List[Tuple[Any, Optional[Dict[str, Any]], bool]]) -> Optional[Exception]:
+    """Commits one WriteBatch and returns its error, if any. Writes without data are deletes."""
+    try:
+        batch = get_db().batch()
+        for doc_ref, data, merge in writes:
+            if data is None:
+                batch.delete(doc_ref)
+            else:
+                batch.set(doc_ref, data, merge=merge)
+        batch.commit()
+    except Exception as e:
+        return e
+    return None
+
+
+def commit_in_batches(writes: List[Tuple[Any, Optional[Dict[str, Any]], bool]],
+                      batch_size: int = FIRESTORE_BATCH_LIMIT) -> List[Tuple[List[str], Exception]]:
+    """
+    Sets many documents with as few round trips as possible.
+
+    The writes are split into WriteBatches of at most `batch_size` documents, which are
+    committed in parallel. Each batch is atomic: either all of its documents are written
+    or none are.
+
+    Args:
+        writes (List[Tuple[Any, Optional[Dict[str, Any]], bool]]): (DocumentReference, data, merge)
+            to set. With merge only the given fields are written; without data the document is deleted.
+        batch_size (int): The most writes per batch.
+
+    Returns:
+        List[Tuple[List[str], Exception]]: The document paths and error of every batch
+            that failed. Empty if everything was written.
+    """
+    chunks = [writes[i:i + batch_size] for i in range(0, len(writes), batch_size)]
+    if not chunks:
+        return []
+
+    if len(chunks) == 1:
+        outcomes = [_commit_batch(chunks[0])]
+    else:
+        outcomes = list(_get_pool().map(_commit_batch, chunks))
+
+    failures = []
+    for chunk, error in zip(chunks, outcomes):
+        if error is not None:
+            logging.error(f"Firestore batch of {len(chunk)} writes failed: {str(error)}")
+            failures.append(([doc_ref.path for doc_ref, _, _ in chunk], error))
+    return failures
+
+
+def delete_in_batches(doc_refs: List[Any]) -> List[Tuple[List[str], Exception]]:
+    """
+    Deletes documents, without their subcollections, in parallel atomic batches.
+
+    Args:
+        doc_refs (List[Any]): The DocumentReferences to delete.
+
+    Returns:
+        List[Tuple[List[str], Exception]]: The document paths and error of every batch
+            that failed. Empty if everything was deleted.
+    """
+    return commit_in_batches([(doc_ref, None, False) for doc_ref in doc_refs])
+
+
+def delete_recursively(doc_ref, page_size: int = FIRESTORE_DELETE_PAGE_SIZE,
+                       on_page: Optional[Callable[[int], None]] = None) -> Tuple[int, List[str]]:
+    """
+    Deletes a document and every document under it.
+
+    Each subcollection is listed page by page with one query over all of its descendants,
+    reading ids only, and every page is deleted through a BulkWriter, which sends the
+    deletes in parallel batches and backs off when Firestore pushes back. The document
+    itself goes last, so a deletion that stops halfway can be run again and only deletes
+    what is left.
+
+    Args:
+        doc_ref: The DocumentReference to delete.
+        page_size (int): The documents listed and deleted per page.
+        on_page (Optional[Callable[[int], None]]): Called after each page is committed with
+            the number of documents of that page that were deleted.
+
+    Returns:
+        Tuple[int, List[str]]: How many documents were deleted, and the paths of the ones
+            that could not be. The document itself is kept if anything under it failed.
+    """
+    from google.cloud.firestore_v1.field_path import FieldPath
+    from google.cloud.firestore_v1.bulk_writer import BulkWriterOptions, SendMode
+
+    writer = get_db().bulk_writer(options=BulkWriterOptions(mode=SendMode.parallel,
+                                                            max_ops_per_second=FIRESTORE_DELETE_MAX_OPS))
+    failed: List[str] = []
+
+    def on_error(error, _writer) -> bool:
+        if error.attempts < FIRESTORE_DELETE_MAX_ATTEMPTS:
+            return True
+        failed.append(error.operation.reference.path)
+        return False
+
+    writer.on_write_error(on_error)
+    deleted = 0
+    for collection in doc_ref.collections():
+        query = (collection.recursive().select([FieldPath.document_id()])
+                 .order_by(FieldPath.document_id()).limit(page_size))
+        last = None
+        while True:
+            docs = list((query.start_after(last) if last else query).stream())
+            failed_before = len(failed)
+            for doc in docs:
+                writer.delete(doc.reference)
+            # flush returns once every delete of the page, retries included, is done.
+            writer.flush()
+            deleted += len(docs)
+            if on_page and docs:
+                on_page(len(docs) - (len(failed) - failed_before))
+            if len(docs) < page_size:
+                break
+            last = docs[-1]
+
+    if not failed:
+        writer.delete(doc_ref)
+        deleted += 1
+    writer.close()
+    if failed:
+        logging.error(f"Failed to delete {len(failed)} documents under {doc_ref.path}")
+    return deleted - len(failed), failed
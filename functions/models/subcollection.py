@@ -0,0 +1,154 @@
+from collections.abc import MutableSequence
+from typing import Any, Iterator, List, Optional
+
+
+class LazySubcollection(MutableSequence):
+    """
+    A list of Transaction or Category objects that reads its subcollection from Firestore
+    the first time it is used.
+
+    Records appended before the first read are kept as pending and merged in when the
+    subcollection is read, so a lazily loaded user can gain records without reading the
+    ones it already has.
+    """
+
+    def __init__(self, collection_ref, model: type, id_field: str, fields: Optional[List[str]] = None,
+                 limit: Optional[int] = None, order_by: str = 'created_at'):
+        """
+        Initializes the proxy without reading anything.
+
+        Args:
+            collection_ref: The subcollection to read.
+            model (type): Transaction or Category.
+            id_field (str): The field the document id goes into.
+            fields (Optional[List[str]]): The only fields to read.
+            limit (Optional[int]): Read only the newest `limit` records by `order_by`.
+            order_by (str): The field that orders records from oldest to newest.
+        """
+        self._collection_ref = collection_ref
+        self._model = model
+        self._id_field = id_field
+        self._fields = fields
+        self._limit = limit
+        self._order_by = order_by
+        self._records: Optional[List[Any]] = None
+        self._pending: List[Any] = []
+
+    @property
+    def loaded(self) -> bool:
+        """Checks whether the subcollection was read."""
+        return self._records is not None
+
+    def pending(self) -> List[Any]:
+        """Gets the records added before the subcollection was read."""
+        return list(self._pending)
+
+    def _query(self):
+        return self._collection_ref.select(self._fields) if self._fields else self._collection_ref
+
+    def _to_model(self, doc) -> Any:
+        record = self._model({self._id_field: doc.id, **doc.to_dict()})
+        record.mark_persisted()
+        return record
+
+    def _load(self) -> List[Any]:
+        if self._records is None:
+            query = self._query()
+            if self._limit:
+                query = query.order_by(self._order_by, direction='DESCENDING').limit(self._limit)
+            records = [self._to_model(doc) for doc in query.stream()]
+            if self._limit:
+                records.reverse()
+            self._records = records + self._pending
+        return self._records
+
+    def load(self) -> List[Any]:
+        """
+        Reads the subcollection now, if it wasn't read yet.
+
+        Returns:
+            List[Any]: The records.
+        """
+        return self._load()
+
+    def pages(self, page_size: int = 100) -> Iterator[List[Any]]:
+        """
+        Reads the subcollection one page at a time, in document id order, without
+        keeping the records.
+
+        Args:
+            page_size (int): The records per page.
+
+        Returns:
+            Iterator[List[Any]]: The pages.
+        """
+        from google.cloud.firestore_v1.field_path import FieldPath
+
+        query = self._query().order_by(FieldPath.document_id()).limit(page_size)
+        last = None
+        while True:
+            docs = list((query.start_after(last) if last else query).stream())
+            if not docs:
+                return
+            yield [self._to_model(doc) for doc in docs]
+            if len(docs) < page_size:
+                return
+            last = docs[-1]
+
+    def recent(self, n: int) -> List[Any]:
+        """
+        Reads the newest `n` records without reading the rest.
+
+        Args:
+            n (int): How many records to read.
+
+        Returns:
+            List[Any]: The records, newest first.
+        """
+        query = self._query().order_by(self._order_by, direction='DESCENDING').limit(n)
+        return [self._to_model(doc) for doc in query.stream()]
+
+    def __getitem__(self, index):
+        return self._load()[index]
+
+    def __setitem__(self, index, value) -> None:
+        self._load()[index] = value
+
+    def __delitem__(self, index) -> None:
+        del self._load()[index]
+
+    def __len__(self) -> int:
+        return len(self._load())
+
+    def __iter__(self) -> Iterator[Any]:
+        return iter(self._load())
+
+    def append(self, value: Any) -> None:
+        # MutableSequence.append would read the subcollection to find its length.
+        if self._records is None:
+            self._pending.append(value)
+        else:
+            self._records.append(value)
+
+    def insert(self, index: int, value: Any) -> None:
+        self._load().insert(index, value)
+
+    def __repr__(self) -> str:
+        state = f"{len(self._records)} records" if self._records is not None else "not loaded"
+        return f"<LazySubcollection {self._collection_ref.id}: {state}>"
+
+
+def loaded_records(records) -> List[Any]:
+    """
+    Gets the records that are in memory without reading anything.
+
+    Args:
+        records: A list of records or a LazySubcollection.
+
+    Returns:
+        List[Any]: All records of a list or a read subcollection, otherwise the records
+            added to it before it was read.
+    """
+    if isinstance(records, LazySubcollection) and not records.loaded:
+        return records.pending()
+    return list(records)
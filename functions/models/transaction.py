@@ -3,6 +3,32 @@ from datetime import datetime
 import uuid
 from protocols.transaction_protocol import TransactionProtocol
 
+# Stored fields returned to clients; `email` is only kept for Firestore queries.
+PUBLIC_TRANSACTION_FIELDS = ['created_at', 'amount', 'vendor', 'category_name', 'category_id', 'picture_id',
+                             'is_successful']
+
+
+def to_amount(value: Any) -> Optional[float]:
+    """
+    Turns an amount into the number Firestore stores, so range filters and ordering on
+    amount compare numbers rather than strings.
+
+    Args:
+        value (Any): A number, or a string such as "1,234.56" or "$12.50".
+
+    Returns:
+        Optional[float]: The amount, or None if it is missing or not a number.
+    """
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return float(str(value).replace('$', '').replace(',', '').strip())
+    except ValueError:
+        return None
+
+
 class Transaction(TransactionProtocol):
     """
     Represents a financial transaction with various attributes.
@@ -28,12 +54,14 @@ class Transaction(TransactionProtocol):
         self._category_id: Optional[uuid.UUID] = None
         self._picture_id: Optional[uuid.UUID] = None
         self._is_successful: Optional[bool] = None
+        # What Firestore holds for this transaction, or None if it was never saved.
+        self._persisted: Optional[Dict[str, Any]] = None
 
         if data:
             self._transaction_id = data.get('transaction_id')
             self._created_at = data.get('created_at')
             self._email = data.get('email') if data.get('email') else None
-            self._amount = data.get('amount')
+            self._amount = to_amount(data.get('amount'))
             self._vendor = data.get('vendor').strip().replace("  ", " ").lower() if data.get('vendor') else None
             self._category_name = data.get('category_name').strip().replace("  ", " ").lower() if data.get('category_name') else None
             self._category_id = data.get('category_id')
@@ -118,7 +146,7 @@ class Transaction(TransactionProtocol):
         Args:
             value (float): The amount of money involved in the transaction.
         """
-        self._amount = value
+        self._amount = to_amount(value)
 
     @property
     def vendor(self) -> Optional[str]:
@@ -220,10 +248,36 @@ class Transaction(TransactionProtocol):
         """
         self._is_successful = value
 
+    def mark_persisted(self) -> None:
+        """
+        Records the current values as what Firestore holds, e.g. after loading or saving.
+        """
+        self._persisted = self.serialize(False)
+
+    @property
+    def is_new(self) -> bool:
+        """Checks whether the transaction was never loaded from or saved to Firestore."""
+        return self._persisted is None
+
+    def changed_fields(self) -> Dict[str, Any]:
+        """
+        Gets the fields that differ from what Firestore holds.
+
+        Returns:
+            Dict[str, Any]: The changed fields and their new values; every field for a new transaction.
+        """
+        current = self.serialize(False)
+        if self._persisted is None:
+            return current
+        return {k: v for k, v in current.items() if self._persisted.get(k) != v}
+
     def serialize(self, getting_transaction: bool = True) -> dict:
+        # Assign the id once so every later save writes the same document.
+        if not self._transaction_id:
+            self._transaction_id = str(uuid.uuid4())
         if getting_transaction:
             return {
-                'transaction_id': str(self.transaction_id) if self.transaction_id else str(uuid.uuid4()),
+                'transaction_id': str(self.transaction_id),
                 'created_at': self.created_at,
                 'amount': self.amount,
                 'vendor': self.vendor.strip().replace("  ", " ").lower() if self.vendor else None,
@@ -234,7 +288,7 @@ class Transaction(TransactionProtocol):
             }
         else:
             return {
-                'transaction_id': str(self.transaction_id) if self.transaction_id else str(uuid.uuid4()),
+                'transaction_id': str(self.transaction_id),
                 'created_at': self.created_at,
                 'email': self.email if self.email else None,
                 'amount': self.amount,
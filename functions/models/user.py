@@ -1,33 +1,108 @@
 import json
+import os
 from typing import Optional, List, Dict, Any, Union
 from datetime import datetime
-import firebase_admin
-from firebase_admin import firestore, credentials, auth
-import os
 
-from google.api_core.exceptions import InvalidArgument, PermissionDenied
-from google.cloud.firestore_v1 import FieldFilter
-
-from models.category import Category
+from models.category import Category, category_id_for_name
+from models.database import db, get_app, commit_in_batches, run_in_parallel, delete_recursively, FIRESTORE_BATCH_LIMIT
+from models.subcollection import LazySubcollection, loaded_records
 from models.transaction import Transaction
 from protocols.user_protocol import UserProtocol
 from models.response import Response
+from services.cache import build_cache
 import uuid
 
-# Load environment variables
-from dotenv import load_dotenv
-env_path = os.path.join(os.path.dirname(__file__), '../.env')
-load_dotenv(env_path)
+# Users loaded with their transactions and categories, read through by User(user_id). The
+# shared tier lets every gunicorn worker on the host reuse a load and see invalidations.
+user_cache = build_cache(
+    "users",
+    max_entries=int(os.getenv("USER_CACHE_MAX_ENTRIES", "256")),
+    max_memory_bytes=int(os.getenv("USER_CACHE_MAX_MEMORY_BYTES", str(64 * 1024 * 1024))),
+    max_disk_bytes=int(os.getenv("USER_CACHE_MAX_DISK_BYTES", str(256 * 1024 * 1024))),
+    ttl=float(os.getenv("USER_CACHE_TTL", "300")),
+    use_disk=os.getenv("USER_CACHE_SHARED", "true").lower() == "true",
+)
 
-# Initialize Firebase using the service account
-from flask_cors import CORS
-firebase_service_account = os.getenv('SECRET_KEY_FOR_FIREBASE')
-firebase_config = json.loads(firebase_service_account)
-cred = credentials.Certificate(firebase_config)
-firebase_admin.initialize_app(cred)
 
-db = firestore.client()
- 
+def _user_generation(user_id: str) -> str:
+    """
+    Gets the token that every cached load of a user is stored under.
+
+    It is read from the shared tier when there is one, so a write made by another worker
+    is seen at once.
+    """
+    key = f"{user_id}:generation"
+    if user_cache.disk is not None:
+        try:
+            found, blob = user_cache.disk.get(key)
+            if found:
+                return blob.decode()
+        except Exception:
+            pass
+    else:
+        found, generation = user_cache.memory.get(key)
+        if found:
+            return generation
+    return invalidate_user_cache(user_id)
+
+
+def invalidate_user_cache(user_id: str) -> str:
+    """
+    Makes every cached load of a user stale. Called by everything that writes a user.
+
+    Args:
+        user_id (str): The unique identifier of the user.
+
+    Returns:
+        str: The new generation token.
+    """
+    generation = uuid.uuid4().hex
+    key = f"{user_id}:generation"
+    # The generation is never served from another worker's memory tier, see _user_generation.
+    user_cache.memory.set(key, generation, len(generation))
+    if user_cache.disk is not None:
+        try:
+            user_cache.disk.set(key, generation.encode())
+        except Exception:
+            user_cache.memory.clear()
+    return generation
+
+
+def record_user_write(user_id: str) -> None:
+    """
+    Bumps a user's version and drops its cached loads, after a write that didn't go
+    through the user document itself.
+
+    The bump comes after the write, so a client never gets the new version with old data.
+
+    Args:
+        user_id (str): The unique identifier of the user.
+    """
+    from google.api_core import exceptions
+    from google.cloud.firestore_v1 import Increment
+
+    try:
+        db.collection(User.class_name).document(user_id).update({VERSION_FIELD: Increment(1)})
+    except exceptions.NotFound:
+        pass
+    invalidate_user_cache(user_id)
+
+
+# The user document field that counts writes to the user and everything under it. It
+# changes whenever anything /user/get returns changes, so it serves as the ETag.
+VERSION_FIELD = 'version'
+
+# User document fields a PATCH may change; the rest are set by the server.
+PATCHABLE_USER_FIELDS = ['access_token', 'email', 'first_name', 'last_name', 'last_login']
+
+
+class UserNotFound(LookupError):
+    """Raised when a user to update doesn't exist."""
+
+
+class UserUpdateConflict(RuntimeError):
+    """Raised when a user changed since the `update_time` an update was based on."""
+
 
 class User(UserProtocol):
     """
@@ -39,12 +114,21 @@ class User(UserProtocol):
 
     class_name = "Users"
 
-    def __init__(self, data: Optional[Union[dict, str]] = None):
+    def __init__(self, data: Optional[Union[dict, str]] = None, transaction_fields: Optional[List[str]] = None,
+                 category_fields: Optional[List[str]] = None, lazy: bool = False,
+                 transaction_limit: Optional[int] = None):
         """
         Initializes a new User instance.
 
         Args:
             data (Optional[Union[str, Any]]): The data to initialize the user. Can be a JSON string or str.
+            transaction_fields (Optional[List[str]]): When loading from Firestore, the only transaction
+                fields to read. All fields are read by default.
+            category_fields (Optional[List[str]]): When loading from Firestore, the only category
+                fields to read. All fields are read by default.
+            lazy (bool): When loading from Firestore, read only the user document. Transactions
+                and categories are read the first time they are used.
+            transaction_limit (Optional[int]): With `lazy`, read only the newest transactions.
         """
         self._user_id: Optional[str] = None
         self._access_token: Optional[str] = None
@@ -54,8 +138,13 @@ class User(UserProtocol):
         self._created_at: Optional[datetime] = None
         self._last_login: Optional[datetime] = None
         self._admin: Optional[bool] = None
-        self._transactions: List[Transaction] = []
-        self._categories: List[Category] = []
+        self._transactions: Union[List[Transaction], LazySubcollection] = []
+        self._categories: Union[List[Category], LazySubcollection] = []
+        # The user document as Firestore holds it, or None if it was never loaded or saved.
+        self._persisted: Optional[Dict[str, Any]] = None
+        # When Firestore last changed the user document, as loaded, in RFC 3339.
+        self._update_time: Optional[str] = None
+        self._version: int = 0
 
         if isinstance(data, dict):
             try:
@@ -63,7 +152,7 @@ class User(UserProtocol):
             except json.JSONDecodeError:
                 raise ValueError("Invalid JSON string provided")
         elif isinstance(data, str):
-            self._initialize_from_firestore(data)
+            self._initialize_from_firestore(data, transaction_fields, category_fields, lazy, transaction_limit)
         elif data is None:
             pass
         else:
@@ -77,44 +166,245 @@ class User(UserProtocol):
             data (Dict[str, str]): The data to initialize the user.
         """
         for k, v in data.items():
-            setattr(self, k, v)
+            if self._is_settable(k):
+                setattr(self, k, v)
 
         if 'transactions' in data:
             self._transactions = [Transaction(tx) for tx in data['transactions']]
         if 'categories' in data:
             self._categories = [Category(cat) for cat in data['categories']]
 
-    def _initialize_from_firestore(self, user_id: str) -> None:
+    def _initialize_from_firestore(self, user_id: str, transaction_fields: Optional[List[str]] = None,
+                                   category_fields: Optional[List[str]] = None, lazy: bool = False,
+                                   transaction_limit: Optional[int] = None) -> None:
         """
         Fetches and initializes the user data from Firestore using the provided UUID.
 
+        The user document and both subcollections are read at the same time, so loading
+        takes as long as the slowest read rather than their sum. A lazy user reads only
+        its document and leaves the subcollections to LazySubcollection proxies.
+
         Args:
             user_id (str): The unique identifier of the user in Firestore.
+            transaction_fields (Optional[List[str]]): The only transaction fields to read.
+            category_fields (Optional[List[str]]): The only category fields to read.
+            lazy (bool): Read the subcollections on first use.
+            transaction_limit (Optional[int]): With `lazy`, read only the newest transactions.
         """
+        if not lazy and self._initialize_from_cache(user_id, transaction_fields, category_fields):
+            return
+
+        # Read before Firestore, so a write that lands during the load makes it stale.
+        generation = None if lazy else _user_generation(user_id)
         user_ref = db.collection(self.class_name).document(user_id)
-        user_doc = user_ref.get()
+        transactions = LazySubcollection(user_ref.collection(Transaction.class_name), Transaction, 'transaction_id',
+                                         transaction_fields, limit=transaction_limit)
+        categories = LazySubcollection(user_ref.collection(Category.class_name), Category, 'category_id',
+                                       category_fields)
+        if lazy:
+            user_doc = user_ref.get()
+        else:
+            user_doc, _, _ = run_in_parallel(user_ref.get, transactions.load, categories.load)
         if user_doc.exists:
             user_data = user_doc.to_dict()
             self._initialize_from_data(user_data)
-            self._fetch_subcollections()
-           
-    def _fetch_subcollections(self) -> None:
+            self._persisted = self.serialize(False)
+            self._update_time = user_doc.update_time.rfc3339() if user_doc.update_time else None
+            self._transactions = transactions if lazy else list(transactions)
+            self._categories = categories if lazy else list(categories)
+            if not lazy:
+                user_cache.set(self._cache_key(user_id, generation, transaction_fields, category_fields), {
+                    'user': user_data,
+                    'update_time': self._update_time,
+                    'transactions': [t.serialize(False) for t in self._transactions],
+                    'categories': [c.serialize() for c in self._categories],
+                })
+
+    @staticmethod
+    def _cache_key(user_id: str, generation: str, transaction_fields: Optional[List[str]],
+                   category_fields: Optional[List[str]]) -> str:
+        fields = f"{','.join(transaction_fields or ['*'])}:{','.join(category_fields or ['*'])}"
+        return f"{user_id}:{generation}:{fields}"
+
+    def _initialize_from_cache(self, user_id: str, transaction_fields: Optional[List[str]] = None,
+                               category_fields: Optional[List[str]] = None) -> bool:
+        """
+        Initializes the user from a cached load made since the user was last written.
+
+        Args:
+            user_id (str): The unique identifier of the user.
+            transaction_fields (Optional[List[str]]): The transaction fields the load read.
+            category_fields (Optional[List[str]]): The category fields the load read.
+
+        Returns:
+            bool: Whether the user was found in the cache.
+        """
+        key = self._cache_key(user_id, _user_generation(user_id), transaction_fields, category_fields)
+        found, cached = user_cache.get(key)
+        if not found:
+            return False
+        self._initialize_from_data(cached['user'])
+        self._persisted = self.serialize(False)
+        self._update_time = cached['update_time']
+        # New objects on every hit, so edits to one User never leak into the cache.
+        self._transactions = [Transaction(t) for t in cached['transactions']]
+        self._categories = [Category(c) for c in cached['categories']]
+        for record in self._transactions + self._categories:
+            record.mark_persisted()
+        return True
+
+    def apply_changes(self, data: Dict[str, Any]) -> None:
+        """
+        Applies an edit from the client onto the loaded user.
+
+        Transactions and categories are matched by id: fields sent for an existing record
+        are merged into it, records without a known id are added, and records that aren't
+        sent are left as they are.
+
+        Args:
+            data (Dict[str, Any]): The fields to change.
+        """
+        for k, v in data.items():
+            if k == 'transactions':
+                self._transactions = self._merge_records(self._transactions, v, Transaction, 'transaction_id')
+            elif k == 'categories':
+                self._categories = self._merge_records(self._categories, v, Category, 'category_id')
+            elif self._is_settable(k):
+                setattr(self, k, v)
+
+    @classmethod
+    def _is_settable(cls, key: str) -> bool:
+        """
+        Checks whether a field sent by a client can be set on a User.
+
+        Clients send back what GET /user returned, which includes read-only fields such as
+        `update_time`; those and unknown keys are ignored.
+        """
+        attribute = getattr(cls, key, None)
+        return isinstance(attribute, property) and attribute.fset is not None
+
+    @staticmethod
+    def _merge_records(records: List[Any], changes: List[Dict[str, Any]], model: type, id_field: str) -> List[Any]:
+        by_id = {str(getattr(r, id_field)): i for i, r in enumerate(records) if getattr(r, id_field)}
+        merged = list(records)
+        for change in changes or []:
+            index = by_id.get(str(change.get(id_field))) if change.get(id_field) else None
+            if index is None:
+                merged.append(model(change))
+                continue
+            current = merged[index]
+            fields = current.serialize(False) if isinstance(current, Transaction) else current.serialize()
+            record = model({**fields, **change})
+            # Keep what Firestore holds, so only the edited fields make the record dirty.
+            record._persisted = current._persisted
+            merged[index] = record
+        return merged
+
+    def changed_fields(self) -> Dict[str, Any]:
+        """
+        Gets the user document fields that differ from what Firestore holds.
+
+        Returns:
+            Dict[str, Any]: The changed fields; every field for a user that was never saved.
         """
-        Fetches and initializes the transactions and categories subcollections from Firestore,
-        adding them to the `user_data` dictionary.
+        current = self.serialize(False)
+        if self._persisted is None:
+            return current
+        return {k: v for k, v in current.items() if self._persisted.get(k) != v}
+
+
+    @staticmethod
+    def patch(user_id: str, changes: Dict[str, Any], update_time: Optional[str] = None) -> Response:
+        """
+        Changes fields of a user document without reading it or its subcollections.
+
+        The changes are sent as one `update()` whose field mask is their keys, so fields that
+        aren't sent stay as they are. With `update_time` the write only applies if the
+        document hasn't changed since then; without it, only if the document exists.
+
+        Args:
+            user_id (str): The unique identifier of the user.
+            changes (Dict[str, Any]): The fields to set, out of PATCHABLE_USER_FIELDS.
+            update_time (Optional[str]): The RFC 3339 `update_time` the changes were based on.
+
+        Returns:
+            Response: A Response whose payload has the `user_id`, the changed fields and the
+                new `update_time`, or errors for fields that can't be patched.
+
+        Raises:
+            UserNotFound: If the user doesn't exist.
+            UserUpdateConflict: If the user changed since `update_time`.
         """
-        if self._user_id:
-            transactions_ref = db.collection(self.class_name).document(str(self._user_id)).collection(Transaction.class_name)
-            transaction_docs = transactions_ref.stream()
-            for doc in transaction_docs:
-                transaction = doc.to_dict()
-                transaction.pop('email')
-                self._transactions.append(transaction)
+        from google.api_core import exceptions
+        from google.api_core.datetime_helpers import DatetimeWithNanoseconds
+        from google.cloud.firestore_v1 import Increment
 
-            categories_ref = db.collection(self.class_name).document(str(self._user_id)).collection(Category.class_name)
-            category_docs = categories_ref.stream()
-            self._categories.extend(doc.to_dict() for doc in category_docs)
+        result = Response()
+        invalid = [k for k in changes if k not in PATCHABLE_USER_FIELDS]
+        if invalid:
+            result.add_error(f"Fields that can't be patched: {', '.join(invalid)}")
+        if not changes:
+            result.add_error(f"Send at least one of {', '.join(PATCHABLE_USER_FIELDS)}")
+        option = None
+        if update_time:
+            try:
+                last_update_time = DatetimeWithNanoseconds.from_rfc3339(update_time).timestamp_pb()
+                option = db.write_option(last_update_time=last_update_time)
+            except ValueError:
+                result.add_error("update_time must be an RFC 3339 timestamp")
+        if not result.is_successful():
+            return result
 
+        try:
+            # update() requires the document to exist, so a missing user is never created.
+            write = db.collection(User.class_name).document(user_id).update({**changes, VERSION_FIELD: Increment(1)},
+                                                                            option=option)
+        except exceptions.NotFound:
+            raise UserNotFound(f"User {user_id} not found.")
+        except exceptions.FailedPrecondition:
+            raise UserUpdateConflict(f"User {user_id} changed since {update_time}.")
+        invalidate_user_cache(user_id)
+
+        result.set_payload({'user_id': user_id, **changes, 'update_time': write.update_time.rfc3339()})
+        return result
+
+    @staticmethod
+    def current_version(user_id: str) -> Optional[int]:
+        """
+        Gets a user's version without loading the user, from the cache or by reading only
+        the version field.
+
+        Args:
+            user_id (str): The unique identifier of the user.
+
+        Returns:
+            Optional[int]: The version, or None if the user doesn't exist.
+        """
+        key = f"{user_id}:{_user_generation(user_id)}:{VERSION_FIELD}"
+        found, version = user_cache.get(key)
+        if found:
+            return version
+        doc = db.collection(User.class_name).document(user_id).get(field_paths=[VERSION_FIELD])
+        if not doc.exists:
+            return None
+        version = (doc.to_dict() or {}).get(VERSION_FIELD) or 0
+        user_cache.set(key, version)
+        return version
+
+    @property
+    def version(self) -> int:
+        """Gets how many times the loaded user was written."""
+        return self._version
+
+    @version.setter
+    def version(self, value: int) -> None:
+        """Sets the version of the user, as loaded."""
+        self._version = value or 0
+
+    @property
+    def update_time(self) -> Optional[str]:
+        """Gets when Firestore last changed the loaded user document, in RFC 3339."""
+        return self._update_time
 
     @property
     def user_id(self) -> Optional[str]:
@@ -241,8 +531,14 @@ class User(UserProtocol):
         Saves the user's information to the Firestore User collection and its subcollections.
         Returns a Response object indicating the result of the operation.
 
+        Documents are written in atomic batches of up to 500, committed in parallel, so a
+        failed batch leaves the other batches saved.
+
         Returns:
             Response: A Response object with the payload of saved data if successful, or errors if not.
+                A lazy user's payload lists only the records that were read or added.
+                On a partial failure the payload lists only what was saved, plus the paths in
+                `failed_documents`, and there is one error per failed batch.
         """
         response = Response()
         
@@ -254,43 +550,21 @@ class User(UserProtocol):
         transactions_list = []
         categories_list = []
 
-        # iterate over all categories, check if all have a category_id
-        for cat in self._categories:
-            # check if category has a category_id
-            if not cat._category_id:
-                # if no category_id, search for category name in firebase
-                # category = db.collection_group(Category.class_name).where('category_name', '==', cat._category_name).get()
-                query_result = db.collection_group(Category.class_name).where(filter=FieldFilter('category_name', '==', cat._category_name))
-
-                category = None
-                try:
-                    category = query_result.get()
-                except PermissionDenied as e:
-                    print(f"Permission Denied: {e}")
-                except InvalidArgument as e:
-                    print(f"Invalid Argument: {e}")
-                except Exception as e:
-                    print(f"Unexpected error: {e}")
-
-                # remove duplicate category_id by assigning to set
-                cat_set = set()
-                cat_id_list = []
-                if category:
-                    for c in category:
-                        cat_set.add(c.to_dict()['category_id'])
-                    cat_id_list.append(list(cat_set))
-
-                match len(cat_id_list):
-                    # if category_name doesn't exist, create new category_id
-                    case 0:
-                        cat._category_id = str(uuid.uuid4())
-                    # if category_name exists, assign existing category_id
-                    case 1:
-                        cat._category_id = cat_id_list[0]
-                    # There should never be more than one category returned
-                    case _:
-                        response.add_error(f"{len(cat_id_list)} category entries with same name found on Firebase.")
-                        return response
+        # Categories without an id reuse the id of the user's category with the same name,
+        # otherwise they get the id derived from their name. No query is needed.
+        # A lazy user only writes what was added to it, reading categories only when a new
+        # category or transaction needs the id of one that is already stored.
+        new_transactions = loaded_records(self._transactions)
+        if isinstance(self._categories, LazySubcollection) and not self._categories.loaded and (
+                any(not cat.category_id for cat in self._categories.pending()) or
+                any(not t.category_id and t.category_name for t in new_transactions)):
+            self._categories.load()
+        categories = loaded_records(self._categories)
+        ids_by_name = {cat.category_name: str(cat.category_id) for cat in categories if cat.category_id}
+        for cat in categories:
+            if not cat._category_id and cat.category_name:
+                cat._category_id = ids_by_name.get(cat.category_name) or category_id_for_name(cat.category_name)
+                ids_by_name.setdefault(cat.category_name, cat._category_id)
             categories_list.append(cat.serialize())
 
         # convert categories to dict for O1 efficiency
@@ -299,7 +573,7 @@ class User(UserProtocol):
             cat_dict.update({f"{c.get('category_name')}":f"{c.get('category_id')}"})
 
         # iterate over all transactions
-        for transaction in self._transactions:
+        for transaction in new_transactions:
             # check if transaction has a category_id
             if not transaction._category_id:
                 # Assign category_id
@@ -307,31 +581,65 @@ class User(UserProtocol):
             transaction._email = self._email
             transactions_list.append(transaction.serialize(False))
 
-        try:
-            # Save to User collection
-            user_ref = db.collection(self.class_name).document(str(self._user_id))
-            user_ref.set(self.serialize(False)) # not getting_existing_user()
-
-            # Save transactions to Transaction subcollection
-            transactions_ref = user_ref.collection(Transaction.class_name)
-            for transaction in self._transactions:
-                transaction_data = transaction.serialize(False)
-                transactions_ref.document(transaction_data['transaction_id']).set(transaction_data)
-
-            # Save categories to Category subcollection
-            categories_ref = user_ref.collection(Category.class_name)
-            for category in self._categories:
-                category_data = category.serialize()
-                categories_ref.document(category_data['category_id']).set(category_data)
-
-        except Exception as e:
-            response.add_error(f"Failed to save data: {str(e)}")
-            return response
+        # Only new and changed documents are written, in parallel batches of up to 500 writes
+        user_ref = db.collection(self.class_name).document(str(self._user_id))
+        transactions_ref = user_ref.collection(Transaction.class_name)
+        categories_ref = user_ref.collection(Category.class_name)
+        writes = []
+        user_changes = self.changed_fields()
+        # Records that are already stored only get their changed fields merged in.
+        changed_transactions = [(t, t.changed_fields()) for t in new_transactions]
+        changed_transactions = [(t, fields) for t, fields in changed_transactions if fields]
+        # Same-name duplicates resolve to one id and one document.
+        unique_categories = {str(c.category_id): c for c in categories}.values()
+        changed_categories = [(c, c.changed_fields()) for c in unique_categories]
+        changed_categories = [(c, fields) for c, fields in changed_categories if fields]
+        writes.extend((transactions_ref.document(str(t.transaction_id)), fields, not t.is_new)
+                      for t, fields in changed_transactions)
+        writes.extend((categories_ref.document(str(c.category_id)), fields, not c.is_new)
+                      for c, fields in changed_categories)
+
+        if writes or user_changes:
+            from google.cloud.firestore_v1 import Increment
+
+            # The version goes up in the same write as the user document, which is always
+            # merged so a new user never resets the version of a document that was there.
+            user_write = (user_ref, {**user_changes, VERSION_FIELD: Increment(1)}, True)
+            if len(writes) < FIRESTORE_BATCH_LIMIT:
+                failures = commit_in_batches(writes + [user_write])
+            else:
+                # Batches commit in parallel, so the version only goes up once all of them are in.
+                failures = commit_in_batches(writes)
+                failures += commit_in_batches([user_write])
+            writes.append(user_write)
+            invalidate_user_cache(str(self._user_id))
+        else:
+            failures = []
+        failed_paths = [path for paths, _ in failures for path in paths]
+        for paths, error in failures:
+            response.add_error(f"Failed to save {len(paths)} of {len(writes)} documents: {str(error)}")
+        failed_ids = {path.rsplit('/', 1)[-1] for path in failed_paths}
+        if user_ref.path in failed_paths:
+            response.add_error("Failed to save the user document")
+        elif writes:
+            self._persisted = self.serialize(False)
+            self._version += 1
+        for transaction, _ in changed_transactions:
+            if str(transaction.transaction_id) not in failed_ids:
+                transaction.mark_persisted()
+        for category, _ in changed_categories:
+            if str(category.category_id) not in failed_ids:
+                category.mark_persisted()
+        transactions_list = [t for t in transactions_list if t['transaction_id'] not in failed_ids]
+        categories_list = [c for c in categories_list if c['category_id'] not in failed_ids]
 
         # Set the payload with detailed saved information
         response_payload = self.serialize(False) # not getting_existing_user()
         response_payload[Transaction.class_name] = transactions_list
         response_payload[Category.class_name] = categories_list
+        if failed_paths:
+            # Only the documents in failed batches are missing; every other batch was committed.
+            response_payload['failed_documents'] = failed_paths
         response.set_payload(response_payload)
 
         return response
@@ -367,51 +675,49 @@ class User(UserProtocol):
         result = Response()
         
         # Query for the user document
-        document = db.collection(User.class_name).document(user_id).get()
+        document = db.collection(User.class_name).document(user_id).get(field_paths=[])
 
         if not document.exists:
             result.add_error(f"A user with id {user_id} doesn't exist.")
         else:
-            delete_document_with_subcollections(document.reference)
-            result.set_payload({"message": "User account deleted."})  # Updated message for consistency
+            deleted, failed = delete_recursively(document.reference)
+            invalidate_user_cache(user_id)
+            if failed:
+                # Running the deletion again only deletes what is left.
+                result.add_error(f"Failed to delete {len(failed)} of {deleted + len(failed)} documents, try again.")
+            else:
+                result.set_payload({"message": "User account deleted."})  # Updated message for consistency
   
         return result
 
-    def delete_transactions(self) -> Response:
+    @staticmethod
+    def delete_category(data: dict) -> Response:
         """
-        Deletes transactions on the Firestore database.
-    
-        Returns:
-            Response: An object indicating the outcome of the operation:
-        """
-        result = Response()
-        
-        # Query for the user document
-        document = db.collection(self.class_name).document(self.user_id).collection(Transaction.class_name).get()
-        if document:
-            for doc in document:
-                doc.reference.delete()
-        
-        result = self.save_to_firestore()
+        Deletes one of the user's categories on the Firestore database without loading the user.
 
-        return result
+        Args:
+            data (dict): The `user_id` and `category_id`.
 
-    def delete_category(self, data: dict) -> Response:
-        """
-        Deletes transactions on the Firestore database.
-    
         Returns:
-            Response: An object indicating the outcome of the operation:
+            Response: A Response whose payload has the `deleted_category_id`, or an error if
+                the category doesn't exist.
         """
         result = Response()
 
         # Query for the user document
         document = db.collection(User.class_name).document(data['user_id']).collection(Category.class_name).document(data['category_id'])
 
-        if document:
-            document.delete()
-        
-        result.set_payload(self)
+        # A DocumentReference is always truthy; only the snapshot says whether it exists.
+        if not document.get(field_paths=[]).exists:
+            result.add_error("This category does not exist")
+            return result
+
+        document.delete()
+        record_user_write(data['user_id'])
+
+        # Clients used to get the whole serialized user back, which cost a read of both
+        # subcollections; they now get the deleted id and re-fetch the user if they need it.
+        result.set_payload({'deleted_category_id': data['category_id']})
 
         return result
 
@@ -428,9 +734,10 @@ class User(UserProtocol):
                   False otherwise.
         """
         print('inside auth')
+        from firebase_admin import auth
         try:
             # The decoded token will return a dictionary with key-value pairs for the user
-            decoded_token = auth.verify_id_token(self._access_token)
+            decoded_token = auth.verify_id_token(self._access_token, app=get_app())
             return True if decoded_token.get("uid") == self._user_id else False
         except Exception as e:
             print(f"Token verification error: {str(e)}")
@@ -469,8 +776,8 @@ class User(UserProtocol):
                 'created_at': self._created_at,
                 'last_login': self._last_login,
                 'admin': self._admin,
-                'categories': self._categories,
-                'transactions': self._transactions
+                'categories': [c.serialize() for c in self._categories],
+                'transactions': [t.serialize() for t in self._transactions]
             }
         else:
             return {
@@ -483,16 +790,3 @@ class User(UserProtocol):
                 'last_login': self._last_login,
                 'admin': self._admin
             }
-
-
-def delete_document_with_subcollections(doc_ref):
-    # Delete all subcollections
-    subcollections = doc_ref.collections()
-    for subcollection in subcollections:
-        for doc in subcollection.stream():
-            # Recursively delete documents in subcollections
-            delete_document_with_subcollections(doc.reference)
-
-    # Delete the document itself
-    doc_ref.delete()
-    print(f"Deleted document: {doc_ref.path}")
\ No newline at end of file
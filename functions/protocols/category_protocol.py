@@ -18,4 +18,11 @@ class CategoryProtocol(Protocol):
     @category_name.setter
     def category_name(self, value: str) -> None: ...
 
+    def mark_persisted(self) -> None: ...
+
+    @property
+    def is_new(self) -> bool: ...
+
+    def changed_fields(self) -> dict: ...
+
     def serialize(self) -> dict: ...
@@ -62,4 +62,11 @@ class TransactionProtocol(Protocol):
     @is_successful.setter
     def is_successful(self, value: bool) -> None: ...
 
+    def mark_persisted(self) -> None: ...
+
+    @property
+    def is_new(self) -> bool: ...
+
+    def changed_fields(self) -> dict: ...
+
     def serialize(self, getting_transaction: bool = True) -> dict: ...
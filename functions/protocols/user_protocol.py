@@ -105,8 +105,6 @@ class UserProtocol(Protocol):
 
     def remove(self) -> Response: ...
 
-    def delete_transactions(self) -> Response: ...
-
     def delete_category(data: dict) -> Response: ...
 
     def is_authenticated(self) -> bool: ...
@@ -0,0 +1,60 @@
+"""Runs queued receipt jobs from Pub/Sub, separately from the web tier.
+
+Start the Firestore and Pub/Sub emulators (or point at the real services), then run:
+
+    RECEIPT_JOB_QUEUE=pubsub python receipt_worker.py
+
+Run as many copies as the queue needs; each pulls at most RECEIPT_JOB_WORKERS jobs at a time.
+"""
+import logging
+
+from google.api_core.exceptions import AlreadyExists
+from google.cloud import pubsub_v1
+
+from services import receipt_jobs
+from services.clients import google_credentials
+
+logging.basicConfig(level=logging.INFO)
+
+
+def handle_message(message) -> None:
+    job_id = message.attributes.get("job_id")
+    if not job_id:
+        logging.warning("Dropping receipt job message without job_id")
+        message.ack()
+        return
+    receipt_jobs.run_job(
+        job_id,
+        message.data,
+        message.attributes.get("image_sha256"),
+        message.attributes.get("user_id"),
+    )
+    # run_job records failures itself, so every message is done once it returns.
+    message.ack()
+
+
+def main() -> None:
+    # The same credentials as the web tier that publishes the jobs.
+    publisher = receipt_jobs._get_publisher()
+    subscriber = pubsub_v1.SubscriberClient(credentials=google_credentials())
+    topic = receipt_jobs.topic_path()
+    subscription = subscriber.subscription_path(receipt_jobs._project_id(), receipt_jobs.RECEIPT_JOBS_SUBSCRIPTION)
+
+    try:
+        publisher.create_topic(name=topic)
+    except AlreadyExists:
+        pass
+    try:
+        subscriber.create_subscription(name=subscription, topic=topic, ack_deadline_seconds=120)
+    except AlreadyExists:
+        pass
+
+    flow_control = pubsub_v1.types.FlowControl(max_messages=receipt_jobs.RECEIPT_JOB_WORKERS)
+    future = subscriber.subscribe(subscription, callback=handle_message, flow_control=flow_control)
+    logging.info(f"Listening for receipt jobs on {subscription}")
+    with subscriber:
+        future.result()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,6 @@
 # ocr_repository.py
 
-from firebase_admin import firestore
-
-firestore_client = firestore.client()
+from models.database import db as firestore_client
 
 def store_receipt_data(collection_name, document_data):
     """Stores the parsed receipt data into Firestore."""
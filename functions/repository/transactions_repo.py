@@ -0,0 +1,261 @@
+import base64
+import hashlib
+import json
+import os
+from typing import Any, Dict, List, Optional
+
+from models.database import db, delete_in_batches
+from models.response import Response
+from models.transaction import Transaction, PUBLIC_TRANSACTION_FIELDS
+from models.user import User, record_user_write
+
+TRANSACTIONS_PAGE_SIZE = int(os.getenv("TRANSACTIONS_PAGE_SIZE", "50"))
+TRANSACTIONS_MAX_PAGE_SIZE = int(os.getenv("TRANSACTIONS_MAX_PAGE_SIZE", "200"))
+
+# Filters that are pushed down to Firestore, by request parameter. Each needs a composite
+# index in firestore.indexes.json together with the created_at ordering, and with the
+# amount then created_at ordering for amount filters.
+EQUALITY_FILTERS = {'category': 'category_name', 'vendor': 'vendor'}
+
+
+def _normalize(value: str) -> str:
+    # Transactions store vendor and category names like this.
+    return value.strip().replace("  ", " ").lower()
+
+
+def _filters_key(filters: Dict[str, Any]) -> str:
+    return hashlib.sha256(json.dumps(filters, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+
+def encode_page_token(values: List[Any], filters: Dict[str, Any]) -> str:
+    """
+    Turns the cursor values of the last transaction of a page into an opaque page token.
+
+    Args:
+        values (List[Any]): The values of the query's order by fields, document id last.
+        filters (Dict[str, Any]): The filters of the query the page came from.
+
+    Returns:
+        str: The page token.
+    """
+    token = json.dumps({'v': values, 'f': _filters_key(filters)}, default=str)
+    return base64.urlsafe_b64encode(token.encode()).decode().rstrip('=')
+
+
+def decode_page_token(page_token: str, filters: Dict[str, Any]) -> List[Any]:
+    """
+    Reads the cursor values back out of a page token.
+
+    Args:
+        page_token (str): A token from `encode_page_token`.
+        filters (Dict[str, Any]): The filters of the query being continued.
+
+    Returns:
+        List[Any]: The cursor values.
+
+    Raises:
+        ValueError: If the token is malformed or was issued for different filters.
+    """
+    try:
+        token = json.loads(base64.urlsafe_b64decode(page_token + '=' * (-len(page_token) % 4)))
+        values, key = token['v'], token['f']
+    except Exception:
+        raise ValueError("Invalid page_token")
+    if key != _filters_key(filters):
+        raise ValueError("page_token was issued for different filters")
+    return values
+
+
+def _transactions_query(user_id: str, filters: Dict[str, Any], fields: List[str], ordered: bool = True):
+    """
+    Builds the query for a user's transactions that match the filters, newest first, or
+    biggest first when amount is filtered.
+
+    Args:
+        user_id (str): The user id.
+        filters (Dict[str, Any]): The filters, without empty values.
+        fields (List[str]): The fields to read. Empty to read ids only.
+        ordered (bool): Order the results. Firestore leaves out documents that lack an
+            order by field, so unordered queries also match transactions without created_at.
+
+    Returns:
+        Tuple[Query, List[str]]: The query, and the fields it is ordered by before the
+            document id, which are empty when it isn't ordered.
+
+    Raises:
+        ValueError: If an amount filter isn't a number.
+    """
+    from google.cloud.firestore_v1.field_path import FieldPath
+    from google.cloud.firestore_v1.base_query import FieldFilter
+
+    query = (db.collection(User.class_name).document(user_id).collection(Transaction.class_name)
+             .select(fields or [FieldPath.document_id()]))
+    for name, field in EQUALITY_FILTERS.items():
+        if name in filters:
+            query = query.where(filter=FieldFilter(field, '==', _normalize(str(filters[name]))))
+    if 'created_from' in filters:
+        query = query.where(filter=FieldFilter('created_at', '>=', str(filters['created_from'])))
+    if 'created_to' in filters:
+        # created_at is a string, so a bare date also matches the times stored on that day.
+        query = query.where(filter=FieldFilter('created_at', '<=', str(filters['created_to']) + '\uf8ff'))
+    has_amount = 'min_amount' in filters or 'max_amount' in filters
+    try:
+        if 'min_amount' in filters:
+            query = query.where(filter=FieldFilter('amount', '>=', float(filters['min_amount'])))
+        if 'max_amount' in filters:
+            query = query.where(filter=FieldFilter('amount', '<=', float(filters['max_amount'])))
+    except ValueError:
+        raise ValueError("min_amount and max_amount must be numbers")
+
+    if not ordered:
+        return query, []
+
+    # Firestore wants a range on amount to be ordered by amount first, so amount filtered
+    # pages are biggest first. The document id breaks ties so pages never skip or repeat
+    # transactions.
+    order_fields = ['amount', 'created_at'] if has_amount else ['created_at']
+    for field in order_fields:
+        query = query.order_by(field, direction='DESCENDING')
+    return query.order_by(FieldPath.document_id(), direction='DESCENDING'), order_fields
+
+
+def list_transactions(user_id: str, filters: Optional[Dict[str, Any]] = None, page_size: Optional[int] = None,
+                      page_token: Optional[str] = None) -> Response:
+    """
+    Reads one page of a user's transactions, newest first, or biggest first when amount is
+    filtered.
+
+    Every filter is part of the Firestore query, so only the transactions on the page are
+    read. Supported filters are `created_from` and `created_to` (inclusive bounds on
+    created_at), `category`, `vendor`, `min_amount` and `max_amount`.
+
+    Args:
+        user_id (str): The user id.
+        filters (Optional[Dict[str, Any]]): The filters, by name.
+        page_size (Optional[int]): The most transactions to return, up to TRANSACTIONS_MAX_PAGE_SIZE.
+            TRANSACTIONS_PAGE_SIZE by default.
+        page_token (Optional[str]): The `next_page_token` of the previous page.
+
+    Returns:
+        Response: A Response whose payload has `transactions` and `next_page_token`, which
+            is None on the last page. Errors for invalid filters or page tokens.
+    """
+    response = Response()
+    filters = {k: v for k, v in (filters or {}).items() if v is not None and v != ''}
+    page_size = max(1, min(int(page_size or TRANSACTIONS_PAGE_SIZE), TRANSACTIONS_MAX_PAGE_SIZE))
+    try:
+        query, order_fields = _transactions_query(user_id, filters, PUBLIC_TRANSACTION_FIELDS)
+    except ValueError as e:
+        response.add_error(str(e))
+        return response
+
+    if page_token:
+        try:
+            values = decode_page_token(page_token, filters)
+        except ValueError as e:
+            response.add_error(str(e))
+            return response
+        # The client turns the trailing document id back into a reference.
+        query = query.start_after(values)
+
+    docs = list(query.limit(page_size + 1).stream())
+    next_page_token = None
+    if len(docs) > page_size:
+        docs = docs[:page_size]
+        last = docs[-1].to_dict()
+        next_page_token = encode_page_token([last.get(f) for f in order_fields] + [docs[-1].id], filters)
+
+    response.set_payload({
+        'transactions': [Transaction({'transaction_id': doc.id, **doc.to_dict()}).serialize() for doc in docs],
+        'next_page_token': next_page_token,
+    })
+    return response
+
+
+def _delete(user_id: str, doc_refs: List[Any]) -> Response:
+    """Deletes transaction documents in batches and reports the ids that are gone."""
+    response = Response()
+    failures = delete_in_batches(doc_refs)
+    if doc_refs:
+        record_user_write(user_id)
+    failed_paths = {path for paths, _ in failures for path in paths}
+    for paths, error in failures:
+        response.add_error(f"Failed to delete {len(paths)} of {len(doc_refs)} transactions: {str(error)}")
+    payload = {'deleted_transaction_ids': [ref.id for ref in doc_refs if ref.path not in failed_paths]}
+    if failed_paths:
+        payload['failed_transaction_ids'] = [ref.id for ref in doc_refs if ref.path in failed_paths]
+    response.set_payload(payload)
+    return response
+
+
+def delete_transactions(user_id: str, transaction_ids: List[str]) -> Response:
+    """
+    Deletes the given transactions of a user.
+
+    Only the ids are read, to leave out transactions that don't exist, so the cost grows
+    with the number of ids rather than with the account.
+
+    Args:
+        user_id (str): The user id.
+        transaction_ids (List[str]): The transactions to delete.
+
+    Returns:
+        Response: A Response whose payload has the `deleted_transaction_ids`, plus the
+            `failed_transaction_ids` and one error per failed batch if a batch failed.
+    """
+    collection = db.collection(User.class_name).document(user_id).collection(Transaction.class_name)
+    refs = [collection.document(str(t)) for t in dict.fromkeys(transaction_ids)]
+    if not refs:
+        return _delete(user_id, [])
+    existing = [doc.reference for doc in db.get_all(refs, field_paths=[]) if doc.exists]
+    return _delete(user_id, existing)
+
+
+def delete_matching_transactions(user_id: str, filters: Dict[str, Any]) -> Response:
+    """
+    Deletes a user's transactions that match the filters of `list_transactions`.
+
+    The query isn't ordered, so transactions without created_at are deleted too unless a
+    created_at filter leaves them out.
+
+    Args:
+        user_id (str): The user id.
+        filters (Dict[str, Any]): The filters; at least one is required.
+
+    Returns:
+        Response: A Response whose payload has the `deleted_transaction_ids`, or errors for
+            missing or invalid filters and failed batches.
+    """
+    response = Response()
+    filters = {k: v for k, v in (filters or {}).items() if v is not None and v != ''}
+    if not filters:
+        response.add_error("At least one filter is required to delete transactions by filter")
+        return response
+    try:
+        query, _ = _transactions_query(user_id, filters, [], ordered=False)
+    except ValueError as e:
+        response.add_error(str(e))
+        return response
+    return _delete(user_id, [doc.reference for doc in query.stream()])
+
+
+def delete_transactions_except(user_id: str, keep_ids: List[str]) -> Response:
+    """
+    Deletes every transaction of a user except the given ones.
+
+    Serves clients that send the transactions to keep: the stored ids are listed without
+    their fields and only the difference is deleted.
+
+    Args:
+        user_id (str): The user id.
+        keep_ids (List[str]): The transactions to keep.
+
+    Returns:
+        Response: A Response whose payload has the `deleted_transaction_ids`.
+    """
+    from google.cloud.firestore_v1.field_path import FieldPath
+
+    keep = {str(t) for t in keep_ids}
+    collection = db.collection(User.class_name).document(user_id).collection(Transaction.class_name)
+    docs = collection.select([FieldPath.document_id()]).stream()
+    return _delete(user_id, [doc.reference for doc in docs if doc.id not in keep])
@@ -1,4 +1,6 @@
 from models.user import User
+from models.database import db
+from repository import transactions_repo
 from models.response import Response
 import string
 import random
@@ -47,6 +49,44 @@ def update_user(user: User) -> Response:
     return user.save_to_firestore()
 
 
+def get_user_version(user_id: str) -> int:
+    """Gets the version of a user from the cache or its version field.
+
+    Args:
+        user_id (str): The unique identifier of the user.
+
+    Returns:
+        int: The version, or None if the user doesn't exist.
+    """
+    return User.current_version(user_id)
+
+
+def patch_user(user_id: str, changes: dict, update_time: str = None) -> Response:
+    """Changes fields of a user document with one write and no reads.
+
+    Args:
+        user_id (str): The unique identifier of the user.
+        changes (dict): The fields to set.
+        update_time (str): The `update_time` the changes were based on, if any.
+
+    Returns:
+        Response: A `Response` object from `User.patch()`.
+    """
+    return User.patch(user_id, changes, update_time)
+
+
+def user_exists(user_id: str) -> bool:
+    """Checks whether a user document exists, reading no fields.
+
+    Args:
+        user_id (str): The unique identifier of the user.
+
+    Returns:
+        bool: True if the user exists.
+    """
+    return db.collection(User.class_name).document(user_id).get(field_paths=[]).exists
+
+
 def delete_user(user_id: str) -> Response:
     """Deletes an existing user from the Firestore database.
 
@@ -61,26 +101,28 @@ def delete_user(user_id: str) -> Response:
 
 def delete_transactions(user: User) -> Response:
     """
-    Deletes existing transactions in the Firestore database.
+    Deletes the stored transactions that are missing from the user's transactions.
 
     Args:
-        user (User): The updated User object with deleted transaction information.
+        user (User): The User object with the transactions to keep.
 
     Returns:
-        Response: A `Response` object from `delete_transactions()` method.
+        Response: A `Response` object from `transactions_repo.delete_transactions_except()`.
     """
-    return user.delete_transactions() 
+    keep_ids = [t.transaction_id for t in user.transactions if t.transaction_id]
+    return transactions_repo.delete_transactions_except(user.user_id, keep_ids)
 
 
 def delete_category(data: dict) -> Response:
     """
-    Deletes existing transactions in the Firestore database.
+    Deletes one of a user's categories in the Firestore database.
 
     Args:
-        user (User): The updated User object with deleted transaction information.
+        data (dict): The `user_id` and `category_id`.
 
     Returns:
-        Response: A `Response` object from `delete_transactions()` method.
+        Response: A `Response` object from `User.delete_category()`, whose payload is
+            `{'deleted_category_id': ...}`.
     """
-    user_instance = User(data.get('user_id'))
-    return user_instance.delete_category(data) 
\ No newline at end of file
+    # Nothing about the user needs reading to delete one of its categories.
+    return User.delete_category(data)
\ No newline at end of file
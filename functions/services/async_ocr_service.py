@@ -0,0 +1,269 @@
+import asyncio
+import concurrent.futures
+import logging
+import os
+import threading
+from typing import Any, List, Optional, Tuple, Union
+
+from services import category_classifier, image_preprocessing, ocr_service
+from services.resilience import Deadline, DeadlineExceeded, UpstreamUnavailable
+
+ASYNC_PIPELINE_TIMEOUT = float(os.getenv("ASYNC_PIPELINE_TIMEOUT", "60"))
+
+
+class AsyncReceiptPipeline:
+    """
+    The receipt pipeline (OCR, then LLM parsing) built on the async Vision and OpenAI clients.
+
+    Each receipt is its own task, so the OCR stage of one receipt overlaps the parsing
+    stage of another and a single worker can keep dozens of receipts in flight. Results
+    share the OCR and parse caches with the sync pipeline in `ocr_service`.
+    """
+
+    def __init__(self, vision_client=None, openai_client=None):
+        """
+        Initializes a new AsyncReceiptPipeline. Must be called from the loop it will run on.
+
+        Args:
+            vision_client: An async Vision client. Built on first use if not given.
+            openai_client: An AsyncOpenAI client. Built on first use if not given.
+        """
+        self._vision_client = vision_client
+        self._openai_client = openai_client
+
+    def _vision(self):
+        if self._vision_client is None:
+            from google.cloud import vision
+            from services.clients import google_credentials
+            self._vision_client = vision.ImageAnnotatorAsyncClient(credentials=google_credentials())
+        return self._vision_client
+
+    def _openai(self):
+        if self._openai_client is None:
+            import httpx
+            from openai import AsyncOpenAI
+            from services import clients
+            # Retries are made by the resilience layer, within the request deadline.
+            self._openai_client = AsyncOpenAI(
+                api_key=os.environ.get("OPENAI_API_KEY"),
+                max_retries=0,
+                http_client=httpx.AsyncClient(
+                    limits=httpx.Limits(
+                        max_connections=clients.OPENAI_MAX_CONNECTIONS,
+                        max_keepalive_connections=clients.OPENAI_MAX_KEEPALIVE,
+                        keepalive_expiry=clients.OPENAI_KEEPALIVE_EXPIRY,
+                    )
+                ),
+            )
+        return self._openai_client
+
+    async def extract_text(self, image_data: bytes, image_sha256: Optional[str] = None,
+                           deadline: Optional[Deadline] = None) -> Optional[str]:
+        """
+        Detects text in an image, reusing the cached result for an identical image.
+
+        Args:
+            image_data (bytes): The image content.
+            image_sha256 (Optional[str]): The SHA-256 of `image_data` if already computed.
+            deadline (Optional[Deadline]): The request deadline the Vision call must finish within.
+
+        Returns:
+            Optional[str]: The detected text, or None if there is none.
+
+        Raises:
+            DeadlineExceeded: If the deadline ran out before Vision could be called.
+        """
+        key = image_sha256 or ocr_service.hash_image(image_data)
+        found, text = ocr_service.ocr_cache.get(key)
+        if found:
+            return text
+
+        processed = await asyncio.wrap_future(image_preprocessing.submit(image_data))
+        # The same breaker and bulkhead as the sync pipeline, so both together stay
+        # within Vision's limit.
+        response = await ocr_service.vision_dependency.call_async(
+            lambda timeout: self._vision().batch_annotate_images(
+                requests=[ocr_service.text_detection_request(processed)],
+                timeout=timeout
+            ),
+            deadline.timeout(ocr_service.VISION_TIMEOUT) if deadline else ocr_service.VISION_TIMEOUT,
+            ocr_service.is_retryable_vision_error,
+        )
+        image_response = response.responses[0]
+        if image_response.error.message:
+            raise RuntimeError(image_response.error.message)
+        if not image_response.text_annotations:
+            return None
+
+        text = image_response.text_annotations[0].description
+        ocr_service.ocr_cache.set(key, text)
+        return text
+
+    async def parse_receipt(self, extracted_text: str, categories: Optional[List[str]] = None,
+                            user_id: Optional[str] = None, deadline: Optional[Deadline] = None) -> Tuple[Optional[Any], bool]:
+        """
+        Parses OCR text locally, or with OpenAI (through the parse cache) when the local
+        parse isn't confident enough.
+
+        Args:
+            extracted_text (str): The text returned by `extract_text`.
+            categories (Optional[List[str]]): The categories the model may choose from.
+            user_id (Optional[str]): The user the receipt belongs to.
+            deadline (Optional[Deadline]): The request deadline the OpenAI call must finish within.
+
+        Returns:
+            Tuple[Optional[Any], bool]: The parsed receipt and whether it came from the cache.
+
+        Raises:
+            DeadlineExceeded: If the deadline ran out before OpenAI could be called.
+        """
+        classifier = None
+        if user_id:
+            classifier = await asyncio.to_thread(category_classifier.get_classifier, user_id)
+        categories = ocr_service.resolve_categories(categories, classifier)
+        local = ocr_service.local_parse(extracted_text, categories, classifier)
+        if local:
+            return local, False
+
+        key = ocr_service.parse_cache_key(extracted_text, categories)
+        found, parsed = ocr_service.parse_cache.get(key)
+        if found:
+            return ocr_service.apply_classifier(dict(parsed), extracted_text, classifier), True
+
+        try:
+            response = await ocr_service.openai_dependency.call_async(
+                lambda timeout: self._openai().chat.completions.create(
+                    **ocr_service.receipt_completion_kwargs(extracted_text, categories),
+                    timeout=timeout
+                ),
+                deadline.timeout(ocr_service.OPENAI_TIMEOUT) if deadline else ocr_service.OPENAI_TIMEOUT,
+                ocr_service.is_retryable_openai_error,
+            )
+            parsed = ocr_service.decode_receipt_completion(response)
+        except DeadlineExceeded:
+            raise
+        except UpstreamUnavailable as e:
+            logging.warning(f"OpenAI unavailable ({str(e)}), using the local parse")
+            return ocr_service.degraded_parse(extracted_text, categories, classifier), False
+        except Exception as e:
+            logging.error(f"Error in OpenAI API call: {str(e)}")
+            return None, False
+
+        if isinstance(parsed, dict):
+            ocr_service.parse_cache.set(key, dict(parsed))
+        return ocr_service.apply_classifier(parsed, extracted_text, classifier), False
+
+    async def process(self, image_data: bytes, image_sha256: Optional[str] = None, user_id: Optional[str] = None,
+                      deadline: Optional[Deadline] = None) -> Tuple[Optional[str], Optional[Any], bool]:
+        """
+        Runs one receipt through OCR and parsing.
+
+        Args:
+            image_data (bytes): The image content.
+            image_sha256 (Optional[str]): The SHA-256 of `image_data` if already computed.
+            user_id (Optional[str]): The user the receipt belongs to.
+            deadline (Optional[Deadline]): The request deadline both calls must finish within.
+
+        Returns:
+            Tuple[Optional[str], Optional[Any], bool]: The extracted text, the parsed receipt
+                (None when no text was found) and whether the parse came from the cache.
+        """
+        text = await self.extract_text(image_data, image_sha256, deadline)
+        if not text:
+            return None, None, False
+        parsed, from_cache = await self.parse_receipt(text, user_id=user_id, deadline=deadline)
+        return text, parsed, from_cache
+
+    async def process_many(self, images: List[bytes]) -> List[Union[Tuple[Optional[str], Optional[Any], bool], Exception]]:
+        """
+        Runs many receipts through the pipeline at the same time.
+
+        Args:
+            images (List[bytes]): The image contents.
+
+        Returns:
+            List[Union[Tuple, Exception]]: The `process` result for each image in order,
+                or the exception raised for that image.
+        """
+        return await asyncio.gather(*(self.process(image) for image in images), return_exceptions=True)
+
+
+class _PipelineLoop:
+    """
+    An event loop running in a daemon thread, with the pipeline bound to it.
+
+    Async gRPC and HTTP clients belong to the loop that created them, so every request
+    thread in a worker submits its coroutine to this one loop. A new loop is started
+    after a fork.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pid: Optional[int] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._pipeline: Optional[AsyncReceiptPipeline] = None
+
+    def _start(self) -> None:
+        loop = asyncio.new_event_loop()
+        ready = threading.Event()
+
+        def run():
+            asyncio.set_event_loop(loop)
+            self._pipeline = AsyncReceiptPipeline()
+            ready.set()
+            loop.run_forever()
+
+        threading.Thread(target=run, name="receipt-pipeline-loop", daemon=True).start()
+        ready.wait()
+        self._loop = loop
+        self._pid = os.getpid()
+
+    def run(self, make_coro, timeout: float = ASYNC_PIPELINE_TIMEOUT):
+        """
+        Runs a coroutine on the pipeline loop and waits for its result.
+
+        Args:
+            make_coro: A callable taking the pipeline and returning the coroutine to run.
+            timeout (float): Seconds to wait for the result.
+
+        Raises:
+            DeadlineExceeded: If there is no result within `timeout`; the coroutine is cancelled.
+        """
+        with self._lock:
+            if self._pid != os.getpid():
+                self._start()
+        future = asyncio.run_coroutine_threadsafe(make_coro(self._pipeline), self._loop)
+        try:
+            return future.result(timeout=timeout)
+        except concurrent.futures.TimeoutError:
+            # Otherwise the receipt keeps its Vision and OpenAI slots after the client is gone.
+            future.cancel()
+            raise DeadlineExceeded(f"Receipt pipeline took longer than {timeout}s")
+
+
+_pipeline_loop = _PipelineLoop()
+
+
+def run_receipt_pipeline(image_data: bytes, image_sha256: Optional[str] = None, user_id: Optional[str] = None,
+                         deadline: Optional[Deadline] = None) -> Tuple[Optional[str], Optional[Any], bool]:
+    """
+    Runs one receipt through the async pipeline from synchronous code.
+
+    The calling thread only waits; the OCR and OpenAI I/O for every in-flight receipt
+    in this worker is multiplexed on the shared pipeline loop.
+
+    Args:
+        image_data (bytes): The image content.
+        image_sha256 (Optional[str]): The SHA-256 of `image_data` if already computed.
+        user_id (Optional[str]): The user the receipt belongs to.
+        deadline (Optional[Deadline]): The request deadline. Without one the wait is
+            capped at ASYNC_PIPELINE_TIMEOUT.
+
+    Returns:
+        Tuple[Optional[str], Optional[Any], bool]: See `AsyncReceiptPipeline.process`.
+
+    Raises:
+        DeadlineExceeded: If the receipt wasn't processed within the deadline.
+    """
+    timeout = deadline.remaining() if deadline else ASYNC_PIPELINE_TIMEOUT
+    return _pipeline_loop.run(lambda pipeline: pipeline.process(image_data, image_sha256, user_id, deadline), timeout)
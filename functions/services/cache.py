@@ -0,0 +1,460 @@
+import json
+import logging
+import os
+import sqlite3
+import stat
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from datetime import date, datetime
+from typing import Any, Optional, Dict, Tuple
+
+# Default location of the on-disk tier. Every gunicorn worker on the host opens the
+# same SQLite file, so a result computed by one worker is visible to all of them. The
+# default is per OS user, since the shared temp dir is writable by everyone.
+_CACHE_OWNER = f"-{os.getuid()}" if hasattr(os, "getuid") else ""
+DEFAULT_CACHE_DIR = os.getenv("CACHE_DIR", os.path.join(tempfile.gettempdir(), f"simplitrac-cache{_CACHE_OWNER}"))
+
+
+def private_dir(path: str) -> str:
+    """
+    Creates a directory only this OS user can use, or checks that an existing one is.
+
+    Args:
+        path (str): The directory.
+
+    Returns:
+        str: The directory.
+
+    Raises:
+        PermissionError: If the directory is a symlink, belongs to another user or can be
+            read or written by other users.
+    """
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    info = os.lstat(path)
+    if not stat.S_ISDIR(info.st_mode):
+        raise PermissionError(f"{path} is not a directory")
+    if hasattr(os, "getuid") and (info.st_uid != os.getuid() or info.st_mode & 0o077):
+        raise PermissionError(f"{path} must belong to this user and have mode 0700")
+    return path
+
+
+def _encode_value(value: Any) -> Any:
+    # Firestore returns datetimes, which JSON has no type for.
+    if isinstance(value, datetime):
+        return {"__datetime__": value.isoformat()}
+    if isinstance(value, date):
+        return {"__date__": value.isoformat()}
+    return str(value)
+
+
+def _decode_value(obj: Dict[str, Any]) -> Any:
+    if len(obj) == 1:
+        if "__datetime__" in obj:
+            return datetime.fromisoformat(obj["__datetime__"])
+        if "__date__" in obj:
+            return date.fromisoformat(obj["__date__"])
+    return obj
+
+
+def dumps(value: Any) -> bytes:
+    """
+    Serializes a value for the disk tier.
+
+    JSON rather than pickle, so whoever can write the cache file can't make the app run
+    code. Datetimes and dates round trip; other non-JSON values are stored as strings.
+
+    Args:
+        value (Any): The value.
+
+    Returns:
+        bytes: The serialized value.
+    """
+    return json.dumps(value, default=_encode_value, separators=(",", ":")).encode()
+
+
+def loads(blob: bytes) -> Any:
+    """
+    Reads a value written by `dumps`.
+
+    Args:
+        blob (bytes): The serialized value.
+
+    Returns:
+        Any: The value.
+    """
+    return json.loads(blob, object_hook=_decode_value)
+
+
+class CacheStats:
+    """
+    Hit/miss counters for a cache. Counters are per process.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts: Dict[str, int] = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "sets": 0,
+            "evictions": 0,
+        }
+
+    def incr(self, name: str, amount: int = 1) -> None:
+        """
+        Increments a counter.
+
+        Args:
+            name (str): The name of the counter.
+            amount (int): How much to add.
+        """
+        with self._lock:
+            self._counts[name] = self._counts.get(name, 0) + amount
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        Gets a copy of the counters with the overall hit rate.
+
+        Returns:
+            Dict[str, Any]: The counters.
+        """
+        with self._lock:
+            result = dict(self._counts)
+        lookups = result["memory_hits"] + result["disk_hits"] + result["misses"]
+        result["hit_rate"] = (result["memory_hits"] + result["disk_hits"]) / lookups if lookups else 0.0
+        return result
+
+
+class LRUCache:
+    """
+    A bounded in-memory LRU cache with a TTL.
+
+    Entries are evicted when there are more than `max_entries` of them, when their
+    combined size goes over `max_bytes`, or when they are older than `ttl` seconds.
+    """
+
+    def __init__(self, max_entries: int = 256, max_bytes: int = 32 * 1024 * 1024, ttl: Optional[float] = None):
+        """
+        Initializes a new LRUCache.
+
+        Args:
+            max_entries (int): The maximum number of entries.
+            max_bytes (int): The maximum combined size of the entries.
+            ttl (Optional[float]): Seconds an entry stays valid. None means forever.
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Tuple[Any, int, float]]" = OrderedDict()
+        self._bytes = 0
+
+    def get(self, key: str) -> Tuple[bool, Any]:
+        """
+        Looks up a key.
+
+        Args:
+            key (str): The cache key.
+
+        Returns:
+            Tuple[bool, Any]: Whether the key was found, and its value.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False, None
+            value, size, stored_at = entry
+            if self.ttl is not None and time.time() - stored_at > self.ttl:
+                del self._entries[key]
+                self._bytes -= size
+                return False, None
+            self._entries.move_to_end(key)
+            return True, value
+
+    def set(self, key: str, value: Any, size: int) -> int:
+        """
+        Stores a value, evicting the least recently used entries if needed.
+
+        Args:
+            key (str): The cache key.
+            value (Any): The value to store.
+            size (int): The size of the value in bytes.
+
+        Returns:
+            int: The number of entries evicted.
+        """
+        if size > self.max_bytes:
+            return 0
+        evicted = 0
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._entries[key] = (value, size, time.time())
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, (_, old_size, _) = self._entries.popitem(last=False)
+                self._bytes -= old_size
+                evicted += 1
+        return evicted
+
+    def delete(self, key: str) -> None:
+        """
+        Removes a key if it is present.
+
+        Args:
+            key (str): The cache key.
+        """
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+
+    def clear(self) -> None:
+        """
+        Removes every entry.
+        """
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+
+class DiskCache:
+    """
+    A persistent cache stored in a SQLite file that several processes can share.
+
+    Entries expire after `ttl` seconds and the least recently used entries are removed
+    when the file holds more than `max_bytes` of values.
+    """
+
+    def __init__(self, path: str, max_bytes: int = 256 * 1024 * 1024, ttl: Optional[float] = None):
+        """
+        Initializes a new DiskCache. The directory and SQLite file are only created when
+        the cache is first used, so building one at import touches nothing on disk.
+
+        Args:
+            path (str): The path of the SQLite file.
+            max_bytes (int): The maximum combined size of the stored values.
+            ttl (Optional[float]): Seconds an entry stays valid. None means forever.
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._local = threading.local()
+
+    def _connect(self) -> sqlite3.Connection:
+        """
+        Gets the SQLite connection for the current thread and process, creating the
+        directory and table on first use.
+        """
+        conn = getattr(self._local, "conn", None)
+        if conn is None or getattr(self._local, "pid", None) != os.getpid():
+            private_dir(os.path.dirname(self.path))
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "key TEXT PRIMARY KEY, value BLOB, size INTEGER, stored_at REAL, accessed_at REAL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS entries_accessed_at ON entries (accessed_at)")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key: str) -> Tuple[bool, Optional[bytes]]:
+        """
+        Looks up a key.
+
+        Args:
+            key (str): The cache key.
+
+        Returns:
+            Tuple[bool, Optional[bytes]]: Whether the key was found, and the stored blob.
+        """
+        conn = self._connect()
+        row = conn.execute("SELECT value, stored_at FROM entries WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return False, None
+        value, stored_at = row
+        now = time.time()
+        if self.ttl is not None and now - stored_at > self.ttl:
+            conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            return False, None
+        conn.execute("UPDATE entries SET accessed_at = ? WHERE key = ?", (now, key))
+        return True, value
+
+    def set(self, key: str, blob: bytes) -> int:
+        """
+        Stores a blob, evicting the least recently used entries if needed.
+
+        Args:
+            key (str): The cache key.
+            blob (bytes): The serialized value.
+
+        Returns:
+            int: The number of entries evicted.
+        """
+        conn = self._connect()
+        now = time.time()
+        conn.execute(
+            "INSERT OR REPLACE INTO entries (key, value, size, stored_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+            (key, sqlite3.Binary(blob), len(blob), now, now),
+        )
+        return self._evict(conn, now)
+
+    def _evict(self, conn: sqlite3.Connection, now: float) -> int:
+        """
+        Removes expired entries, then the least recently used ones until under `max_bytes`.
+        """
+        evicted = 0
+        if self.ttl is not None:
+            evicted += conn.execute("DELETE FROM entries WHERE stored_at < ?", (now - self.ttl,)).rowcount
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total > self.max_bytes:
+            excess = total - self.max_bytes
+            freed = 0
+            keys = []
+            for key, size in conn.execute("SELECT key, size FROM entries ORDER BY accessed_at"):
+                keys.append((key,))
+                freed += size
+                if freed >= excess:
+                    break
+            conn.executemany("DELETE FROM entries WHERE key = ?", keys)
+            evicted += len(keys)
+        return evicted
+
+    def delete(self, key: str) -> None:
+        """
+        Removes a key if it is present.
+
+        Args:
+            key (str): The cache key.
+        """
+        self._connect().execute("DELETE FROM entries WHERE key = ?", (key,))
+
+    def clear(self) -> None:
+        """
+        Removes every entry.
+        """
+        self._connect().execute("DELETE FROM entries")
+
+
+class TieredCache:
+    """
+    A cache with an in-memory LRU tier in front of an optional shared disk tier.
+
+    Values are stored as JSON in the disk tier (see `dumps`). A value found only on disk
+    is copied into the memory tier.
+    """
+
+    def __init__(self, memory: LRUCache, disk: Optional[DiskCache] = None):
+        """
+        Initializes a new TieredCache.
+
+        Args:
+            memory (LRUCache): The in-memory tier.
+            disk (Optional[DiskCache]): The shared tier, if any.
+        """
+        self.memory = memory
+        self.disk = disk
+        self.stats = CacheStats()
+
+    def get(self, key: str) -> Tuple[bool, Any]:
+        """
+        Looks up a key in the memory tier and then the disk tier.
+
+        Args:
+            key (str): The cache key.
+
+        Returns:
+            Tuple[bool, Any]: Whether the key was found, and its value.
+        """
+        found, value = self.memory.get(key)
+        if found:
+            self.stats.incr("memory_hits")
+            return True, value
+
+        if self.disk is not None:
+            try:
+                found, blob = self.disk.get(key)
+                if found:
+                    value = loads(blob)
+                    self.stats.incr("evictions", self.memory.set(key, value, len(blob)))
+                    self.stats.incr("disk_hits")
+                    return True, value
+            except Exception as e:
+                logging.warning(f"Disk cache read failed: {str(e)}")
+
+        self.stats.incr("misses")
+        return False, None
+
+    def set(self, key: str, value: Any) -> None:
+        """
+        Stores a value in every tier.
+
+        Args:
+            key (str): The cache key.
+            value (Any): The value to store. JSON types, datetimes and dates.
+        """
+        blob = dumps(value)
+        evicted = self.memory.set(key, value, len(blob))
+        if self.disk is not None:
+            try:
+                evicted += self.disk.set(key, blob)
+            except Exception as e:
+                logging.warning(f"Disk cache write failed: {str(e)}")
+        self.stats.incr("sets")
+        self.stats.incr("evictions", evicted)
+
+    def delete(self, key: str) -> None:
+        """
+        Removes a key from every tier.
+
+        Args:
+            key (str): The cache key.
+        """
+        self.memory.delete(key)
+        if self.disk is not None:
+            try:
+                self.disk.delete(key)
+            except Exception as e:
+                logging.warning(f"Disk cache delete failed: {str(e)}")
+
+    def clear(self) -> None:
+        """
+        Removes every entry from every tier.
+        """
+        self.memory.clear()
+        if self.disk is not None:
+            try:
+                self.disk.clear()
+            except Exception as e:
+                logging.warning(f"Disk cache clear failed: {str(e)}")
+
+
+def build_cache(name: str, max_entries: int, max_memory_bytes: int, max_disk_bytes: int,
+                ttl: Optional[float], use_disk: bool = True) -> TieredCache:
+    """
+    Builds a TieredCache whose disk tier lives in `DEFAULT_CACHE_DIR/<name>.sqlite3`.
+
+    Nothing is opened until the cache is used. If the disk tier can't be opened then,
+    for instance because the directory isn't private, reads and writes use memory only.
+
+    Args:
+        name (str): The name of the cache, used for the SQLite file name.
+        max_entries (int): The maximum number of entries in memory.
+        max_memory_bytes (int): The maximum size of the memory tier.
+        max_disk_bytes (int): The maximum size of the disk tier.
+        ttl (Optional[float]): Seconds an entry stays valid. None means forever.
+        use_disk (bool): Whether to add the disk tier.
+
+    Returns:
+        TieredCache: The cache.
+    """
+    disk = None
+    if use_disk:
+        disk = DiskCache(os.path.join(DEFAULT_CACHE_DIR, f"{name}.sqlite3"), max_bytes=max_disk_bytes, ttl=ttl)
+    return TieredCache(LRUCache(max_entries=max_entries, max_bytes=max_memory_bytes, ttl=ttl), disk)
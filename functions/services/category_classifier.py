@@ -0,0 +1,271 @@
+import logging
+import math
+import os
+import re
+import threading
+from collections import Counter, defaultdict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from services.cache import LRUCache
+
+# How many users' classifiers one worker keeps in memory, and for how long. The TTL
+# bounds how stale a classifier can get from saves handled by other workers.
+CLASSIFIER_CACHE_SIZE = int(os.getenv("CLASSIFIER_CACHE_SIZE", "1000"))
+CLASSIFIER_CACHE_TTL = float(os.getenv("CLASSIFIER_CACHE_TTL", "900"))
+# Minimum posterior probability for a naive Bayes guess to be used.
+CLASSIFIER_MIN_CONFIDENCE = float(os.getenv("CLASSIFIER_MIN_CONFIDENCE", "0.6"))
+# Only the newest transactions train a classifier, so a user with a long history doesn't
+# make the first receipt of the day stream their whole account.
+CLASSIFIER_MAX_TRAINING_TRANSACTIONS = int(os.getenv("CLASSIFIER_MAX_TRAINING_TRANSACTIONS", "2000"))
+# OCR lines looked at for extra tokens; the store header is at the top.
+CLASSIFIER_OCR_LINES = 8
+
+_TOKEN = re.compile(r"[a-z0-9&']{2,}")
+
+
+def tokenize(text: Optional[str]) -> List[str]:
+    """
+    Splits text into lowercase word tokens.
+
+    Args:
+        text (Optional[str]): The text to split.
+
+    Returns:
+        List[str]: The tokens.
+    """
+    return _TOKEN.findall(text.lower().replace("'", "")) if text else []
+
+
+def normalize_name(vendor: Optional[str]) -> Optional[str]:
+    """
+    Normalizes a vendor or category name the way Transaction stores it.
+    """
+    return " ".join(vendor.split()).lower() if vendor else None
+
+
+class CategoryClassifier:
+    """
+    Learns which category a user assigns to which vendor.
+
+    An exact vendor to category map answers for vendors the user has seen before. Other
+    vendors go to a multinomial naive Bayes model over vendor tokens, which also uses OCR
+    header tokens that appear in its vocabulary.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._vendor_counts: Dict[str, Counter] = defaultdict(Counter)
+        self._token_counts: Dict[str, Counter] = defaultdict(Counter)
+        self._token_totals: Counter = Counter()
+        self._category_counts: Counter = Counter()
+        self._vocabulary: Counter = Counter()
+        self._seen: Dict[str, Tuple[str, str]] = {}
+        self._categories: set = set()
+
+    @property
+    def categories(self) -> List[str]:
+        """Gets every category the user has, sorted."""
+        with self._lock:
+            return sorted(self._categories)
+
+    def add_category(self, category_name: Optional[str]) -> None:
+        """
+        Adds a category the user owns, even if no transaction uses it yet.
+
+        Args:
+            category_name (Optional[str]): The category name.
+        """
+        if category_name:
+            with self._lock:
+                self._categories.add(normalize_name(category_name))
+
+    def _update(self, vendor: str, category: str, sign: int) -> None:
+        self._vendor_counts[vendor][category] += sign
+        if self._vendor_counts[vendor][category] <= 0:
+            del self._vendor_counts[vendor][category]
+        self._category_counts[category] += sign
+        for token in tokenize(vendor):
+            self._token_counts[category][token] += sign
+            self._token_totals[category] += sign
+            self._vocabulary[token] += sign
+            if self._vocabulary[token] <= 0:
+                del self._vocabulary[token]
+
+    def learn(self, vendor: Optional[str], category: Optional[str], transaction_id: Optional[str] = None) -> None:
+        """
+        Learns one categorized transaction. Relearning the same transaction id replaces
+        what was learned from it before, so repeated saves don't count twice.
+
+        Args:
+            vendor (Optional[str]): The vendor name.
+            category (Optional[str]): The category the user assigned.
+            transaction_id (Optional[str]): The id of the transaction.
+        """
+        vendor = normalize_name(vendor)
+        category = normalize_name(category)
+        if not vendor or not category:
+            return
+
+        with self._lock:
+            if transaction_id:
+                previous = self._seen.get(transaction_id)
+                if previous == (vendor, category):
+                    return
+                if previous:
+                    self._update(previous[0], previous[1], -1)
+                self._seen[transaction_id] = (vendor, category)
+            self._categories.add(category)
+            self._update(vendor, category, 1)
+
+    def forget(self, transaction_id: str) -> None:
+        """
+        Removes what was learned from a deleted transaction.
+
+        Args:
+            transaction_id (str): The id of the transaction.
+        """
+        with self._lock:
+            previous = self._seen.pop(transaction_id, None)
+            if previous:
+                self._update(previous[0], previous[1], -1)
+
+    def predict(self, vendor: Optional[str], text: Optional[str] = None) -> Tuple[Optional[str], float]:
+        """
+        Guesses the category of a receipt.
+
+        Args:
+            vendor (Optional[str]): The vendor name read from the receipt.
+            text (Optional[str]): The OCR text of the receipt.
+
+        Returns:
+            Tuple[Optional[str], float]: The category and its probability, or (None, 0.0)
+                when there is nothing to go on.
+        """
+        vendor = normalize_name(vendor)
+        with self._lock:
+            counts = self._vendor_counts.get(vendor) if vendor else None
+            if counts:
+                category, count = counts.most_common(1)[0]
+                return category, count / sum(counts.values())
+
+            header = "\n".join(text.splitlines()[:CLASSIFIER_OCR_LINES]) if text else ""
+            tokens = [t for t in tokenize(vendor) + tokenize(header) if t in self._vocabulary]
+            total = sum(self._category_counts.values())
+            if not tokens or not total:
+                return None, 0.0
+
+            vocabulary_size = len(self._vocabulary)
+            scores = {}
+            for category, category_count in self._category_counts.items():
+                if category_count <= 0:
+                    continue
+                token_counts = self._token_counts[category]
+                denominator = self._token_totals[category] + vocabulary_size
+                score = math.log(category_count / total)
+                for token in tokens:
+                    score += math.log((token_counts[token] + 1) / denominator)
+                scores[category] = score
+
+        if not scores:
+            return None, 0.0
+        best = max(scores, key=scores.get)
+        # Softmax over the log scores gives the posterior of the best category.
+        top = scores[best]
+        probability = 1.0 / sum(math.exp(score - top) for score in scores.values())
+        return best, probability
+
+
+_classifiers = LRUCache(max_entries=CLASSIFIER_CACHE_SIZE, max_bytes=2 ** 62, ttl=CLASSIFIER_CACHE_TTL)
+# One lock per user being trained, so users don't wait on each other's training. Each
+# entry is [lock, threads using it] and is dropped when the last thread is done.
+_load_locks: Dict[str, List[Any]] = {}
+_load_locks_lock = threading.Lock()
+
+
+def _train_from_firestore(user_id: str) -> CategoryClassifier:
+    """
+    Builds a classifier from the user's newest transactions and their categories.
+    """
+    from models.database import db
+    from models.user import User
+    from models.transaction import Transaction
+    from models.category import Category
+
+    classifier = CategoryClassifier()
+    user_ref = db.collection(User.class_name).document(user_id)
+    transactions = (user_ref.collection(Transaction.class_name).select(['vendor', 'category_name'])
+                    .order_by('created_at', direction='DESCENDING').limit(CLASSIFIER_MAX_TRAINING_TRANSACTIONS))
+    for doc in transactions.stream():
+        data = doc.to_dict()
+        classifier.learn(data.get('vendor'), data.get('category_name'), doc.id)
+    for doc in user_ref.collection(Category.class_name).select(['category_name']).stream():
+        classifier.add_category(doc.to_dict().get('category_name'))
+    return classifier
+
+
+def get_classifier(user_id: str) -> Optional[CategoryClassifier]:
+    """
+    Gets the classifier for a user, training it from Firestore on first use.
+
+    Args:
+        user_id (str): The user id.
+
+    Returns:
+        Optional[CategoryClassifier]: The classifier, or None if it couldn't be loaded.
+    """
+    found, classifier = _classifiers.get(user_id)
+    if found:
+        return classifier
+
+    with _load_locks_lock:
+        entry = _load_locks.setdefault(user_id, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        with entry[0]:
+            found, classifier = _classifiers.get(user_id)
+            if found:
+                return classifier
+            try:
+                classifier = _train_from_firestore(user_id)
+            except Exception as e:
+                logging.error(f"Could not train category classifier for {user_id}: {str(e)}")
+                return None
+            _classifiers.set(user_id, classifier, 1)
+            return classifier
+    finally:
+        with _load_locks_lock:
+            entry[1] -= 1
+            if not entry[1]:
+                del _load_locks[user_id]
+
+
+def learn_transactions(user_id: str, transactions: Iterable[Any], categories: Iterable[Any] = ()) -> None:
+    """
+    Updates a cached classifier with saved transactions and categories.
+
+    Users whose classifier isn't in memory are skipped; it is trained from Firestore,
+    saves included, the next time it is needed.
+
+    Args:
+        user_id (str): The user id.
+        transactions (Iterable[Any]): Saved Transaction objects.
+        categories (Iterable[Any]): Saved Category objects.
+    """
+    found, classifier = _classifiers.get(user_id)
+    if not found:
+        return
+    for transaction in transactions:
+        classifier.learn(transaction.vendor, transaction.category_name,
+                         str(transaction.transaction_id) if transaction.transaction_id else None)
+    for category in categories:
+        classifier.add_category(category.category_name)
+
+
+def forget_user(user_id: str) -> None:
+    """
+    Drops a user's classifier, e.g. after transactions were deleted.
+
+    Args:
+        user_id (str): The user id.
+    """
+    _classifiers.delete(user_id)
@@ -0,0 +1,207 @@
+import json
+import logging
+import os
+import threading
+from typing import Optional
+
+# Load environment variables
+from dotenv import load_dotenv
+
+env_path = os.path.join(os.path.dirname(__file__), '../.env')
+load_dotenv(env_path)
+
+# Keep-alive settings for the Vision gRPC channel. Without pings an idle channel
+# gets dropped by load balancers and the next receipt pays for a new handshake.
+VISION_KEEPALIVE_MS = int(os.getenv("VISION_KEEPALIVE_MS", "30000"))
+VISION_WARMUP_TIMEOUT = float(os.getenv("VISION_WARMUP_TIMEOUT", "5"))
+
+# Connection pool settings for the OpenAI HTTP client.
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "20"))
+OPENAI_MAX_KEEPALIVE = int(os.getenv("OPENAI_MAX_KEEPALIVE", "10"))
+OPENAI_KEEPALIVE_EXPIRY = float(os.getenv("OPENAI_KEEPALIVE_EXPIRY", "60"))
+
+_credentials_lock = threading.Lock()
+_credentials = None
+
+
+def google_credentials():
+    """
+    Gets Google Cloud credentials for the service account in SECRET_KEY_FOR_FIREBASE.
+
+    The secret is parsed once, on first use, and handed to the clients directly, so no
+    key file has to be written to disk.
+
+    Returns:
+        google.oauth2.service_account.Credentials: The credentials, or None to let the
+            client libraries use Application Default Credentials.
+    """
+    global _credentials
+    with _credentials_lock:
+        if _credentials is None:
+            env_string = os.getenv("SECRET_KEY_FOR_FIREBASE")
+            if not env_string:
+                logging.info("SECRET_KEY_FOR_FIREBASE not set, using default Google credentials")
+                return None
+            try:
+                info = json.loads(env_string)
+            except json.JSONDecodeError:
+                logging.error("Invalid JSON in SECRET_KEY_FOR_FIREBASE environment variable")
+                return None
+            from google.oauth2 import service_account
+            _credentials = service_account.Credentials.from_service_account_info(
+                info, scopes=["https://www.googleapis.com/auth/cloud-platform"]
+            )
+        return _credentials
+
+
+class ClientManager:
+    """
+    Owns the Vision and OpenAI clients used by the receipt pipeline.
+
+    Clients are created lazily on first use and then shared by every request handled
+    by the current process. gRPC channels and HTTP connection pools are not fork safe,
+    so the manager remembers the pid that built them and rebuilds everything when it
+    is used from a forked gunicorn worker.
+    """
+
+    def __init__(self):
+        """
+        Initializes an empty ClientManager. No client is built until it is requested.
+        """
+        self._lock = threading.Lock()
+        self._pid: Optional[int] = None
+        self._vision_channel = None
+        self._vision_client = None
+        self._openai_http_client = None
+        self._openai_client = None
+
+    def _check_pid(self) -> None:
+        """
+        Drops clients inherited from a parent process. Must be called with the lock held.
+        """
+        pid = os.getpid()
+        if self._pid != pid:
+            # Never close inherited clients: the sockets still belong to the parent.
+            self._vision_channel = None
+            self._vision_client = None
+            self._openai_http_client = None
+            self._openai_client = None
+            self._pid = pid
+
+    def _build_vision_client(self):
+        """
+        Builds an ImageAnnotatorClient on top of a keep-alive gRPC channel.
+        """
+        from google.cloud import vision
+        from google.cloud.vision_v1.services.image_annotator.transports import ImageAnnotatorGrpcTransport
+
+        channel = ImageAnnotatorGrpcTransport.create_channel(
+            credentials=google_credentials(),
+            options=[
+                ("grpc.keepalive_time_ms", VISION_KEEPALIVE_MS),
+                ("grpc.keepalive_permit_without_calls", 1),
+                ("grpc.http2.max_pings_without_data", 0),
+            ]
+        )
+        self._vision_channel = channel
+        return vision.ImageAnnotatorClient(transport=ImageAnnotatorGrpcTransport(channel=channel))
+
+    def _build_openai_client(self):
+        """
+        Builds an OpenAI client that reuses pooled keep-alive HTTP connections.
+        """
+        import httpx
+        from openai import OpenAI
+
+        self._openai_http_client = httpx.Client(
+            limits=httpx.Limits(
+                max_connections=OPENAI_MAX_CONNECTIONS,
+                max_keepalive_connections=OPENAI_MAX_KEEPALIVE,
+                keepalive_expiry=OPENAI_KEEPALIVE_EXPIRY,
+            )
+        )
+        # Retries are made by the callers, within their request deadline.
+        return OpenAI(api_key=os.environ.get("OPENAI_API_KEY"), http_client=self._openai_http_client, max_retries=0)
+
+    def vision(self):
+        """
+        Gets the process-wide Vision client, creating it on first use.
+
+        Returns:
+            vision.ImageAnnotatorClient: The shared Vision client.
+        """
+        with self._lock:
+            self._check_pid()
+            if self._vision_client is None:
+                logging.info(f"Creating Vision client for pid {self._pid}")
+                self._vision_client = self._build_vision_client()
+            return self._vision_client
+
+    def openai(self):
+        """
+        Gets the process-wide OpenAI client, creating it on first use.
+
+        Returns:
+            OpenAI: The shared OpenAI client.
+        """
+        with self._lock:
+            self._check_pid()
+            if self._openai_client is None:
+                logging.info(f"Creating OpenAI client for pid {self._pid}")
+                self._openai_client = self._build_openai_client()
+            return self._openai_client
+
+    def warm_up(self) -> None:
+        """
+        Creates both clients and waits for the Vision channel to connect, so the first
+        receipt handled by a worker doesn't pay for the TLS handshake.
+
+        Failures are logged and ignored; the clients are rebuilt on first use instead.
+        """
+        try:
+            self.vision()
+            import grpc
+            grpc.channel_ready_future(self._vision_channel).result(timeout=VISION_WARMUP_TIMEOUT)
+        except Exception as e:
+            logging.warning(f"Vision client warm up failed: {str(e)}")
+
+        try:
+            self.openai()
+        except Exception as e:
+            logging.warning(f"OpenAI client warm up failed: {str(e)}")
+
+    def install(self, vision_client=None, openai_client=None) -> None:
+        """
+        Installs prebuilt clients for this process, e.g. stubs for benchmarks.
+
+        Args:
+            vision_client: The client to return from `vision()`, if given.
+            openai_client: The client to return from `openai()`, if given.
+        """
+        with self._lock:
+            self._check_pid()
+            if vision_client is not None:
+                self._vision_client = vision_client
+            if openai_client is not None:
+                self._openai_client = openai_client
+
+    def reset(self) -> None:
+        """
+        Forgets every client so the next call builds fresh ones in this process.
+        """
+        with self._lock:
+            self._pid = None
+            self._check_pid()
+
+
+client_manager = ClientManager()
+
+
+def _reinit_after_fork() -> None:
+    # The lock itself may have been held by another thread at fork time.
+    client_manager._lock = threading.Lock()
+    client_manager.reset()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reinit_after_fork)
@@ -0,0 +1,153 @@
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from typing import Any, Dict, Optional
+
+from services.receipt_jobs import (RECEIPT_JOB_STORE, RECEIPT_JOB_RETENTION, QUEUED, RUNNING, DONE, FAILED,
+                                   MemoryJobStore, FirestoreJobStore, _now)
+
+DELETION_JOB_WORKERS = int(os.getenv("DELETION_JOB_WORKERS", "2"))
+# A queued or running job whose progress hasn't moved for this long is assumed to have
+# died with its worker, and is resumed the next time its status is read.
+DELETION_JOB_STALE_AFTER = timedelta(seconds=int(os.getenv("DELETION_JOB_STALE_SECONDS", "120")))
+
+job_store = MemoryJobStore() if RECEIPT_JOB_STORE == "memory" else FirestoreJobStore("DeletionJobs")
+
+_pool_lock = threading.Lock()
+_pool: Optional[ThreadPoolExecutor] = None
+_pool_pid: Optional[int] = None
+
+
+class DeletionJobTakenOver(RuntimeError):
+    """
+    Raised in a worker whose job was claimed by another worker after it looked stale.
+    """
+
+
+def run_deletion(job_id: str, user_id: str, runner: str) -> None:
+    """
+    Deletes a user and everything under it, recording progress in the job store.
+
+    Documents that are already gone are not listed again, so running a job that was
+    interrupted picks up where it stopped. Progress is only written for pages Firestore
+    has committed, and only while the job is still claimed by `runner`, so a worker
+    that was wrongly thought dead can't count the same documents as the one that
+    resumed its job.
+
+    Args:
+        job_id (str): The job id.
+        user_id (str): The user to delete.
+        runner (str): The claim this worker holds on the job.
+    """
+    from models.database import db, delete_recursively
+    from models.user import User, invalidate_user_cache
+
+    start = time.perf_counter()
+    job = job_store.get(job_id) or {}
+    # What earlier runs had committed; documents they deleted are not listed again.
+    deleted_before = job.get("deleted", 0)
+    deleted_now = 0
+
+    def claimed(current: Dict[str, Any]) -> bool:
+        return current.get("runner") == runner
+
+    def update(data: Dict[str, Any]) -> None:
+        if not job_store.update_if(job_id, claimed, data):
+            raise DeletionJobTakenOver(f"Deletion job {job_id} was resumed by another worker")
+
+    def report(page_deleted: int) -> None:
+        nonlocal deleted_now
+        deleted_now += page_deleted
+        update({"deleted": deleted_before + deleted_now, "heartbeat_at": _now()})
+
+    try:
+        update({"status": RUNNING, "started_at": job.get("started_at") or _now(), "heartbeat_at": _now()})
+        deleted, failed = delete_recursively(db.collection(User.class_name).document(user_id), on_page=report)
+        invalidate_user_cache(user_id)
+        result: Dict[str, Any] = {
+            "deleted": deleted_before + deleted,
+            "finished_at": _now(),
+            "expire_at": _now() + RECEIPT_JOB_RETENTION,
+        }
+        if failed:
+            result.update({"status": FAILED, "error": f"Failed to delete {len(failed)} documents",
+                           "failed_documents": failed[:100]})
+        else:
+            result["status"] = DONE
+        update(result)
+        logging.info(f"Deletion job {job_id} deleted {deleted} documents in {time.perf_counter() - start:.2f}s")
+    except DeletionJobTakenOver as e:
+        logging.warning(f"{str(e)}, stopping this run")
+    except Exception as e:
+        logging.error(f"Deletion job {job_id} failed: {str(e)}", exc_info=True)
+        job_store.update_if(job_id, claimed, {
+            "status": FAILED,
+            "error": "Error deleting user",
+            "finished_at": _now(),
+            "expire_at": _now() + RECEIPT_JOB_RETENTION,
+        })
+
+
+def _get_pool() -> ThreadPoolExecutor:
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = ThreadPoolExecutor(max_workers=DELETION_JOB_WORKERS, thread_name_prefix="deletion-job")
+            _pool_pid = os.getpid()
+        return _pool
+
+
+def submit_deletion(user_id: str) -> str:
+    """
+    Records a new deletion job for a user and starts it in the background.
+
+    Args:
+        user_id (str): The user to delete.
+
+    Returns:
+        str: The job id to poll.
+    """
+    job_id = str(uuid.uuid4())
+    runner = uuid.uuid4().hex
+    job_store.create(job_id, {"job_id": job_id, "status": QUEUED, "user_id": user_id, "deleted": 0,
+                              "created_at": _now(), "heartbeat_at": _now(), "runner": runner})
+    _get_pool().submit(run_deletion, job_id, user_id, runner)
+    return job_id
+
+
+def get_deletion(job_id: str) -> Optional[Dict[str, Any]]:
+    """
+    Gets the status of a deletion job, resuming it if its worker died.
+
+    The resume is a claim on the job that only succeeds if nobody touched it since it
+    was read, so when several pollers see the same stale job only one resumes it.
+
+    Args:
+        job_id (str): The job id.
+
+    Returns:
+        Optional[Dict[str, Any]]: The job, or None if it doesn't exist.
+    """
+    job = job_store.get(job_id)
+    if job and job.get("status") in (QUEUED, RUNNING):
+        heartbeat = job.get("heartbeat_at") or job.get("created_at")
+        if heartbeat and _now() - heartbeat > DELETION_JOB_STALE_AFTER:
+            runner = uuid.uuid4().hex
+
+            def still_stale(current: Dict[str, Any]) -> bool:
+                return (current.get("status") in (QUEUED, RUNNING)
+                        and current.get("runner") == job.get("runner")
+                        and current.get("heartbeat_at") == job.get("heartbeat_at"))
+
+            if job_store.update_if(job_id, still_stale, {"status": QUEUED, "heartbeat_at": _now(), "runner": runner}):
+                logging.warning(f"Resuming stale deletion job {job_id}")
+                _get_pool().submit(run_deletion, job_id, job["user_id"], runner)
+            job = job_store.get(job_id)
+    if job:
+        # The claim token is only for the workers.
+        job.pop("runner", None)
+    return job
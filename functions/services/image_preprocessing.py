@@ -0,0 +1,205 @@
+import io
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Any, Dict, Optional, Tuple
+
+# Phone photos are far larger than Vision needs to read receipt text. These settings
+# shrink the upload while keeping small print legible.
+PREPROCESS_ENABLED = os.getenv("PREPROCESS_ENABLED", "true").lower() == "true"
+PREPROCESS_MAX_EDGE = int(os.getenv("PREPROCESS_MAX_EDGE", "1600"))
+PREPROCESS_JPEG_QUALITY = int(os.getenv("PREPROCESS_JPEG_QUALITY", "80"))
+PREPROCESS_GRAYSCALE = os.getenv("PREPROCESS_GRAYSCALE", "true").lower() == "true"
+PREPROCESS_WORKERS = int(os.getenv("PREPROCESS_WORKERS", "2"))
+# Pool processes are started by a clean forkserver (or spawned), never forked from a
+# worker that already runs request threads and gRPC channels, which can deadlock the child.
+PREPROCESS_START_METHOD = os.getenv("PREPROCESS_START_METHOD", "forkserver")
+
+
+def _preprocess(image_data: bytes, max_edge: int, quality: int, grayscale: bool) -> Tuple[Optional[bytes], float]:
+    """
+    Orients, downscales and re-encodes an image. Runs inside a pool process.
+
+    Returns:
+        Tuple[Optional[bytes], float]: The new image, or None if the original is smaller, and
+            the seconds spent. The original is never sent back to the caller, which has it.
+    """
+    from PIL import Image, ImageOps
+
+    start = time.perf_counter()
+    with Image.open(io.BytesIO(image_data)) as image:
+        # For JPEGs, let the decoder skip detail we are about to throw away.
+        image.draft("L" if grayscale else "RGB", (max_edge, max_edge))
+        image = ImageOps.exif_transpose(image)
+        image = image.convert("L" if grayscale else "RGB")
+        image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+
+        output = io.BytesIO()
+        image.save(output, format="JPEG", quality=quality, optimize=True)
+
+    result = output.getvalue()
+    return (result if len(result) < len(image_data) else None), time.perf_counter() - start
+
+
+class PreprocessStats:
+    """
+    Running totals for the preprocessing stage in this process.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.images = 0
+        self.failures = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.seconds = 0.0
+
+    def record(self, bytes_in: int, bytes_out: int, seconds: float) -> None:
+        """
+        Adds one processed image to the totals.
+
+        Args:
+            bytes_in (int): The size of the original image.
+            bytes_out (int): The size of the image sent to Vision.
+            seconds (float): Time spent preprocessing.
+        """
+        with self._lock:
+            self.images += 1
+            self.bytes_in += bytes_in
+            self.bytes_out += bytes_out
+            self.seconds += seconds
+
+    def record_failure(self) -> None:
+        """
+        Counts an image that had to be sent unchanged.
+        """
+        with self._lock:
+            self.failures += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        Gets a copy of the totals.
+
+        Returns:
+            Dict[str, Any]: The totals, with bytes saved and average time per image.
+        """
+        with self._lock:
+            return {
+                "images": self.images,
+                "failures": self.failures,
+                "bytes_in": self.bytes_in,
+                "bytes_out": self.bytes_out,
+                "bytes_saved": self.bytes_in - self.bytes_out,
+                "seconds": self.seconds,
+                "avg_ms": 1000 * self.seconds / self.images if self.images else 0.0,
+            }
+
+
+stats = PreprocessStats()
+
+_pool_lock = threading.Lock()
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_pid: Optional[int] = None
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    """
+    Gets the process pool for this worker, starting it on first use.
+    """
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            if PREPROCESS_START_METHOD in multiprocessing.get_all_start_methods():
+                context = multiprocessing.get_context(PREPROCESS_START_METHOD)
+            else:
+                context = multiprocessing.get_context("spawn")
+            _pool = ProcessPoolExecutor(max_workers=PREPROCESS_WORKERS, mp_context=context)
+            _pool_pid = os.getpid()
+        return _pool
+
+
+def _warm_up() -> None:
+    """Does nothing; runs in each pool process so it is started ahead of the first upload."""
+
+
+def start_pool() -> None:
+    """
+    Starts the forkserver and every pool process now, so the first upload doesn't pay for
+    them. ProcessPoolExecutor only starts processes when work is submitted, hence the
+    no-op tasks.
+
+    Pool processes come from the forkserver (see PREPROCESS_START_METHOD), so calling this
+    after the worker has threads or gRPC channels is safe too; it is only done early to
+    keep the startup cost out of requests.
+    """
+    if not PREPROCESS_ENABLED:
+        return
+    try:
+        pool = _get_pool()
+        for future in [pool.submit(_warm_up) for _ in range(PREPROCESS_WORKERS)]:
+            future.result()
+    except Exception as e:
+        logging.warning(f"Could not start the preprocessing pool ahead of time: {str(e)}")
+
+
+def submit(image_data: bytes) -> Future:
+    """
+    Starts preprocessing an image in the process pool.
+
+    The returned future never fails: if the image can't be processed, it resolves to the
+    original bytes.
+
+    Args:
+        image_data (bytes): The uploaded image, as bytes or a memoryview.
+
+    Returns:
+        Future: Resolves to the bytes to send to Vision.
+    """
+    result: Future = Future()
+    if not PREPROCESS_ENABLED:
+        result.set_result(image_data)
+        return result
+
+    def done(pool_future: Future) -> None:
+        try:
+            processed, seconds = pool_future.result()
+            if processed is None:
+                processed = image_data
+            stats.record(len(image_data), len(processed), seconds)
+            result.set_result(processed)
+        except Exception as e:
+            logging.warning(f"Image preprocessing failed, sending original: {str(e)}")
+            stats.record_failure()
+            result.set_result(image_data)
+
+    try:
+        pool_future = _get_pool().submit(
+            # Only memoryviews over the upload buffer need a copy to be pickled.
+            _preprocess, image_data if isinstance(image_data, bytes) else bytes(image_data), PREPROCESS_MAX_EDGE, PREPROCESS_JPEG_QUALITY, PREPROCESS_GRAYSCALE
+        )
+    except Exception as e:
+        logging.warning(f"Could not start image preprocessing, sending original: {str(e)}")
+        stats.record_failure()
+        result.set_result(image_data)
+        return result
+
+    pool_future.add_done_callback(done)
+    return result
+
+
+def preprocess_image(image_data: bytes) -> bytes:
+    """
+    Preprocesses an image and waits for the result.
+
+    Args:
+        image_data (bytes): The uploaded image.
+
+    Returns:
+        bytes: The image to send to Vision.
+    """
+    processed = submit(image_data).result()
+    logging.info(f"Preprocessed image {len(image_data)} -> {len(processed)} bytes: {stats.snapshot()}")
+    return processed
@@ -1,17 +1,21 @@
+import hashlib
 import io
 import json
 import logging
 import os
 import re
-from typing import Optional, Dict
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Optional, Dict, List, Tuple, Any, Union
 from datetime import datetime
-from google.cloud import vision
 # from google.cloud import storage
-from firebase_admin import firestore, credentials, initialize_app
-import nltk
-from nltk.tokenize import word_tokenize, sent_tokenize
-from nltk.corpus import stopwords
-from openai import OpenAI
+from services.cache import build_cache
+from services.clients import client_manager
+from services.resilience import Deadline, DeadlineExceeded, UpstreamUnavailable, call_with_retries, get_dependency
+from services import image_preprocessing
+from services.receipt_parser import parse_receipt_text, compact_receipt_text
+from services import category_classifier
 
 
 # Load environment variables
@@ -21,55 +25,123 @@ from dotenv import load_dotenv
 env_path = os.path.join(os.path.dirname(__file__), '../.env')
 load_dotenv(env_path)
 
-curr_path = os.path.dirname(__file__)
-root_path = f'{curr_path}/../'
-
-# Get the service account credentials from the environment variable
-env_string = os.getenv("SECRET_KEY_FOR_FIREBASE")
-
-# Initialize OpenAI client
-client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
-
-# Append to NLTK paths
-nltk.data.path.append(f'{root_path}nltk_data')
-
-# I had to create this to solve the issue with Google OCR not being able to find the credentials it needs.
-# This file doesn't get stored in GitHub.
-
-@lambda _: _()
-def find_files():
-    if env_string:
-        try:
-            env_json = json.loads(env_string)
-
-            json_file_path = f'{root_path}temp_google_credentials.json'
-
-            if not os.path.exists(json_file_path):
-                with open(json_file_path, 'w') as temp_file:
-                    json.dump(env_json, temp_file)
-
-            os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = os.path.abspath(json_file_path)
-        except json.JSONDecodeError:
-            print("Invalid JSON in SECRET_KEY_FOR_FIREBASE environment variable")
-    else:
-        print("SECRET_KEY_FOR_FIREBASE not found in environment variables")
-
-    # Function to check if NLTK data packages are downloaded
-
-
-def check_nltk_data(package):
-    try:
-        nltk.data.find(f'{package}')
-        return True
-    except LookupError:
-        return False
-
+# Cache of Vision results keyed by the SHA-256 of the uploaded image, so a re-uploaded
+# receipt doesn't pay for a second text_detection call.
+ocr_cache = build_cache(
+    "ocr_text",
+    max_entries=int(os.getenv("OCR_CACHE_MAX_ENTRIES", "512")),
+    max_memory_bytes=int(os.getenv("OCR_CACHE_MAX_MEMORY_BYTES", str(16 * 1024 * 1024))),
+    max_disk_bytes=int(os.getenv("OCR_CACHE_MAX_DISK_BYTES", str(256 * 1024 * 1024))),
+    ttl=float(os.getenv("OCR_CACHE_TTL", str(7 * 24 * 3600))),
+)
+
+# Bump PROMPT_VERSION whenever the prompt below changes, so cached parses made with the
+# old prompt are never returned.
+PROMPT_VERSION = "3"
+# Structured outputs ("json_schema") need gpt-4o-mini or newer. Set OPENAI_RESPONSE_FORMAT
+# to "json_object" for older models, which still guarantees valid JSON but not the schema.
+OPENAI_RECEIPT_MODEL = os.getenv("OPENAI_RECEIPT_MODEL", "gpt-4o-mini")
+OPENAI_RESPONSE_FORMAT = os.getenv("OPENAI_RESPONSE_FORMAT", "json_schema")
+OPENAI_MAX_OUTPUT_TOKENS = int(os.getenv("OPENAI_MAX_OUTPUT_TOKENS", "100"))
+# Roughly how many tokens of OCR text are sent; the rest of the receipt is compacted away.
+OCR_PROMPT_TOKEN_BUDGET = int(os.getenv("OCR_PROMPT_TOKEN_BUDGET", "300"))
+DEFAULT_CATEGORIES = ["Vehicle", "Insurance/health", "Rent/mortgage", "Meals", "Travels", "Supplies", "Cellphone", "Utilities"]
+
+# Vision accepts at most 16 images per synchronous batch_annotate_images request.
+VISION_BATCH_SIZE = min(int(os.getenv("VISION_BATCH_SIZE", "16")), 16)
+# Per-attempt timeouts and retry limits for the external calls. With a request deadline
+# each attempt also stops when the deadline does.
+VISION_TIMEOUT = float(os.getenv("VISION_TIMEOUT", "10"))
+VISION_BATCH_TIMEOUT = float(os.getenv("VISION_BATCH_TIMEOUT", "30"))
+VISION_MAX_ATTEMPTS = int(os.getenv("VISION_MAX_ATTEMPTS", "3"))
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "20"))
+OPENAI_MAX_ATTEMPTS = int(os.getenv("OPENAI_MAX_ATTEMPTS", "3"))
+# Send a second request when the first is slower than the upstream's observed p95.
+VISION_HEDGE = os.getenv("VISION_HEDGE", "false").lower() == "true"
+OPENAI_HEDGE = os.getenv("OPENAI_HEDGE", "false").lower() == "true"
+
+# Circuit breakers and adaptive bulkheads shared by every request in this worker, so a
+# degraded upstream fails fast instead of tying up the threads that serve other routes.
+vision_dependency = get_dependency("vision")
+openai_dependency = get_dependency("openai")
+
+# Upper bound on concurrent OpenAI calls made by one worker for batch uploads.
+PARSE_CONCURRENCY = int(os.getenv("PARSE_CONCURRENCY", "8"))
+
+# Threads are only started on first submit, so it is safe to create this before a fork.
+_parse_pool = ThreadPoolExecutor(max_workers=PARSE_CONCURRENCY, thread_name_prefix="receipt-parse")
+
+# Local parses at or above this confidence skip the OpenAI call.
+LOCAL_PARSE_THRESHOLD = float(os.getenv("LOCAL_PARSE_THRESHOLD", "0.9"))
+
+# Cache of OpenAI parses keyed by the normalized OCR text, prompt version, model and categories.
+parse_cache = build_cache(
+    "receipt_parse",
+    max_entries=int(os.getenv("PARSE_CACHE_MAX_ENTRIES", "2048")),
+    max_memory_bytes=int(os.getenv("PARSE_CACHE_MAX_MEMORY_BYTES", str(4 * 1024 * 1024))),
+    max_disk_bytes=int(os.getenv("PARSE_CACHE_MAX_DISK_BYTES", str(64 * 1024 * 1024))),
+    ttl=float(os.getenv("PARSE_CACHE_TTL", str(24 * 3600))),
+)
+
+
+class TokenUsage:
+    """
+    Running totals of OpenAI token usage for receipt parsing in this process.
+    """
 
-# Download NLTK data if not already present
-if not check_nltk_data('tokenizers/punkt'):
-    nltk.download('punkt')
-if not check_nltk_data('corpora/stopwords'):
-    nltk.download('stopwords')
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.failures = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    def record(self, response) -> Dict[str, int]:
+        """
+        Adds the usage reported on one completion to the totals.
+
+        Args:
+            response: The OpenAI chat completion.
+
+        Returns:
+            Dict[str, int]: The prompt and completion tokens of this call.
+        """
+        usage = getattr(response, "usage", None)
+        prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+        completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+        with self._lock:
+            self.calls += 1
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+        return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens}
+
+    def record_failure(self) -> None:
+        """
+        Counts a call whose answer couldn't be used.
+        """
+        with self._lock:
+            self.failures += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        Gets a copy of the totals.
+
+        Returns:
+            Dict[str, Any]: The totals, with the average tokens per call.
+        """
+        with self._lock:
+            calls = self.calls
+            return {
+                "calls": calls,
+                "failures": self.failures,
+                "prompt_tokens": self.prompt_tokens,
+                "completion_tokens": self.completion_tokens,
+                "avg_prompt_tokens": round(self.prompt_tokens / calls, 1) if calls else 0.0,
+                "avg_completion_tokens": round(self.completion_tokens / calls, 1) if calls else 0.0,
+            }
+
+
+token_usage = TokenUsage()
 
 # Initialize Vision client
 # client = vision.ImageAnnotatorClient()
@@ -88,41 +160,63 @@ if not check_nltk_data('corpora/stopwords'):
 #         return texts[0].description
 #     return None
 
-# def extract_receipt_data(text):
-#     """Parses the extracted text to find key receipt data."""
-#     # Implement your parsing logic here
-#     # This is a placeholder implementation
-#     lines = text.split('\n')
-#     data = {
-#         'store_name': lines[0] if lines else '',
-#         'date': '',
-#         'total': '',
-#         'items': []
-#     }
-
-#     for line in lines[1:]:
-#         if 'date' in line.lower():
-#             data['date'] = line
-#         elif 'total' in line.lower():
-#             data['total'] = line
-#         else:
-#             data['items'].append(line)
-
-#     return data
 # Initialize Vision and Firestore clients
 
 
 # storage_client = storage.Client()
 
-def extract_text(image_file):
-    vision_client = vision.ImageAnnotatorClient()
+def hash_image(image_data: bytes) -> str:
+    """Returns the SHA-256 hex digest used as the OCR cache key for an image."""
+    return hashlib.sha256(image_data).hexdigest()
+
 
-    """Detects text in the file."""
-    image = vision.Image(content=image_file)
+def extract_text(image_file, image_sha256: Optional[str] = None, deadline: Optional[Deadline] = None):
+    """Detects text in the file, reusing the cached result for an identical image.
 
-    logging.info("Detecting text in picture")
+    Args:
+        image_file (bytes): The image content.
+        image_sha256 (Optional[str]): The SHA-256 of `image_file` if the caller already computed it.
+        deadline (Optional[Deadline]): The request deadline the Vision call must finish within.
 
-    response = vision_client.text_detection(image=image)
+    Raises:
+        DeadlineExceeded: If the deadline ran out before Vision answered.
+        UpstreamUnavailable: If Vision's circuit is open or its bulkhead is full.
+    """
+    key = image_sha256 or hash_image(image_file)
+    found, text = ocr_cache.get(key)
+    if found:
+        logging.info(f"OCR cache hit for {key}: {ocr_cache.stats.snapshot()}")
+        return text
+
+    text = _detect_text(image_preprocessing.preprocess_image(image_file), deadline)
+    if text:
+        ocr_cache.set(key, text)
+    logging.info(f"OCR cache miss for {key}: {ocr_cache.stats.snapshot()}")
+    return text
+
+
+def _detect_text(image_file, deadline: Optional[Deadline] = None):
+    """Detects text in the file with the Vision API, retrying transient errors."""
+    from google.cloud import vision
+    vision_client = client_manager.vision()
+
+    image = vision.Image(content=_as_bytes(image_file))
+
+    logging.info(f"Detecting text in picture ({len(image_file)} bytes)")
+
+    start = time.perf_counter()
+    # Retries are done here, within the deadline, rather than by the client library.
+    response = call_with_retries(
+        lambda timeout: vision_client.text_detection(image=image, timeout=timeout, retry=None),
+        deadline=deadline,
+        attempt_timeout=VISION_TIMEOUT,
+        max_attempts=VISION_MAX_ATTEMPTS,
+        retryable=is_retryable_vision_error,
+        dependency=vision_dependency,
+        hedge=VISION_HEDGE,
+        name="Vision text_detection",
+    )
+    logging.info(f"Vision text_detection took {time.perf_counter() - start:.3f}s")
     logging.info(response.text_annotations)
     texts = response.text_annotations
     if not texts:
@@ -131,159 +225,345 @@ def extract_text(image_file):
        
         return texts[0].description
     
-def process_receipt_image(extracted_text):
+def normalize_ocr_text(extracted_text: str) -> str:
+    """Collapses whitespace and case so trivially different OCR dumps share a cache key."""
+    lines = (" ".join(line.split()) for line in extracted_text.casefold().splitlines())
+    return "\n".join(line for line in lines if line)
+
+
+def parse_cache_key(extracted_text: str, categories: List[str], model: str = OPENAI_RECEIPT_MODEL) -> str:
+    """Builds the parse cache key from the normalized text, prompt version, model and categories."""
+    digest = hashlib.sha256()
+    for part in (PROMPT_VERSION, model, "\x1f".join(sorted(c.casefold() for c in categories)),
+                 normalize_ocr_text(extracted_text)):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\x1e")
+    return digest.hexdigest()
+
+
+def invalidate_parse_cache() -> None:
+    """Drops every cached parse, e.g. after changing the prompt without bumping PROMPT_VERSION."""
+    parse_cache.clear()
+
+
+def process_receipt_image(extracted_text, categories: Optional[List[str]] = None, user_id: Optional[str] = None,
+                          deadline: Optional[Deadline] = None):
     """Process the extracted text using OpenAI API."""
-    list_of_categories = "Vehicle, Insurance/health, Rent/mortgage, Meals, Travels, Supplies, Cellphone, Utilities"
-    prompt = f"""
-    Given this extracted text from a receipt:
-    {extracted_text}
-    Return a JSON string with the vendor name as vendor, the date as created_at (this needs to be in this format: YYYY-MM-DD), amount without the dollar sign, and category_name from this list of categories : ({list_of_categories}). Do not include any Markdown formatting or code block syntax in your response.
+    return parse_receipt(extracted_text, categories, user_id, deadline)[0]
+
+
+def parse_receipt(extracted_text, categories: Optional[List[str]] = None,
+                  user_id: Optional[str] = None, deadline: Optional[Deadline] = None) -> Tuple[Optional[Any], bool]:
+    """Parses the extracted text locally, falling back to OpenAI (through the parse cache)
+    when the local parse isn't confident enough.
+
+    Args:
+        extracted_text (str): The text returned by `extract_text`.
+        categories (Optional[List[str]]): The categories the model may choose from.
+            Defaults to the user's categories, or `DEFAULT_CATEGORIES`.
+        user_id (Optional[str]): The user the receipt belongs to. Their transaction
+            history is used to pick the category.
+        deadline (Optional[Deadline]): The request deadline the OpenAI call must finish within.
+
+    Returns:
+        Tuple[Optional[Any], bool]: The parsed receipt and whether it came from the cache.
+
+    Raises:
+        DeadlineExceeded: If the deadline ran out before OpenAI could be called.
+    """
+    classifier = category_classifier.get_classifier(user_id) if user_id else None
+    categories = resolve_categories(categories, classifier)
+    local = local_parse(extracted_text, categories, classifier)
+    if local:
+        return local, False
+
+    key = parse_cache_key(extracted_text, categories)
+    found, parsed = parse_cache.get(key)
+    if found:
+        logging.info(f"Parse cache hit for {key}: {parse_cache.stats.snapshot()}")
+        return apply_classifier(dict(parsed), extracted_text, classifier), True
+
+    try:
+        parsed = _call_openai(extracted_text, categories, deadline)
+    except UpstreamUnavailable as e:
+        logging.warning(f"OpenAI unavailable ({str(e)}), using the local parse")
+        return degraded_parse(extracted_text, categories, classifier), False
+    # Only cache real parses; failures should be retried next time.
+    if isinstance(parsed, dict):
+        parse_cache.set(key, dict(parsed))
+    return apply_classifier(parsed, extracted_text, classifier), False
+
+
+def resolve_categories(categories: Optional[List[str]], classifier=None) -> List[str]:
+    """Returns the explicit categories, else the user's own categories, else `DEFAULT_CATEGORIES`."""
+    if categories:
+        return categories
+    if classifier is not None and classifier.categories:
+        return classifier.categories
+    return DEFAULT_CATEGORIES
+
+
+def classify(vendor: Optional[str], extracted_text, classifier) -> Optional[str]:
+    """Returns the user's category for the receipt if their classifier is confident enough."""
+    if classifier is None:
+        return None
+    category, probability = classifier.predict(vendor, extracted_text)
+    if category and probability >= category_classifier.CLASSIFIER_MIN_CONFIDENCE:
+        return category
+    return None
+
+
+def apply_classifier(parsed, extracted_text, classifier):
+    """Replaces the parsed category with the user's learned category for that vendor, if any."""
+    if isinstance(parsed, dict):
+        category = classify(parsed.get('vendor'), extracted_text, classifier)
+        if category:
+            parsed['category_name'] = category
+    return parsed
+
+
+def local_parse(extracted_text, categories: List[str], classifier=None) -> Optional[Dict[str, Any]]:
+    """Returns the local parse if it is confident and its category is one of `categories`, else None."""
+    parsed = parse_receipt_text(extracted_text)
+    allowed = {c.casefold(): c for c in categories}
+    category = classify(parsed['vendor'], extracted_text, classifier) or parsed['category_name']
+    if parsed['confidence'] < LOCAL_PARSE_THRESHOLD or not category or category.casefold() not in allowed:
+        logging.info(f"Local parse not used (confidence {parsed['confidence']}, category {category})")
+        return None
+
+    logging.info(f"Local parse used (confidence {parsed['confidence']})")
+    parsed['category_name'] = allowed[category.casefold()]
+    return parsed
+
+
+def degraded_parse(extracted_text, categories: List[str], classifier=None) -> Dict[str, Any]:
+    """Returns the local parse whatever its confidence, for when OpenAI can't be called.
+    The category is dropped unless it is one of `categories`."""
+    parsed = parse_receipt_text(extracted_text)
+    allowed = {c.casefold(): c for c in categories}
+    category = classify(parsed['vendor'], extracted_text, classifier) or parsed['category_name']
+    parsed['category_name'] = allowed.get(category.casefold()) if category else None
+    parsed['degraded'] = True
+    return parsed
+
+
+def build_receipt_messages(extracted_text, categories: List[str]) -> List[Dict[str, str]]:
+    """Builds the chat messages that ask OpenAI to parse a receipt, sending only the
+    compacted OCR lines."""
+    list_of_categories = ", ".join(categories)
+    receipt_text = compact_receipt_text(extracted_text, OCR_PROMPT_TOKEN_BUDGET)
+    return [
+        {"role": "system", "content": "You read receipts for a bookkeeping app. Reply with JSON: vendor is the store "
+                                      "name, created_at is the purchase date as YYYY-MM-DD, amount is the total paid "
+                                      "as a number without the currency sign, and category_name is one of the given categories. "
+                                      "Use null for anything the receipt doesn't show."},
+        {"role": "user", "content": f"Categories: {list_of_categories}\nReceipt:\n{receipt_text}"}
+    ]
+
+
+def receipt_response_format(categories: List[str]) -> Dict[str, Any]:
+    """Builds the `response_format` that makes OpenAI answer in the receipt schema."""
+    if OPENAI_RESPONSE_FORMAT != "json_schema":
+        return {"type": "json_object"}
+
+    nullable_string = {"type": ["string", "null"]}
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": "receipt",
+            "strict": True,
+            "schema": {
+                "type": "object",
+                "properties": {
+                    "vendor": nullable_string,
+                    "created_at": nullable_string,
+                    "amount": {"type": ["number", "null"]},
+                    "category_name": {"type": ["string", "null"], "enum": list(dict.fromkeys(categories)) + [None]},
+                },
+                "required": ["vendor", "created_at", "amount", "category_name"],
+                "additionalProperties": False,
+            },
+        },
+    }
+
+
+def receipt_completion_kwargs(extracted_text, categories: List[str]) -> Dict[str, Any]:
+    """Builds the arguments for the chat completion that parses a receipt, shared by the
+    sync and async pipelines."""
+    return {
+        "model": OPENAI_RECEIPT_MODEL,
+        "messages": build_receipt_messages(extracted_text, categories),
+        "response_format": receipt_response_format(categories),
+        "max_tokens": OPENAI_MAX_OUTPUT_TOKENS,
+        "temperature": 0,
+    }
+
+
+def decode_receipt_completion(response) -> Optional[Dict[str, Any]]:
+    """Returns the receipt parsed from an OpenAI completion and records its token usage.
+
+    Returns None, never a raw string, when the model refused or the answer isn't a JSON
+    object, so callers can always build a Transaction from the result.
     """
+    usage = token_usage.record(response)
+    message = response.choices[0].message
+    logging.info(f"OpenAI receipt parse used {usage['prompt_tokens']} prompt and "
+                 f"{usage['completion_tokens']} completion tokens: {token_usage.snapshot()}")
+
+    if getattr(message, "refusal", None):
+        token_usage.record_failure()
+        logging.error(f"OpenAI refused to parse the receipt: {message.refusal}")
+        return None
+
+    try:
+        parsed_result = json.loads(message.content)
+    except (TypeError, json.JSONDecodeError):
+        parsed_result = None
+    if not isinstance(parsed_result, dict):
+        token_usage.record_failure()
+        logging.error("Failed to parse the OpenAI response as a JSON object")
+        return None
+    return parsed_result
+
+
+def is_retryable_vision_error(error: Exception) -> bool:
+    """Tells transient Vision errors (unavailable, throttled, timed out) from bad requests."""
+    from google.api_core import exceptions
+    return isinstance(error, (exceptions.ServiceUnavailable, exceptions.TooManyRequests,
+                              exceptions.InternalServerError, exceptions.DeadlineExceeded))
 
+
+def is_retryable_openai_error(error: Exception) -> bool:
+    """Tells transient OpenAI errors (connection, timeout, rate limit, 5xx) from bad requests."""
+    import openai
+    return isinstance(error, (openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError))
+
+
+def _call_openai(extracted_text, categories: List[str], deadline: Optional[Deadline] = None) -> Optional[Dict[str, Any]]:
+    """Sends the extracted text to OpenAI and returns the parsed receipt, or None."""
+    kwargs = receipt_completion_kwargs(extracted_text, categories)
+    openai_client = client_manager.openai()
     try:
-        response = client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": "You are a skilled financial professional with detailed accounting skills."},
-                {"role": "user", "content": prompt}
-            ]
+        response = call_with_retries(
+            lambda timeout: openai_client.chat.completions.create(**kwargs, timeout=timeout),
+            deadline=deadline,
+            attempt_timeout=OPENAI_TIMEOUT,
+            max_attempts=OPENAI_MAX_ATTEMPTS,
+            retryable=is_retryable_openai_error,
+            dependency=openai_dependency,
+            hedge=OPENAI_HEDGE,
+            name="OpenAI receipt parse",
         )
-        
-        # Extract the content from the response
-        result = response.choices[0].message.content
-        
-        # Attempt to parse the result as JSON
-        try:
-            parsed_result = json.loads(result)
-            return parsed_result
-        except json.JSONDecodeError:
-            logging.error("Failed to parse the OpenAI response as JSON")
-            return result  # Return the raw string if it's not valid JSON
+        return decode_receipt_completion(response)
 
+    except (DeadlineExceeded, UpstreamUnavailable):
+        raise
     except Exception as e:
         logging.error(f"Error in OpenAI API call: {str(e)}")
         return None
 
 
-# def parse_receipt_text(text):
-#     """Parse the extracted text to find key data using regex and NLP."""
-#     subtotal, tax, total = extract_total(text)
-#     date = extract_date(text)
-
-#     print("Extracted Date:", date)
-#     print("Extracted Subtotal:", subtotal)
-#     print("Extracted Tax:", tax)
-#     print("Extracted Total:", total)
-
-#     data = {
-#         "date": date,
-#         "subtotal": subtotal,
-#         "tax": tax,
-#         "total": total,
-
-#     }
-#     return data
-
-# def extract_date(text):
-#     """Extract date using regex."""
-#     date_patterns = [
-#         r'\b\d{1,2}[/-]\d{1,2}[/-]\d{2,4}\b',
-#         r'\b\d{4}[/-]\d{1,2}[/-]\d{1,2}\b',
-#         r'\b\d{1,2}\s+\w+\s+\d{4}\b',
-#         r'\d{1,2}/\d{1,2}/\d{4}',  # MM/DD/YYYY
-#         r'\d{1,2}-\d{1,2}-\d{4}',  # MM-DD-YYYY
-#         r'\d{1,2}/\d{1,2}/\d{2}',  # MM/DD/YY
-#         r'\d{1,2}-\d{1,2}-\d{2}',  # MM-DD-YY
-#     ]
-    # for pattern in date_patterns:
-    #     match = re.search(pattern, text)
-    #     if match:
-    #         return match.group()
-    # return None
-
-
-# def extract_receipt_data(text: str) -> Dict[str, Optional[str]]:
-#     lines = text.split('\n')
-#     data = {
-#         'date': None,
-#         'subtotal': None,
-#         'tax': None,
-#         'total': None,
-#         'store_name': None,
-#         'created_at': None,
-#         'vendor': None,
-#         'amount': None
-#     }
-
-    # #Extract store name (usually in the first few lines)
-    # for i, line in enumerate(lines[:5]):
-    #     if len(line.strip()) > 0 and not re.search(r'\d', line):  # Look for non-empty lines without numbers
-    #         data['store_name'] = line.strip()
-    #         break
-    #     if i == 4 and not data['store_name']:  # If no store name found in first 5 lines, use the first non-empty line
-    #         for line in lines:
-    #             if len(line.strip()) > 0:
-    #                 data['store_name'] = line.strip()
-    #                 break
-
-    # # Extract date
-    # date_pattern = r'\b\d{1,2}[/.-]\d{1,2}[/.-]\d{2,4}\b'
-    # for line in lines:
-    #     date_match = re.search(date_pattern, line)
-    #     if date_match:
-    #         data['date'] = date_match.group()
-    #         break
-
-    # Extract subtotal, tax, and total
-    # subtotal_found = False
-    # for i, line in enumerate(lines):
-    #     # Subtotal
-    #     if re.search(r'\b(Subtotal|Sub[ -]?total|Items\s+Subtotal)\b', line, re.IGNORECASE) and not subtotal_found:
-    #         subtotal_match = re.search(r'\$?(\d+\.\d{2})', line)
-    #         if subtotal_match:
-    #             data['subtotal'] = subtotal_match.group(1)
-    #             subtotal_found = True
-    #         elif i + 1 < len(lines):
-    #             subtotal_match = re.search(r'\$?(\d+\.\d{2})', lines[i + 1])
-    #             if subtotal_match:
-    #                 data['subtotal'] = subtotal_match.group(1)
-    #                 subtotal_found = True
-
-        # # Tax
-        # if re.search(r'\b(Tax|Sales\s+Tax)\b', line, re.IGNORECASE):
-        #     tax_match = re.search(r'\$?(\d+\.\d{2})', line)
-        #     if tax_match:
-        #         data['tax'] = tax_match.group(1)
-        #     elif i + 1 < len(lines):
-        #         tax_match = re.search(r'\$?(\d+\.\d{2})', lines[i + 1])
-        #         if tax_match:
-        #             data['tax'] = tax_match.group(1)
-
-        # # Total
-        # if re.search(r'\b(Total|Grand\s+Total)\b', line, re.IGNORECASE):
-        #     total_matches = re.findall(r'\$?(\d+\.\d{2})', line)
-        #     if total_matches:
-        #         data['total'] = total_matches[-1]  # Take the last match if multiple found
-        #     elif i + 1 < len(lines):
-        #         total_matches = re.findall(r'\$?(\d+\.\d{2})', lines[i + 1])
-        #         if total_matches:
-        #             data['total'] = total_matches[-1]  # Take the last match if multiple found
-
-    # # If tax is not found, try to calculate it
-    # if data['subtotal'] and data['total'] and not data['tax']:
-    #     try:
-    #         subtotal = float(data['subtotal'])
-    #         total = float(data['total'])
-    #         calculated_tax = total - subtotal
-    #         data['tax'] = f"{calculated_tax:.2f}"
-    #     except ValueError:
-    #         pass
-
-    # data['created_at'] = data.get("date")
-    # data['vendor'] = data.get("store_name")
-    # data['amount'] = data.get("total")
-
-    # return data
+def _as_bytes(image_data) -> bytes:
+    """Vision needs real bytes; uploads arrive as memoryviews over the ingestion buffer."""
+    return image_data if isinstance(image_data, bytes) else bytes(image_data)
+
+
+def text_detection_request(image_data: bytes):
+    """Builds the Vision request that runs text detection on one image."""
+    from google.cloud import vision
+    return vision.AnnotateImageRequest(
+        image=vision.Image(content=_as_bytes(image_data)),
+        features=[vision.Feature(type_=vision.Feature.Type.TEXT_DETECTION)],
+    )
+
+
+def extract_texts(images: List[bytes], image_hashes: Optional[List[str]] = None,
+                  deadline: Optional[Deadline] = None) -> List[Union[Optional[str], Exception]]:
+    """Detects text in many images, sending cache misses to Vision in batches.
+
+    Args:
+        images (List[bytes]): The image contents.
+        image_hashes (Optional[List[str]]): The SHA-256 of each image, if already computed.
+        deadline (Optional[Deadline]): The request deadline every Vision batch must finish within.
+
+    Returns:
+        List[Union[Optional[str], Exception]]: The text of each image in the original order,
+            None when no text was found, or the exception raised for that image
+            (DeadlineExceeded for the batches the deadline left no time for).
+    """
+    keys = image_hashes or [hash_image(image) for image in images]
+    results: List[Union[Optional[str], Exception]] = [None] * len(images)
+    misses = []
+    for i, key in enumerate(keys):
+        found, text = ocr_cache.get(key)
+        if found:
+            results[i] = text
+        else:
+            misses.append(i)
+
+    # Start shrinking every miss at once; the pool works through them while batches go out.
+    preprocessed = {i: image_preprocessing.submit(images[i]) for i in misses}
+
+    for start in range(0, len(misses), VISION_BATCH_SIZE):
+        chunk = misses[start:start + VISION_BATCH_SIZE]
+        try:
+            requests = [text_detection_request(preprocessed[i].result()) for i in chunk]
+            response = call_with_retries(
+                lambda timeout: client_manager.vision().batch_annotate_images(requests=requests, timeout=timeout, retry=None),
+                deadline=deadline,
+                attempt_timeout=VISION_BATCH_TIMEOUT,
+                max_attempts=VISION_MAX_ATTEMPTS,
+                retryable=is_retryable_vision_error,
+                name="Vision batch_annotate_images",
+                dependency=vision_dependency,
+            )
+        except Exception as e:
+            logging.error(f"Vision batch request failed: {str(e)}")
+            for i in chunk:
+                results[i] = e
+            continue
+
+        for i, image_response in zip(chunk, response.responses):
+            if image_response.error.message:
+                results[i] = RuntimeError(image_response.error.message)
+            elif image_response.text_annotations:
+                results[i] = image_response.text_annotations[0].description
+                ocr_cache.set(keys[i], results[i])
+
+    logging.info(f"OCR batch of {len(images)} images, {len(misses)} sent to Vision: {ocr_cache.stats.snapshot()}")
+    return results
+
+
+def parse_receipts(texts: List[str], categories: Optional[List[str]] = None, user_id: Optional[str] = None,
+                   deadline: Optional[Deadline] = None) -> List[Union[Tuple[Optional[Any], bool], Exception]]:
+    """Parses many OCR texts concurrently on the bounded parse pool.
+
+    Args:
+        texts (List[str]): The texts returned by `extract_texts`.
+        categories (Optional[List[str]]): The categories the model may choose from.
+        user_id (Optional[str]): The user the receipts belong to.
+        deadline (Optional[Deadline]): The request deadline every parse must finish within.
+
+    Returns:
+        List[Union[Tuple[Optional[Any], bool], Exception]]: The `parse_receipt` result for
+            each text in the original order, or the exception raised for that text
+            (DeadlineExceeded for the parses still waiting when the deadline ran out).
+    """
+    if user_id:
+        # Train the user's classifier once here rather than racing to do it in every thread.
+        category_classifier.get_classifier(user_id)
+    futures = [_parse_pool.submit(parse_receipt, text, categories, user_id, deadline) for text in texts]
+    results = []
+    for future in futures:
+        try:
+            results.append(future.result(timeout=deadline.remaining() if deadline else None))
+        except FutureTimeoutError:
+            # Parses that haven't started yet are dropped; running ones stop at their own deadline.
+            future.cancel()
+            results.append(DeadlineExceeded(f"Request deadline of {deadline.seconds}s exceeded"))
+        except Exception as e:
+            results.append(e)
+    return results
 
 
 # def store_receipt_data(collection_name, document_data):
@@ -0,0 +1,257 @@
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, Optional
+
+# Where job status lives: "firestore" is shared by every worker and the queue consumers,
+# "memory" only works when one process both accepts and runs jobs (local runs).
+RECEIPT_JOB_STORE = os.getenv("RECEIPT_JOB_STORE", "firestore")
+# How jobs are handed to workers: "local" runs them on a thread pool in the web process,
+# "pubsub" publishes them for receipt_worker.py (works with the Pub/Sub emulator).
+RECEIPT_JOB_QUEUE = os.getenv("RECEIPT_JOB_QUEUE", "local")
+RECEIPT_JOB_WORKERS = int(os.getenv("RECEIPT_JOB_WORKERS", "4"))
+# Jobs have no client waiting on the connection, so they get a longer budget than requests.
+RECEIPT_JOB_DEADLINE_SECONDS = float(os.getenv("RECEIPT_JOB_DEADLINE_SECONDS", "120"))
+RECEIPT_JOBS_TOPIC = os.getenv("RECEIPT_JOBS_TOPIC", "receipt-jobs")
+RECEIPT_JOBS_SUBSCRIPTION = os.getenv("RECEIPT_JOBS_SUBSCRIPTION", "receipt-jobs-worker")
+# Pub/Sub rejects messages over 10 MB, attributes included, so bigger images can't be
+# queued with RECEIPT_JOB_QUEUE=pubsub. A little is kept back for the attributes.
+PUBSUB_MAX_MESSAGE_BYTES = 10 * 1000 * 1000
+MAX_QUEUED_IMAGE_BYTES = PUBSUB_MAX_MESSAGE_BYTES - 4 * 1024
+# Finished jobs carry an expire_at field for a Firestore TTL policy.
+RECEIPT_JOB_RETENTION = timedelta(hours=int(os.getenv("RECEIPT_JOB_RETENTION_HOURS", "24")))
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class MemoryJobStore:
+    """
+    Keeps job status in this process.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+
+    def create(self, job_id: str, data: Dict[str, Any]) -> None:
+        with self._lock:
+            self._jobs[job_id] = dict(data)
+
+    def update(self, job_id: str, data: Dict[str, Any]) -> None:
+        with self._lock:
+            self._jobs.setdefault(job_id, {}).update(data)
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def update_if(self, job_id: str, check: Callable[[Dict[str, Any]], bool], data: Dict[str, Any]) -> bool:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or not check(dict(job)):
+                return False
+            job.update(data)
+            return True
+
+
+class FirestoreJobStore:
+    """
+    Keeps job status in a Firestore collection, ReceiptJobs by default, visible to every worker.
+    """
+
+    class_name = "ReceiptJobs"
+
+    def __init__(self, class_name: Optional[str] = None):
+        if class_name:
+            self.class_name = class_name
+
+    def _collection(self):
+        from models.database import db
+        return db.collection(self.class_name)
+
+    def create(self, job_id: str, data: Dict[str, Any]) -> None:
+        self._collection().document(job_id).set(data)
+
+    def update(self, job_id: str, data: Dict[str, Any]) -> None:
+        self._collection().document(job_id).set(data, merge=True)
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        doc = self._collection().document(job_id).get()
+        return doc.to_dict() if doc.exists else None
+
+    def update_if(self, job_id: str, check: Callable[[Dict[str, Any]], bool], data: Dict[str, Any]) -> bool:
+        """
+        Updates a job only if `check` accepts it and nobody writes it in between.
+
+        Returns:
+            bool: Whether the job was updated.
+        """
+        from google.api_core import exceptions
+        from models.database import db
+
+        doc_ref = self._collection().document(job_id)
+        snapshot = doc_ref.get()
+        if not snapshot.exists or not check(snapshot.to_dict()):
+            return False
+        try:
+            doc_ref.update(data, option=db.write_option(last_update_time=snapshot.update_time))
+        except exceptions.FailedPrecondition:
+            return False
+        return True
+
+
+job_store = MemoryJobStore() if RECEIPT_JOB_STORE == "memory" else FirestoreJobStore()
+
+_pool_lock = threading.Lock()
+_pool: Optional[ThreadPoolExecutor] = None
+_pool_pid: Optional[int] = None
+_publisher = None
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def run_job(job_id: str, image_data: bytes, image_sha256: Optional[str] = None, user_id: Optional[str] = None) -> None:
+    """
+    Runs OCR and parsing for a job and records the outcome in the job store.
+
+    Args:
+        job_id (str): The job id.
+        image_data (bytes): The image content.
+        image_sha256 (Optional[str]): The SHA-256 of `image_data` if already computed.
+        user_id (Optional[str]): The user the receipt belongs to.
+    """
+    from models.transaction import Transaction
+    from services.ocr_service import extract_text, parse_receipt
+    from services.resilience import Deadline
+
+    start = time.perf_counter()
+    job_store.update(job_id, {"status": RUNNING, "started_at": _now()})
+    deadline = Deadline(RECEIPT_JOB_DEADLINE_SECONDS)
+    try:
+        extracted_text = extract_text(image_data, image_sha256, deadline)
+        if not extracted_text:
+            job_store.update(job_id, {
+                "status": FAILED,
+                "error": "No text detected",
+                "finished_at": _now(),
+                "expire_at": _now() + RECEIPT_JOB_RETENTION,
+            })
+            return
+
+        parsed_data, from_cache = parse_receipt(extracted_text, user_id=user_id, deadline=deadline)
+        result = Transaction(parsed_data).serialize()
+        result['parsed_from_cache'] = from_cache
+        job_store.update(job_id, {
+            "status": DONE,
+            "result": result,
+            "finished_at": _now(),
+            "expire_at": _now() + RECEIPT_JOB_RETENTION,
+        })
+        logging.info(f"Receipt job {job_id} done in {time.perf_counter() - start:.2f}s")
+    except Exception as e:
+        logging.error(f"Receipt job {job_id} failed: {str(e)}", exc_info=True)
+        job_store.update(job_id, {
+            "status": FAILED,
+            "error": "Error processing image",
+            "finished_at": _now(),
+            "expire_at": _now() + RECEIPT_JOB_RETENTION,
+        })
+
+
+def _get_pool() -> ThreadPoolExecutor:
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = ThreadPoolExecutor(max_workers=RECEIPT_JOB_WORKERS, thread_name_prefix="receipt-job")
+            _pool_pid = os.getpid()
+        return _pool
+
+
+def _get_publisher():
+    global _publisher
+    if _publisher is None:
+        from google.cloud import pubsub_v1
+        from services.clients import google_credentials
+        _publisher = pubsub_v1.PublisherClient(credentials=google_credentials())
+    return _publisher
+
+
+def topic_path() -> str:
+    """Gets the full name of the receipt jobs topic."""
+    return _get_publisher().topic_path(_project_id(), RECEIPT_JOBS_TOPIC)
+
+
+def _project_id() -> str:
+    return os.getenv("GOOGLE_CLOUD_PROJECT") or os.getenv("GCLOUD_PROJECT") or "simplitracapp"
+
+
+def submit_job(image_data: bytes, image_sha256: Optional[str] = None, user_id: Optional[str] = None) -> str:
+    """
+    Records a new job and queues it.
+
+    Args:
+        image_data (bytes): The image content.
+        image_sha256 (Optional[str]): The SHA-256 of `image_data` if already computed.
+        user_id (Optional[str]): The user the receipt belongs to.
+
+    Returns:
+        str: The job id to poll.
+
+    Raises:
+        UploadTooLarge: If the image is too big to publish, before any job is recorded.
+        Exception: If publishing fails; the job is marked failed first.
+    """
+    from services.upload_ingestion import UploadTooLarge
+
+    if RECEIPT_JOB_QUEUE == "pubsub" and len(image_data) > MAX_QUEUED_IMAGE_BYTES:
+        raise UploadTooLarge(MAX_QUEUED_IMAGE_BYTES)
+
+    job_id = str(uuid.uuid4())
+    job_store.create(job_id, {"job_id": job_id, "status": QUEUED, "user_id": user_id, "created_at": _now()})
+    image_data = bytes(image_data)
+
+    if RECEIPT_JOB_QUEUE == "pubsub":
+        attributes = {"job_id": job_id}
+        if image_sha256:
+            attributes["image_sha256"] = image_sha256
+        if user_id:
+            attributes["user_id"] = user_id
+        try:
+            _get_publisher().publish(topic_path(), image_data, **attributes).result()
+        except Exception as e:
+            # Otherwise the job would stay queued forever with nothing to run it.
+            logging.error(f"Failed to publish receipt job {job_id}: {str(e)}")
+            job_store.update(job_id, {
+                "status": FAILED,
+                "error": "Could not queue the receipt",
+                "finished_at": _now(),
+                "expire_at": _now() + RECEIPT_JOB_RETENTION,
+            })
+            raise
+    else:
+        _get_pool().submit(run_job, job_id, image_data, image_sha256, user_id)
+
+    return job_id
+
+
+def get_job(job_id: str) -> Optional[Dict[str, Any]]:
+    """
+    Gets the status of a job.
+
+    Args:
+        job_id (str): The job id.
+
+    Returns:
+        Optional[Dict[str, Any]]: The job, or None if it doesn't exist.
+    """
+    return job_store.get(job_id)
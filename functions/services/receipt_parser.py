@@ -0,0 +1,277 @@
+import re
+from datetime import date
+from typing import Optional, Dict, Any, List, Tuple
+
+# Receipts from big chains follow predictable layouts, so vendor, date and total can be
+# read with a few regexes. Every pattern is compiled once at import.
+
+_AMOUNT = re.compile(r'(?<![\d.])\$?\s*((?:\d{1,3}(?:,\d{3})+|\d+)\.\d{2})(?![\d])')
+
+# Labels for the amount actually paid, strongest first.
+_TOTAL_LABELS: List[Tuple[re.Pattern, float]] = [
+    (re.compile(r'\b(grand\s+total|amount\s+due|balance\s+due|total\s+due)\b', re.IGNORECASE), 1.0),
+    (re.compile(r'^\s*total\b', re.IGNORECASE), 0.9),
+    (re.compile(r'\btotal\b', re.IGNORECASE), 0.7),
+]
+_NOT_TOTAL = re.compile(r'\b(sub[ -]?total|total\s+(tax|savings|discount|items?)|tax\s+total|you\s+saved|change)\b',
+                        re.IGNORECASE)
+
+_MONTHS = {
+    'jan': 1, 'feb': 2, 'mar': 3, 'apr': 4, 'may': 5, 'jun': 6,
+    'jul': 7, 'aug': 8, 'sep': 9, 'oct': 10, 'nov': 11, 'dec': 12,
+}
+_DATE_PATTERNS: List[Tuple[re.Pattern, str]] = [
+    (re.compile(r'\b(\d{4})[/.-](\d{1,2})[/.-](\d{1,2})\b'), 'ymd'),
+    (re.compile(r'\b(\d{1,2})[/.-](\d{1,2})[/.-](\d{4})\b'), 'mdy'),
+    (re.compile(r'\b(\d{1,2})[/.-](\d{1,2})[/.-](\d{2})\b'), 'mdy'),
+    (re.compile(r'\b(\d{1,2})\s+(jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]*\.?,?\s+(\d{4})\b', re.IGNORECASE), 'dMy'),
+    (re.compile(r'\b(jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]*\.?\s+(\d{1,2}),?\s+(\d{4})\b', re.IGNORECASE), 'Mdy'),
+]
+
+# Header lines that are never the store name.
+_NOT_VENDOR = re.compile(
+    r'(welcome|thank|receipt|invoice|store\s*#|st#|tel|phone|www\.|\.com|http|cashier|register|'
+    r'\b(street|st|ave|avenue|rd|road|blvd|suite|ste|hwy|dr)\b\.?)',
+    re.IGNORECASE,
+)
+_LETTERS = re.compile(r'[A-Za-z]')
+_DIGITS = re.compile(r'\d')
+
+# Chains we recognise anywhere in the header, with their usual category.
+KNOWN_VENDORS: Dict[str, Optional[str]] = {
+    'walmart': 'Supplies',
+    'target': 'Supplies',
+    'costco': 'Supplies',
+    'home depot': 'Supplies',
+    "lowe's": 'Supplies',
+    'staples': 'Supplies',
+    'office depot': 'Supplies',
+    'walgreens': None,
+    'cvs': None,
+    'starbucks': 'Meals',
+    "mcdonald's": 'Meals',
+    'chipotle': 'Meals',
+    'subway': 'Meals',
+    'panera': 'Meals',
+    'shell': 'Vehicle',
+    'chevron': 'Vehicle',
+    'exxon': 'Vehicle',
+    'bp': 'Vehicle',
+    'marriott': 'Travels',
+    'hilton': 'Travels',
+    'verizon': 'Cellphone',
+    't-mobile': 'Cellphone',
+    'at&t': 'Cellphone',
+}
+_KNOWN_VENDOR = re.compile(
+    r'\b(' + '|'.join(re.escape(name).replace("'", "'?") for name in sorted(KNOWN_VENDORS, key=len, reverse=True)) + r')\b',
+    re.IGNORECASE,
+)
+
+# How much each field adds to the confidence score.
+_VENDOR_WEIGHT = 0.3
+_DATE_WEIGHT = 0.3
+_TOTAL_WEIGHT = 0.4
+
+_HEADER_LINES = 6
+
+# Footer and marketing lines that never hold the vendor, date or total.
+_BOILERPLATE = re.compile(
+    r'(thank\s*you|come\s+again|survey|feedback|return\s+policy|returns?\s+(within|accepted)|'
+    r'receipt\s+required|www\.|http|\.com\b|rewards?|member\s*(ship|#)|items?\s+sold|'
+    r'approval|auth(orization)?\s*(code|#)|terminal|trans(action)?\s*#|ref\s*#|aid\s*:|'
+    r'[*xX]{4,}\d{4})',
+    re.IGNORECASE,
+)
+_PAYMENT = re.compile(r'\b(cash|visa|mastercard|amex|discover|debit|credit|paid|tender)\b', re.IGNORECASE)
+# Rough size of a token in English OCR text, used to turn token budgets into characters.
+CHARS_PER_TOKEN = 4
+
+
+def parse_amount(text: str) -> Optional[float]:
+    """
+    Gets the last money amount in a line.
+
+    Args:
+        text (str): A line of receipt text.
+
+    Returns:
+        Optional[float]: The amount, e.g. 1234.56 for "$1,234.56", or None.
+    """
+    matches = _AMOUNT.findall(text)
+    return float(matches[-1].replace(',', '')) if matches else None
+
+
+def extract_total(lines: List[str]) -> Tuple[Optional[float], float]:
+    """
+    Finds the amount paid.
+
+    Args:
+        lines (List[str]): The receipt lines.
+
+    Returns:
+        Tuple[Optional[float], float]: The total and how sure we are of it, from 0 to 1.
+    """
+    best: Tuple[Optional[float], float] = (None, 0.0)
+    for i, line in enumerate(lines):
+        if _NOT_TOTAL.search(line):
+            continue
+        for pattern, score in _TOTAL_LABELS:
+            if pattern.search(line):
+                amount = parse_amount(line)
+                if amount is None and i + 1 < len(lines):
+                    # Some layouts print the amount on the line below the label.
+                    amount = parse_amount(lines[i + 1])
+                    score -= 0.1
+                # Later totals win ties: the grand total comes after the per-section ones.
+                if amount is not None and score >= best[1]:
+                    best = (amount, score)
+                break
+    return best
+
+
+def _make_date(year: int, month: int, day: int) -> Optional[date]:
+    if year < 100:
+        year += 2000
+    try:
+        value = date(year, month, day)
+    except ValueError:
+        return None
+    if value.year < 2000 or value > date.today():
+        return None
+    return value
+
+
+def extract_date(lines: List[str]) -> Tuple[Optional[str], float]:
+    """
+    Finds the purchase date. Numeric dates are read month first, as on US receipts.
+
+    Args:
+        lines (List[str]): The receipt lines.
+
+    Returns:
+        Tuple[Optional[str], float]: The date as YYYY-MM-DD and how sure we are of it.
+    """
+    for line in lines:
+        for pattern, order in _DATE_PATTERNS:
+            match = pattern.search(line)
+            if not match:
+                continue
+            a, b, c = match.groups()
+            if order == 'ymd':
+                value = _make_date(int(a), int(b), int(c))
+            elif order == 'mdy':
+                value = _make_date(int(c), int(a), int(b)) or _make_date(int(c), int(b), int(a))
+            elif order == 'dMy':
+                value = _make_date(int(c), _MONTHS[b[:3].lower()], int(a))
+            else:
+                value = _make_date(int(c), _MONTHS[a[:3].lower()], int(b))
+            if value:
+                return value.isoformat(), 1.0
+    return None, 0.0
+
+
+def extract_vendor(lines: List[str]) -> Tuple[Optional[str], float, Optional[str]]:
+    """
+    Finds the store name, looking for a known chain first and then at the header lines.
+
+    Args:
+        lines (List[str]): The receipt lines.
+
+    Returns:
+        Tuple[Optional[str], float, Optional[str]]: The vendor, how sure we are of it, and
+            the usual category for a known chain.
+    """
+    header = lines[:_HEADER_LINES]
+    for line in header:
+        match = _KNOWN_VENDOR.search(line)
+        if match:
+            name = match.group(1).lower().replace("'", "")
+            for known, category in KNOWN_VENDORS.items():
+                if known.replace("'", "") == name:
+                    return known, 1.0, category
+
+    for line in header:
+        stripped = line.strip()
+        if len(stripped) < 3 or not _LETTERS.search(stripped) or _NOT_VENDOR.search(stripped):
+            continue
+        if len(_DIGITS.findall(stripped)) > len(stripped) // 3:
+            continue
+        return stripped, 0.7, None
+    return None, 0.0, None
+
+
+def parse_receipt_text(text: str) -> Dict[str, Any]:
+    """
+    Parses OCR text from a receipt without calling any API.
+
+    Args:
+        text (str): The text returned by Vision.
+
+    Returns:
+        Dict[str, Any]: The receipt in the same shape as the OpenAI parse (`vendor`,
+            `created_at`, `amount`, `category_name`) plus `confidence`, from 0 to 1.
+    """
+    lines = [line for line in text.splitlines() if line.strip()]
+    vendor, vendor_score, category = extract_vendor(lines)
+    created_at, date_score = extract_date(lines)
+    amount, total_score = extract_total(lines)
+
+    return {
+        'vendor': vendor,
+        'created_at': created_at,
+        'amount': amount,
+        'category_name': category,
+        'confidence': round(_VENDOR_WEIGHT * vendor_score + _DATE_WEIGHT * date_score + _TOTAL_WEIGHT * total_score, 3),
+    }
+
+
+def compact_receipt_text(text: str, token_budget: int) -> str:
+    """
+    Shrinks OCR text to the lines that can hold the vendor, date and total, so the
+    model reads a few dozen tokens instead of the whole receipt.
+
+    Item lines and boilerplate are dropped. If the kept lines are still over budget,
+    totals are kept first, then dates, then the header.
+
+    Args:
+        text (str): The text returned by Vision.
+        token_budget (int): The most tokens the result should take, roughly.
+
+    Returns:
+        str: The kept lines, in their original order.
+    """
+    lines = [" ".join(line.split()) for line in text.splitlines()]
+    lines = [line for line in lines if line]
+    budget = token_budget * CHARS_PER_TOKEN
+    if sum(len(line) + 1 for line in lines) <= budget:
+        return "\n".join(lines)
+
+    # Lower rank is kept first.
+    ranks: Dict[int, int] = {}
+
+    def keep(index: int, rank: int) -> None:
+        if 0 <= index < len(lines):
+            ranks[index] = min(rank, ranks.get(index, rank))
+
+    for i, line in enumerate(lines):
+        if any(pattern.search(line) for pattern, _ in _TOTAL_LABELS) and not _NOT_TOTAL.search(line):
+            keep(i, 0)
+            if parse_amount(line) is None:
+                keep(i + 1, 0)
+        elif any(pattern.search(line) for pattern, _ in _DATE_PATTERNS):
+            keep(i, 1)
+        elif i < _HEADER_LINES and not _BOILERPLATE.search(line) and parse_amount(line) is None:
+            keep(i, 2)
+        elif _PAYMENT.search(line) and parse_amount(line) is not None:
+            # The amount tendered is a fallback when the total line was misread.
+            keep(i, 3)
+
+    kept = []
+    used = 0
+    for i in sorted(ranks, key=lambda index: (ranks[index], index)):
+        if used + len(lines[i]) + 1 > budget:
+            continue
+        kept.append(i)
+        used += len(lines[i]) + 1
+    return "\n".join(lines[i] for i in sorted(kept))
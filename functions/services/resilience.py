@@ -0,0 +1,590 @@
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Awaitable, Callable, Optional, TypeVar
+
+T = TypeVar("T")
+
+# Total time one receipt upload may spend on Vision and OpenAI, retries included.
+RECEIPT_DEADLINE_SECONDS = float(os.getenv("RECEIPT_DEADLINE_SECONDS", "30"))
+# The same for a whole multi-file upload, whose Vision batches and parses overlap.
+RECEIPT_BATCH_DEADLINE_SECONDS = float(os.getenv("RECEIPT_BATCH_DEADLINE_SECONDS", "60"))
+# Attempts whose remaining budget is below this are not started.
+MIN_ATTEMPT_SECONDS = float(os.getenv("MIN_ATTEMPT_SECONDS", "0.25"))
+RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", "0.2"))
+RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", "2"))
+# Hedged calls run on this pool so the caller can return whichever request finishes first.
+HEDGE_POOL_SIZE = int(os.getenv("HEDGE_POOL_SIZE", "32"))
+# Latencies needed before a p95 is trusted for hedging.
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+# How often a coroutine waiting for a bulkhead slot checks again; see acquire_async.
+ASYNC_SLOT_POLL_SECONDS = 0.01
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+def _env(prefix: str, name: str, default: str) -> float:
+    """Reads `<PREFIX>_<NAME>`, falling back to `<NAME>` and then the default."""
+    return float(os.getenv(f"{prefix}_{name}", os.getenv(name, default)))
+
+
+class DeadlineExceeded(TimeoutError):
+    """
+    Raised when a request has no time left for another call.
+    """
+
+
+class UpstreamUnavailable(RuntimeError):
+    """
+    Raised without calling an upstream that is known to be failing or saturated.
+    """
+
+    def __init__(self, message: str, retry_after: float = 1.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CircuitOpen(UpstreamUnavailable):
+    """
+    Raised when a dependency's circuit breaker is open.
+    """
+
+
+class BulkheadFull(UpstreamUnavailable):
+    """
+    Raised when every call slot of a dependency stayed busy for the whole queue wait.
+    """
+
+
+class Deadline:
+    """
+    The time budget of one request, shared by every external call it makes.
+    """
+
+    def __init__(self, seconds: float = RECEIPT_DEADLINE_SECONDS):
+        """
+        Starts the clock.
+
+        Args:
+            seconds (float): How long the request may take from now.
+        """
+        self.seconds = seconds
+        self._expires_at = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        """Gets the seconds left, never below zero."""
+        return max(0.0, self._expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        """Checks whether the budget is used up."""
+        return self.remaining() <= 0
+
+    def timeout(self, cap: Optional[float] = None) -> float:
+        """
+        Gets the timeout for the next call: the time left, capped at `cap`.
+
+        Args:
+            cap (Optional[float]): The longest a single call should take.
+
+        Returns:
+            float: The timeout in seconds.
+
+        Raises:
+            DeadlineExceeded: If too little time is left to start a call.
+        """
+        remaining = self.remaining()
+        if remaining < MIN_ATTEMPT_SECONDS:
+            raise DeadlineExceeded(f"Request deadline of {self.seconds}s exceeded")
+        return min(remaining, cap) if cap else remaining
+
+
+class LatencyTracker:
+    """
+    Keeps the latest successful call latencies of one upstream to estimate its p95.
+    """
+
+    def __init__(self, window: int = 200):
+        self._lock = threading.Lock()
+        self._samples = deque(maxlen=window)
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def record(self, seconds: float) -> None:
+        """
+        Adds the latency of a successful call.
+
+        Args:
+            seconds (float): How long the call took.
+        """
+        with self._lock:
+            self._samples.append(seconds)
+
+    def record_hedge(self, won: bool = False) -> None:
+        """
+        Counts a hedged request, or a hedged request that answered first.
+
+        Args:
+            won (bool): Whether the hedge beat the original request.
+        """
+        with self._lock:
+            if won:
+                self.hedge_wins += 1
+            else:
+                self.hedges += 1
+
+    def p95(self) -> Optional[float]:
+        """
+        Gets the 95th percentile latency.
+
+        Returns:
+            Optional[float]: The p95 in seconds, or None with too few samples.
+        """
+        with self._lock:
+            if len(self._samples) < HEDGE_MIN_SAMPLES:
+                return None
+            samples = sorted(self._samples)
+        return samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+
+    def snapshot(self):
+        """Gets the p95, sample count and how often hedges fired and won."""
+        with self._lock:
+            count = len(self._samples)
+            hedges, wins = self.hedges, self.hedge_wins
+        return {"samples": count, "p95": self.p95(), "hedges": hedges, "hedge_wins": wins}
+
+
+class CircuitBreaker:
+    """
+    Stops calling a dependency whose recent calls mostly failed.
+
+    The breaker opens when the failure rate over the last `window` calls reaches
+    `failure_rate`. While open every call fails fast. After `reset_timeout` one probe call
+    is let through (half open); it closes the breaker on success and reopens it on failure.
+    """
+
+    def __init__(self, name: str, failure_rate: float = 0.5, min_calls: int = 10, window: int = 50,
+                 reset_timeout: float = 30.0):
+        self.name = name
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._outcomes = deque(maxlen=window)
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        """Gets the breaker state: closed, open or half_open."""
+        with self._lock:
+            if self._state == OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                return HALF_OPEN
+            return self._state
+
+    def allow(self) -> None:
+        """
+        Lets a call through, or fails fast.
+
+        Raises:
+            CircuitOpen: If the breaker is open, or half open with a probe already out.
+        """
+        with self._lock:
+            if self._state == CLOSED:
+                return
+            waited = time.monotonic() - self._opened_at
+            if self._state == OPEN and waited >= self.reset_timeout:
+                self._state = HALF_OPEN
+            if self._state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return
+            retry_after = max(1.0, self.reset_timeout - waited)
+        raise CircuitOpen(f"{self.name} circuit is open", retry_after)
+
+    def record(self, success: bool) -> None:
+        """
+        Records the outcome of an allowed call.
+
+        Args:
+            success (bool): False if the dependency failed (5xx, throttled, timed out).
+        """
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._probing = False
+                if success:
+                    self._state = CLOSED
+                    self._outcomes.clear()
+                    logging.info(f"{self.name} circuit closed")
+                else:
+                    self._trip()
+                return
+
+            self._outcomes.append(success)
+            failures = self._outcomes.count(False)
+            if (self._state == CLOSED and len(self._outcomes) >= self.min_calls
+                    and failures / len(self._outcomes) >= self.failure_rate):
+                self._trip()
+
+    def cancel(self) -> None:
+        """
+        Forgets an allowed call that was never made, so a half open breaker can probe again.
+        """
+        with self._lock:
+            self._probing = False
+
+    def _trip(self) -> None:
+        # Must be called with the lock held.
+        self._state = OPEN
+        self._opened_at = time.monotonic()
+        logging.warning(f"{self.name} circuit opened for {self.reset_timeout}s")
+
+
+class AdaptiveLimiter:
+    """
+    A bulkhead whose size adapts to the dependency, additive increase and multiplicative
+    decrease (AIMD) style.
+
+    Each fast success adds about one slot per `limit` calls; a throttled, failed or slow
+    call halves the limit. The limit stays between `min_limit` and `max_limit`, so one
+    slow dependency can never take every worker thread. Calls over the limit wait up to
+    `max_wait` for a slot.
+    """
+
+    def __init__(self, name: str, initial: int = 8, min_limit: int = 1, max_limit: int = 16,
+                 latency_target: float = 5.0, max_wait: float = 1.0):
+        self.name = name
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_target = latency_target
+        self.max_wait = max_wait
+        self._condition = threading.Condition()
+        self._limit = float(max(min_limit, min(initial, max_limit)))
+        self._in_flight = 0
+        self.rejected = 0
+
+    @property
+    def limit(self) -> int:
+        """Gets the number of calls currently allowed at once."""
+        return int(self._limit)
+
+    def acquire(self, timeout: Optional[float] = None) -> None:
+        """
+        Takes a call slot, waiting up to `max_wait` (or `timeout` if shorter).
+
+        Args:
+            timeout (Optional[float]): The longest the caller can wait, e.g. its deadline.
+
+        Raises:
+            BulkheadFull: If no slot was freed in time.
+        """
+        wait_for = self.max_wait if timeout is None else min(self.max_wait, timeout)
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._in_flight < int(self._limit), timeout=wait_for):
+                self.rejected += 1
+                raise BulkheadFull(f"{self.name} has {self._in_flight} calls in flight (limit {int(self._limit)})")
+            self._in_flight += 1
+
+    async def acquire_async(self, timeout: Optional[float] = None) -> None:
+        """
+        Takes a call slot like `acquire`, for coroutines: it waits without blocking the
+        event loop, and a coroutine cancelled while waiting holds no slot.
+
+        Args:
+            timeout (Optional[float]): The longest the caller can wait, e.g. its deadline.
+
+        Raises:
+            BulkheadFull: If no slot was freed in time.
+        """
+        expires_at = time.monotonic() + (self.max_wait if timeout is None else min(self.max_wait, timeout))
+        while True:
+            with self._condition:
+                if self._in_flight < int(self._limit):
+                    self._in_flight += 1
+                    return
+                if time.monotonic() >= expires_at:
+                    self.rejected += 1
+                    raise BulkheadFull(f"{self.name} has {self._in_flight} calls in flight (limit {int(self._limit)})")
+            await asyncio.sleep(ASYNC_SLOT_POLL_SECONDS)
+
+    def release(self, seconds: float, overloaded: bool) -> None:
+        """
+        Gives a slot back and adjusts the limit.
+
+        Args:
+            seconds (float): How long the call took.
+            overloaded (bool): Whether the dependency throttled, failed or timed out.
+        """
+        with self._condition:
+            self._in_flight -= 1
+            if overloaded or seconds > self.latency_target:
+                self._limit = max(self.min_limit, self._limit / 2)
+            else:
+                self._limit = min(self.max_limit, self._limit + 1 / self._limit)
+            self._condition.notify_all()
+
+    def snapshot(self):
+        """Gets the limit, calls in flight and calls rejected."""
+        with self._condition:
+            return {"limit": int(self._limit), "in_flight": self._in_flight, "rejected": self.rejected}
+
+
+class Dependency:
+    """
+    The resilience state for one external API, shared by every request in the process:
+    circuit breaker, adaptive bulkhead and latency tracker.
+    """
+
+    def __init__(self, name: str, env_prefix: str):
+        """
+        Builds the dependency from `<PREFIX>_*` settings, e.g. OPENAI_BREAKER_FAILURE_RATE,
+        falling back to the unprefixed setting and then the default.
+
+        Args:
+            name (str): The dependency name, for logs.
+            env_prefix (str): The prefix of its settings.
+        """
+        self.name = name
+        self.breaker = CircuitBreaker(
+            name,
+            failure_rate=_env(env_prefix, "BREAKER_FAILURE_RATE", "0.5"),
+            min_calls=int(_env(env_prefix, "BREAKER_MIN_CALLS", "10")),
+            window=int(_env(env_prefix, "BREAKER_WINDOW", "50")),
+            reset_timeout=_env(env_prefix, "BREAKER_RESET_TIMEOUT", "30"),
+        )
+        self.limiter = AdaptiveLimiter(
+            name,
+            initial=int(_env(env_prefix, "CONCURRENCY_INITIAL", "8")),
+            min_limit=int(_env(env_prefix, "CONCURRENCY_MIN", "1")),
+            max_limit=int(_env(env_prefix, "CONCURRENCY_MAX", "16")),
+            latency_target=_env(env_prefix, "LATENCY_TARGET", "5"),
+            max_wait=_env(env_prefix, "BULKHEAD_MAX_WAIT", "1"),
+        )
+        self.latency = LatencyTracker()
+
+    def call(self, fn: Callable[[float], T], timeout: float, is_failure: Callable[[Exception], bool]) -> T:
+        """
+        Makes one call through the breaker and the bulkhead.
+
+        Args:
+            fn (Callable[[float], T]): Makes the call, given its timeout.
+            timeout (float): The timeout for the call; time spent waiting for a slot counts.
+            is_failure (Callable[[Exception], bool]): Tells dependency failures from errors
+                caused by the request itself, which don't count against the dependency.
+
+        Returns:
+            T: What `fn` returned.
+
+        Raises:
+            UpstreamUnavailable: If the breaker is open or the bulkhead stayed full.
+        """
+        self.breaker.allow()
+        start = time.monotonic()
+        try:
+            self.limiter.acquire(timeout)
+        except BulkheadFull:
+            self.breaker.cancel()
+            raise
+        call_start = time.monotonic()
+        try:
+            result = fn(max(MIN_ATTEMPT_SECONDS, timeout - (call_start - start)))
+        except Exception as e:
+            failed = is_failure(e)
+            self.limiter.release(time.monotonic() - call_start, overloaded=failed)
+            self.breaker.record(not failed)
+            raise
+        seconds = time.monotonic() - call_start
+        self.limiter.release(seconds, overloaded=False)
+        self.breaker.record(True)
+        self.latency.record(seconds)
+        return result
+
+    async def call_async(self, fn: Callable[[float], Awaitable[T]], timeout: float,
+                         is_failure: Callable[[Exception], bool]) -> T:
+        """
+        Awaits one call through the breaker and the bulkhead, sharing both with `call`, so
+        async and threaded requests together stay within the dependency's limit.
+
+        Args:
+            fn (Callable[[float], Awaitable[T]]): Starts the call, given its timeout.
+            timeout (float): The timeout for the call; time spent waiting for a slot counts.
+            is_failure (Callable[[Exception], bool]): Tells dependency failures from errors
+                caused by the request itself.
+
+        Returns:
+            T: What `fn` returned.
+
+        Raises:
+            UpstreamUnavailable: If the breaker is open or the bulkhead stayed full.
+        """
+        self.breaker.allow()
+        start = time.monotonic()
+        try:
+            await self.limiter.acquire_async(timeout)
+        except BaseException:
+            self.breaker.cancel()
+            raise
+        call_start = time.monotonic()
+        try:
+            result = await fn(max(MIN_ATTEMPT_SECONDS, timeout - (call_start - start)))
+        except Exception as e:
+            failed = is_failure(e)
+            self.limiter.release(time.monotonic() - call_start, overloaded=failed)
+            self.breaker.record(not failed)
+            raise
+        except BaseException:
+            # Cancelled, e.g. the request timed out: CancelledError isn't an Exception, and
+            # a half open breaker would wait forever for this probe's outcome.
+            self.limiter.release(time.monotonic() - call_start, overloaded=False)
+            self.breaker.cancel()
+            raise
+        seconds = time.monotonic() - call_start
+        self.limiter.release(seconds, overloaded=False)
+        self.breaker.record(True)
+        self.latency.record(seconds)
+        return result
+
+    def snapshot(self):
+        """Gets the breaker state, bulkhead and latency figures."""
+        return {"state": self.breaker.state, **self.limiter.snapshot(), **self.latency.snapshot()}
+
+
+_dependencies_lock = threading.Lock()
+_dependencies = {}
+
+
+def get_dependency(name: str) -> Dependency:
+    """
+    Gets the shared Dependency for an external API, e.g. "vision" or "openai".
+
+    Args:
+        name (str): The dependency name. Its settings use the upper-cased name as prefix.
+
+    Returns:
+        Dependency: The dependency, created on first use.
+    """
+    with _dependencies_lock:
+        if name not in _dependencies:
+            _dependencies[name] = Dependency(name, name.upper())
+        return _dependencies[name]
+
+
+def dependency_status():
+    """Gets the snapshot of every dependency created so far."""
+    with _dependencies_lock:
+        dependencies = list(_dependencies.values())
+    return {dependency.name: dependency.snapshot() for dependency in dependencies}
+
+
+_pool_lock = threading.Lock()
+_pool: Optional[ThreadPoolExecutor] = None
+_pool_pid: Optional[int] = None
+
+
+def _get_pool() -> ThreadPoolExecutor:
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = ThreadPoolExecutor(max_workers=HEDGE_POOL_SIZE, thread_name_prefix="hedge")
+            _pool_pid = os.getpid()
+        return _pool
+
+
+def _hedged(fn: Callable[[float], T], timeout: float, hedge_after: float, latency: LatencyTracker, name: str) -> T:
+    """
+    Runs `fn`, and a second copy if the first hasn't answered within `hedge_after`.
+    The first successful answer wins; the slower call is left to finish on its own.
+    """
+    pool = _get_pool()
+    start = time.monotonic()
+    primary = pool.submit(fn, timeout)
+    done, _ = wait([primary], timeout=hedge_after)
+    if done:
+        return primary.result()
+
+    hedge_timeout = timeout - (time.monotonic() - start)
+    if hedge_timeout < MIN_ATTEMPT_SECONDS:
+        return primary.result()
+
+    logging.info(f"Hedging {name} after {hedge_after:.2f}s")
+    latency.record_hedge()
+    hedge = pool.submit(fn, hedge_timeout)
+    pending = {primary, hedge}
+    error = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                if future is hedge:
+                    latency.record_hedge(won=True)
+                return future.result()
+            error = future.exception()
+    raise error
+
+
+def call_with_retries(fn: Callable[[float], T], deadline: Optional[Deadline] = None, attempt_timeout: float = 10.0,
+                      max_attempts: int = 3, retryable: Callable[[Exception], bool] = lambda e: False,
+                      latency: Optional[LatencyTracker] = None, hedge: bool = False, name: str = "call",
+                      dependency: Optional[Dependency] = None) -> T:
+    """
+    Calls an upstream with a per-attempt timeout, retrying transient errors with jittered
+    exponential backoff for as long as the deadline allows.
+
+    Args:
+        fn (Callable[[float], T]): Makes the call, given the timeout in seconds for this attempt.
+        deadline (Optional[Deadline]): The request deadline. Without one, each attempt
+            still gets `attempt_timeout`.
+        attempt_timeout (float): The longest one attempt may take.
+        max_attempts (int): How many attempts to make at most.
+        retryable (Callable[[Exception], bool]): Tells transient errors from permanent ones.
+        latency (Optional[LatencyTracker]): Where successful latencies are recorded.
+        hedge (bool): Whether to send a second request when the first is slower than the
+            p95 in `latency`.
+        name (str): The upstream name, for logs.
+        dependency (Optional[Dependency]): Sends every attempt, hedges included, through
+            this dependency's circuit breaker and bulkhead. Its latency tracker is used
+            when `latency` isn't given. Errors that `retryable` accepts count as failures.
+
+    Returns:
+        T: What `fn` returned.
+
+    Raises:
+        DeadlineExceeded: If the deadline ran out before a call could be made.
+        UpstreamUnavailable: If the dependency's circuit is open or its bulkhead stayed full.
+        Exception: The last error from `fn` if it isn't retryable or retries ran out.
+    """
+    call = fn
+    if dependency:
+        call = lambda timeout: dependency.call(fn, timeout, retryable)
+        latency = latency or dependency.latency
+
+    for attempt in range(max_attempts):
+        timeout = deadline.timeout(attempt_timeout) if deadline else attempt_timeout
+        start = time.monotonic()
+        try:
+            hedge_after = latency.p95() if hedge and latency else None
+            if hedge_after is not None and hedge_after < timeout:
+                result = _hedged(call, timeout, hedge_after, latency, name)
+            else:
+                result = call(timeout)
+        except Exception as e:
+            if attempt + 1 >= max_attempts or isinstance(e, UpstreamUnavailable) or not retryable(e):
+                raise
+            # Full jitter keeps retries from many workers from arriving together.
+            delay = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+            if deadline and deadline.remaining() - delay < MIN_ATTEMPT_SECONDS:
+                raise
+            logging.warning(f"{name} attempt {attempt + 1} failed ({type(e).__name__}: {str(e)}), "
+                            f"retrying in {delay:.2f}s")
+            time.sleep(delay)
+            continue
+
+        if latency and not dependency:
+            latency.record(time.monotonic() - start)
+        return result
@@ -0,0 +1,160 @@
+import binascii
+import os
+from typing import BinaryIO, Optional
+
+# Largest receipt image accepted, after base64 decoding.
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(20 * 1024 * 1024)))
+# Size of each read from the request stream or spooled file.
+READ_CHUNK_BYTES = 64 * 1024
+# Room for multipart boundaries and headers on top of the file itself.
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+
+
+class UploadTooLarge(ValueError):
+    """
+    Raised when an upload is bigger than the allowed limit.
+    """
+
+    def __init__(self, limit: int):
+        super().__init__(f"Upload is larger than {limit} bytes")
+        self.limit = limit
+
+
+class InvalidUpload(ValueError):
+    """
+    Raised when an upload can't be decoded.
+    """
+
+
+def check_content_length(content_length: Optional[int], limit: int = MAX_UPLOAD_BYTES, base64_body: bool = False) -> None:
+    """
+    Rejects a request from its Content-Length before any of the body is read.
+
+    Args:
+        content_length (Optional[int]): The Content-Length header, if sent.
+        limit (int): The largest decoded image allowed.
+        base64_body (bool): Whether the body is base64, which is 4/3 the size of the image.
+
+    Raises:
+        UploadTooLarge: If the body can't fit within the limit.
+    """
+    if content_length is None:
+        return
+    allowed = (limit * 4) // 3 + 4 if base64_body else limit
+    if content_length > allowed + MULTIPART_OVERHEAD_BYTES:
+        raise UploadTooLarge(limit)
+
+
+def read_file(stream: BinaryIO, limit: int = MAX_UPLOAD_BYTES) -> memoryview:
+    """
+    Reads an uploaded file into one buffer, stopping as soon as it goes over the limit.
+
+    Werkzeug spools large multipart files to disk, so the only full copy of the image in
+    memory is the buffer returned here.
+
+    Args:
+        stream (BinaryIO): The uploaded file, e.g. `FileStorage.stream`.
+        limit (int): The largest file allowed.
+
+    Returns:
+        memoryview: The file content.
+
+    Raises:
+        UploadTooLarge: If the file is bigger than the limit.
+    """
+    size = None
+    if stream.seekable():
+        start = stream.tell()
+        size = stream.seek(0, os.SEEK_END) - start
+        stream.seek(start)
+        if size > limit:
+            raise UploadTooLarge(limit)
+
+    if size is not None:
+        buffer = bytearray(size)
+        view = memoryview(buffer)
+        read = 0
+        while read < size:
+            count = stream.readinto(view[read:])
+            if not count:
+                break
+            read += count
+        return view[:read]
+
+    buffer = bytearray()
+    while True:
+        chunk = stream.read(READ_CHUNK_BYTES)
+        if not chunk:
+            return memoryview(buffer)
+        if len(buffer) + len(chunk) > limit:
+            raise UploadTooLarge(limit)
+        buffer += chunk
+
+
+def decode_base64_stream(stream: BinaryIO, limit: int = MAX_UPLOAD_BYTES,
+                         size_hint: Optional[int] = None) -> memoryview:
+    """
+    Decodes a base64 body or `data:` URL while reading it, without building the whole
+    string in memory.
+
+    Whitespace inside the base64 text is ignored.
+
+    Args:
+        stream (BinaryIO): The request body.
+        limit (int): The largest decoded image allowed.
+        size_hint (Optional[int]): The body length, used to size the output buffer once.
+
+    Returns:
+        memoryview: The decoded image.
+
+    Raises:
+        UploadTooLarge: If the decoded image is bigger than the limit.
+        InvalidUpload: If the body is not valid base64.
+    """
+    output = bytearray()
+    if size_hint:
+        # Reserve the whole output up front, then trim, so the buffer is never regrown.
+        output = bytearray((size_hint * 3) // 4 + 3)
+    written = 0
+    pending = b""
+    first = True
+
+    while True:
+        chunk = stream.read(READ_CHUNK_BYTES)
+        if not chunk:
+            break
+
+        if first:
+            first = False
+            chunk = chunk.lstrip()
+            if chunk[:5].lower() == b"data:":
+                # The header is short, so it always ends in the first chunk.
+                comma = chunk.find(b",")
+                if comma == -1 or b";base64" not in chunk[:comma].lower():
+                    raise InvalidUpload("Only base64 data URLs are supported")
+                chunk = chunk[comma + 1:]
+
+        data = pending + b"".join(chunk.split())
+        usable = len(data) - len(data) % 4
+        pending = data[usable:]
+        if not usable:
+            continue
+
+        try:
+            decoded = binascii.a2b_base64(data[:usable])
+        except binascii.Error as e:
+            raise InvalidUpload(f"Invalid base64 data: {e}")
+
+        if written + len(decoded) > limit:
+            raise UploadTooLarge(limit)
+        if written + len(decoded) <= len(output):
+            output[written:written + len(decoded)] = decoded
+        else:
+            del output[written:]
+            output += decoded
+        written += len(decoded)
+
+    if pending.rstrip(b"="):
+        raise InvalidUpload("Truncated base64 data")
+
+    return memoryview(output)[:written]
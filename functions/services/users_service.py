@@ -1,6 +1,8 @@
 from models.user import User
 from models.response import Response
-from repository import users_repo
+from repository import users_repo, transactions_repo
+from services import category_classifier, deletion_jobs
+from models.subcollection import loaded_records
 
 def add_new_user(user: User) -> Response:
     """
@@ -15,7 +17,10 @@ def add_new_user(user: User) -> Response:
                   - If unsuccessful, `result.is_successful()` is False and `result.get_errors()` provides an error message.
     """
 
-    return users_repo.create_user(user)
+    result = users_repo.create_user(user)
+    if result.is_successful():
+        category_classifier.learn_transactions(user.user_id, user.transactions, user.categories)
+    return result
 
 
 def update_user(user: User) -> Response:
@@ -32,7 +37,44 @@ def update_user(user: User) -> Response:
             - In case of other errors during the update process, the `errors` attribute will contain an appropriate message.
     """
 
-    return users_repo.update_user(user)
+    result = users_repo.update_user(user)
+    if result.is_successful():
+        # A lazily loaded user only teaches the classifier what it has in memory.
+        category_classifier.learn_transactions(user.user_id, loaded_records(user.transactions),
+                                               loaded_records(user.categories))
+    return result
+
+
+def get_user_version(user_id: str) -> int:
+    """
+    Gets the version of a user, which changes on every write to it, without loading it.
+
+    Args:
+        user_id (str): The unique identifier of the user.
+
+    Returns:
+        int: The version, or None if the user doesn't exist.
+    """
+
+    return users_repo.get_user_version(user_id)
+
+
+def patch_user(user_id: str, changes: dict, update_time: str = None) -> Response:
+    """
+    Changes fields of a user without loading it.
+
+    Args:
+        user_id (str): The unique identifier of the user.
+        changes (dict): The profile fields to set.
+        update_time (str): The `update_time` the changes were based on, for optimistic concurrency.
+
+    Returns:
+        Response: A Response object:
+            - If successful, `result.get_payload()` contains the changed fields and the new `update_time`.
+            - If a field can't be patched, `result.get_errors()` says which.
+    """
+
+    return users_repo.patch_user(user_id, changes, update_time)
 
 
 def delete_user(user_id: str) -> Response:
@@ -49,23 +91,65 @@ def delete_user(user_id: str) -> Response:
             - In case of other errors during the delete process, the `errors` attribute will contain an appropriate message.
     """
 
+    category_classifier.forget_user(user_id)
     return users_repo.delete_user(user_id)
 
-def delete_transactions(user: User) -> Response:
+
+def delete_user_in_background(user_id: str) -> Response:
     """
-    Deletes an existing transactions from the database.
+    Starts deleting an existing user in the background.
 
     Args:
-        user (User): The updated User object with deleted transaction information.
+        user_id (str): The unique identifier (e.g., UUID) of the user to delete.
 
     Returns:
         Response: A Response object:
-            - If successful, `result.is_successful()` is True and `result.get_payload()` contains any relevant data (e.g., a success message).
-            - If unsuccessful (user not found), `result.is_successful()` is False and `result.get_errors()` contains "This user does not exist".
-            - In case of other errors during the delete process, the `errors` attribute will contain an appropriate message.
+            - If successful, `result.get_payload()` contains the `job_id` to poll.
+            - If unsuccessful (user not found), `result.get_errors()` contains an error message.
+    """
+    result = Response()
+    if not users_repo.user_exists(user_id):
+        result.add_error(f"A user with id {user_id} doesn't exist.")
+        return result
+    category_classifier.forget_user(user_id)
+    result.set_payload({"job_id": deletion_jobs.submit_deletion(user_id), "status": deletion_jobs.QUEUED})
+    return result
+
+def get_deletion_job(job_id: str) -> dict:
+    """
+    Gets the progress of a background user deletion.
+
+    Args:
+        job_id (str): The job id returned by `delete_user_in_background`.
+
+    Returns:
+        dict: The job, or None if it doesn't exist.
+    """
+    return deletion_jobs.get_deletion(job_id)
+
+def delete_transactions(user_id: str, transaction_ids: list = None, filters: dict = None,
+                        keep: User = None) -> Response:
+    """
+    Deletes a user's transactions by id, by filter, or all but the ones a client kept.
+
+    Args:
+        user_id (str): The unique identifier of the user.
+        transaction_ids (list): The transactions to delete.
+        filters (dict): Date range, category, vendor and amount range filters of the transactions to delete.
+        keep (User): A User object whose transactions are the only ones to keep.
+
+    Returns:
+        Response: A Response object:
+            - If successful, `result.get_payload()` contains the `deleted_transaction_ids`.
+            - If unsuccessful, `result.get_errors()` contains an appropriate message.
     """
 
-    return users_repo.delete_transactions(user)
+    category_classifier.forget_user(user_id)
+    if transaction_ids is not None:
+        return transactions_repo.delete_transactions(user_id, transaction_ids)
+    if filters is not None:
+        return transactions_repo.delete_matching_transactions(user_id, filters)
+    return users_repo.delete_transactions(keep)
 
 
 def delete_category(data: dict) -> Response:
@@ -82,4 +166,23 @@ def delete_category(data: dict) -> Response:
             - In case of other errors during the delete process, the `errors` attribute will contain an appropriate message.
     """
 
-    return users_repo.delete_category(data)
\ No newline at end of file
+    category_classifier.forget_user(data.get('user_id'))
+    return users_repo.delete_category(data)
+
+
+def list_transactions(user_id: str, filters: dict, page_size: int = None, page_token: str = None) -> Response:
+    """
+    Gets one page of a user's transactions, newest first.
+
+    Args:
+        user_id (str): The unique identifier of the user.
+        filters (dict): Date range, category, vendor and amount range filters.
+        page_size (int): The most transactions to return; the repository default if None.
+        page_token (str): The `next_page_token` of the previous page, if any.
+
+    Returns:
+        Response: A Response object:
+            - If successful, `result.get_payload()` contains `transactions` and `next_page_token`.
+            - If a filter or the page token is invalid, `result.get_errors()` says which.
+    """
+    return transactions_repo.list_transactions(user_id, filters, page_size, page_token)
@@ -0,0 +1,131 @@
+import pytest
+
+from models.category import Category
+from models.transaction import Transaction
+from services import category_classifier
+from services.category_classifier import CategoryClassifier
+
+HISTORY = [
+    ('Starbucks', 'Meals', 'tx-1'),
+    ('Starbucks', 'Meals', 'tx-2'),
+    ('Blue Bottle Coffee', 'Meals', 'tx-3'),
+    ('Shell Gas Station', 'Travel', 'tx-4'),
+    ('Chevron Gas', 'Travel', 'tx-5'),
+]
+
+
+def trained() -> CategoryClassifier:
+    classifier = CategoryClassifier()
+    for vendor, category, transaction_id in HISTORY:
+        classifier.learn(vendor, category, transaction_id)
+    return classifier
+
+
+@pytest.fixture
+def trainings(monkeypatch):
+    # Users whose classifier was trained from Firestore, in order.
+    calls = []
+
+    def train(user_id):
+        calls.append(user_id)
+        return trained()
+
+    monkeypatch.setattr(category_classifier, '_train_from_firestore', train)
+    monkeypatch.setattr(category_classifier, '_classifiers',
+                        category_classifier.LRUCache(max_entries=10, max_bytes=2 ** 62, ttl=60))
+    return calls
+
+
+def test_known_vendor_gets_its_category():
+    assert trained().predict('  STARBUCKS ') == ('meals', 1.0)
+
+
+def test_known_vendor_gets_its_most_used_category():
+    classifier = trained()
+    classifier.learn('Starbucks', 'Work', 'tx-6')
+
+    category, probability = classifier.predict('Starbucks')
+
+    assert category == 'meals'
+    assert probability == pytest.approx(2 / 3)
+
+
+def test_unknown_vendor_falls_back_to_naive_bayes():
+    category, probability = trained().predict('Costco Gas')
+
+    assert category == 'travel'
+    assert 0.5 < probability < 1.0
+
+
+def test_ocr_header_helps_an_unknown_vendor():
+    category, _ = trained().predict('Acme', text="BLUE BOTTLE\n123 Main St\nLatte 4.50")
+
+    assert category == 'meals'
+
+
+def test_nothing_to_go_on():
+    assert trained().predict('Acme') == (None, 0.0)
+    assert CategoryClassifier().predict('Starbucks') == (None, 0.0)
+
+
+def test_relearning_a_transaction_replaces_it():
+    classifier = trained()
+    classifier.learn('Starbucks', 'Work', 'tx-1')
+    classifier.learn('Starbucks', 'Work', 'tx-2')
+
+    assert classifier.predict('Starbucks') == ('work', 1.0)
+
+
+def test_forget_removes_a_transaction():
+    classifier = trained()
+    classifier.forget('tx-4')
+    classifier.forget('tx-5')
+
+    assert classifier.predict('Shell Gas Station') == (None, 0.0)
+    assert classifier.predict('Costco Gas') == (None, 0.0)
+
+
+def test_classifier_is_trained_once(trainings):
+    first = category_classifier.get_classifier('user-1')
+
+    assert category_classifier.get_classifier('user-1') is first
+    assert trainings == ['user-1']
+
+
+def test_forget_user_retrains(trainings):
+    first = category_classifier.get_classifier('user-1')
+    category_classifier.forget_user('user-1')
+
+    assert category_classifier.get_classifier('user-1') is not first
+    assert trainings == ['user-1', 'user-1']
+
+
+def test_learn_transactions_updates_a_cached_classifier(trainings):
+    category_classifier.get_classifier('user-1')
+
+    category_classifier.learn_transactions(
+        'user-1',
+        [Transaction({'transaction_id': 'tx-9', 'vendor': 'Costco', 'category_name': 'Groceries'})],
+        [Category({'category_name': 'Rent'})])
+
+    classifier = category_classifier.get_classifier('user-1')
+    assert classifier.predict('Costco') == ('groceries', 1.0)
+    assert 'rent' in classifier.categories
+    assert trainings == ['user-1']
+
+
+def test_learn_transactions_skips_users_that_are_not_cached(trainings):
+    category_classifier.learn_transactions(
+        'user-1', [Transaction({'transaction_id': 'tx-9', 'vendor': 'Costco', 'category_name': 'Groceries'})])
+
+    assert trainings == []
+    assert category_classifier.get_classifier('user-1').predict('Costco') == (None, 0.0)
+
+
+def test_failed_training_is_not_cached(trainings, monkeypatch):
+    def fail(user_id):
+        raise RuntimeError("unavailable")
+
+    monkeypatch.setattr(category_classifier, '_train_from_firestore', fail)
+    assert category_classifier.get_classifier('user-1') is None
+    assert category_classifier._load_locks == {}
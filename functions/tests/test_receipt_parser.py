@@ -0,0 +1,130 @@
+import pytest
+
+from services.receipt_parser import extract_total, parse_amount, parse_receipt_text
+
+WALMART_RECEIPT = """WALMART
+Save money. Live better.
+123 Main St
+Springfield IL 62701
+ST# 1234 OP# 00001 TE# 12
+01/15/2024 10:32
+PAPER TOWELS 12.97
+DISH SOAP 3.47
+SUBTOTAL 16.44
+TAX 1.15
+TOTAL $17.59
+VISA TEND 17.59
+CHANGE DUE 0.00
+"""
+
+BAKERY_RECEIPT = """Joe's Corner Bakery
+45 Elm Street
+Mar 3, 2024
+Sourdough loaf 6.50
+Croissant 3.25
+Total 9.75
+"""
+
+ONLINE_RECEIPT = """STAPLES
+Order #88812
+2024-02-10
+Printer paper 24.99
+Shipping 0.00
+Order total: $24.99
+"""
+
+
+def test_parse_amount_strips_dollar_sign_and_separators():
+    assert parse_amount("TOTAL $1,234.56") == 1234.56
+    assert parse_amount("Thank you") is None
+
+
+def test_known_chain():
+    parsed = parse_receipt_text(WALMART_RECEIPT)
+
+    assert parsed['vendor'] == 'walmart'
+    assert parsed['category_name'] == 'Supplies'
+    assert parsed['created_at'] == '2024-01-15'
+    # The subtotal, tax and change lines are not the total.
+    assert parsed['amount'] == 17.59
+    assert parsed['confidence'] >= 0.9
+
+
+def test_unknown_vendor_uses_first_header_line_without_category():
+    parsed = parse_receipt_text(BAKERY_RECEIPT)
+
+    assert parsed['vendor'] == "Joe's Corner Bakery"
+    assert parsed['category_name'] is None
+    assert parsed['created_at'] == '2024-03-03'
+    assert parsed['amount'] == 9.75
+    assert parsed['confidence'] < 1.0
+
+
+def test_order_total_line():
+    parsed = parse_receipt_text(ONLINE_RECEIPT)
+
+    assert parsed['vendor'] == 'staples'
+    assert parsed['created_at'] == '2024-02-10'
+    assert parsed['amount'] == 24.99
+    # A total that isn't at the start of its line is a weaker match.
+    assert parsed['confidence'] < parse_receipt_text(WALMART_RECEIPT)['confidence']
+
+
+def test_total_on_the_line_below_its_label():
+    amount, score = extract_total(["AMOUNT DUE", "$42.10"])
+
+    assert amount == 42.10
+    assert 0 < score < 1.0
+
+
+def test_missing_date_and_total():
+    parsed = parse_receipt_text("STARBUCKS\nStore 5521\nCaffe Latte\nThank you\n")
+
+    assert parsed['vendor'] == 'starbucks'
+    assert parsed['created_at'] is None
+    assert parsed['amount'] is None
+    assert parsed['confidence'] == pytest.approx(0.3)
+
+
+def test_empty_text():
+    parsed = parse_receipt_text("")
+
+    assert parsed == {'vendor': None, 'created_at': None, 'amount': None, 'category_name': None, 'confidence': 0.0}
+
+
+@pytest.fixture
+def ocr_service(monkeypatch):
+    # ocr_service loads the .env file on import.
+    pytest.importorskip("dotenv")
+    from services import ocr_service
+
+    monkeypatch.setattr(ocr_service, "LOCAL_PARSE_THRESHOLD", 0.9)
+    return ocr_service
+
+
+def test_confident_parse_skips_openai(ocr_service):
+    parsed = ocr_service.local_parse(WALMART_RECEIPT, ['Meals', 'Supplies'])
+
+    assert parsed is not None
+    assert parsed['category_name'] == 'Supplies'
+    assert parsed['amount'] == 17.59
+
+
+def test_parse_below_threshold_falls_back_to_openai(ocr_service):
+    # Known chain and date, but the weaker "Order total" match keeps it under 0.9.
+    assert parse_receipt_text(ONLINE_RECEIPT)['confidence'] < 0.9
+    assert ocr_service.local_parse(ONLINE_RECEIPT, ['Supplies']) is None
+
+
+def test_parse_without_allowed_category_falls_back_to_openai(ocr_service):
+    assert ocr_service.local_parse(WALMART_RECEIPT, ['Meals']) is None
+    assert ocr_service.local_parse(BAKERY_RECEIPT, ['Meals', 'Supplies']) is None
+
+
+def test_degraded_parse_is_used_whatever_its_confidence(ocr_service):
+    parsed = ocr_service.degraded_parse(ONLINE_RECEIPT, ['Meals'])
+
+    assert parsed['degraded'] is True
+    assert parsed['amount'] == 24.99
+    # Categories the user doesn't have are dropped rather than returned.
+    assert parsed['category_name'] is None
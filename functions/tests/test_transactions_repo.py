@@ -0,0 +1,198 @@
+import pytest
+
+from repository import transactions_repo
+
+
+class FakeDoc:
+    def __init__(self, doc_id, data, parent_id='user-1'):
+        self.id = doc_id
+        self._data = data
+        self.reference = FakeRef(doc_id, parent_id)
+
+    def to_dict(self):
+        return dict(self._data)
+
+
+class FakeRef:
+    def __init__(self, doc_id, user_id):
+        self.id = doc_id
+        self.path = f'Users/{user_id}/transactions/{doc_id}'
+        # transactions live at Users/{user_id}/transactions/{transaction_id}.
+        self.parent = type('Collection', (), {'parent': type('User', (), {'id': user_id})})()
+
+
+class FakeQuery:
+    """Records how a query is built and streams its documents from `limit` and `start_after`."""
+
+    def __init__(self, docs=()):
+        self.docs = list(docs)
+        self.wheres = []
+        self.orders = []
+        self.cursors = []
+        self._limit = None
+        self._after = None
+
+    def collection(self, name):
+        return self
+
+    collection_group = document = collection
+
+    def select(self, fields):
+        return self
+
+    def where(self, filter):
+        self.wheres.append((filter.field_path, filter.op_string, filter.value))
+        return self
+
+    def order_by(self, field, direction=None):
+        self.orders.append(field)
+        return self
+
+    def start_after(self, cursor):
+        self.cursors.append(cursor)
+        self._after = cursor
+        return self
+
+    def limit(self, count):
+        self._limit = count
+        return self
+
+    def stream(self):
+        docs = self.docs
+        if self._after is not None:
+            after_id = self._after.id if isinstance(self._after, FakeDoc) else self._after[-1]
+            docs = docs[[d.id for d in docs].index(after_id) + 1:]
+        self._after = None
+        return iter(docs[:self._limit] if self._limit else docs)
+
+
+@pytest.fixture
+def query(monkeypatch):
+    pytest.importorskip("google.cloud.firestore_v1")
+    fake = FakeQuery()
+    monkeypatch.setattr(transactions_repo, 'db', fake)
+    return fake
+
+
+def test_page_token_round_trips():
+    filters = {'vendor': 'Starbucks', 'min_amount': '5'}
+    values = [12.5, '2024-01-15T10:00:00', 'tx-1']
+
+    token = transactions_repo.encode_page_token(values, filters)
+
+    assert transactions_repo.decode_page_token(token, dict(reversed(list(filters.items())))) == values
+
+
+def test_page_token_is_rejected_when_the_filters_change():
+    token = transactions_repo.encode_page_token(['2024-01-15', 'tx-1'], {'vendor': 'Starbucks'})
+
+    with pytest.raises(ValueError, match="different filters"):
+        transactions_repo.decode_page_token(token, {'vendor': 'Target'})
+
+
+def test_malformed_page_token_is_rejected():
+    with pytest.raises(ValueError, match="Invalid page_token"):
+        transactions_repo.decode_page_token('not-a-token', {})
+
+
+def test_list_transactions_reports_a_token_from_other_filters(query):
+    token = transactions_repo.encode_page_token(['2024-01-15', 'tx-1'], {'vendor': 'Starbucks'})
+
+    response = transactions_repo.list_transactions('user-1', {'vendor': 'Target'}, page_token=token)
+
+    assert not response.is_successful()
+    assert query.cursors == []
+
+
+def test_newest_first_without_amount_filters(query):
+    transactions_repo.list_transactions('user-1', {'vendor': 'Starbucks'})
+
+    assert query.orders == ['created_at', '__name__']
+    assert query.wheres == [('vendor', '==', 'starbucks')]
+
+
+def test_amount_filters_order_by_amount_first(query):
+    transactions_repo.list_transactions('user-1', {'min_amount': '5', 'max_amount': 20})
+
+    assert query.orders == ['amount', 'created_at', '__name__']
+    assert query.wheres == [('amount', '>=', 5.0), ('amount', '<=', 20.0)]
+
+
+def test_amount_filters_must_be_numbers(query):
+    response = transactions_repo.list_transactions('user-1', {'min_amount': 'five'})
+
+    assert not response.is_successful()
+
+
+def test_created_to_includes_the_whole_day(query):
+    transactions_repo.list_transactions('user-1', {'created_from': '2024-01-01', 'created_to': '2024-01-31'})
+
+    field, op, upper = query.wheres[-1]
+    assert (field, op) == ('created_at', '<=')
+    assert upper == '2024-01-31\uf8ff'
+    assert '2024-01-31T23:59:59.999999' <= upper
+    assert '2024-02-01' > upper
+
+
+def test_next_page_starts_after_the_last_transaction(query):
+    query.docs = [FakeDoc(f'tx-{i}', {'created_at': f'2024-01-0{9 - i}', 'amount': 1.0}) for i in range(3)]
+
+    first = transactions_repo.list_transactions('user-1', page_size=2).get_payload()
+    second = transactions_repo.list_transactions('user-1', page_size=2,
+                                                 page_token=first['next_page_token']).get_payload()
+
+    assert [t['transaction_id'] for t in first['transactions']] == ['tx-0', 'tx-1']
+    assert query.cursors == [['2024-01-08', 'tx-1']]
+    assert [t['transaction_id'] for t in second['transactions']] == ['tx-2']
+    assert second['next_page_token'] is None
+
+
+def test_filtered_delete_is_unordered(query, monkeypatch):
+    # Firestore leaves out documents without an order by field.
+    query.docs = [FakeDoc('tx-1', {}), FakeDoc('tx-2', {'created_at': '2024-01-01'})]
+    monkeypatch.setattr(transactions_repo, 'delete_in_batches', lambda refs: [])
+    monkeypatch.setattr(transactions_repo, 'record_user_write', lambda user_id: None)
+
+    response = transactions_repo.delete_matching_transactions('user-1', {'vendor': 'Starbucks'})
+
+    assert query.orders == []
+    assert response.get_payload() == {'deleted_transaction_ids': ['tx-1', 'tx-2']}
+
+
+@pytest.fixture
+def migration(monkeypatch):
+    pytest.importorskip("google.cloud.firestore_v1")
+    from migrations import amounts_to_numbers
+
+    commits, writes = [], []
+    monkeypatch.setattr(amounts_to_numbers, 'commit_in_batches', lambda batch: commits.append(batch) or [])
+    monkeypatch.setattr(amounts_to_numbers, 'record_user_write', writes.append)
+    return amounts_to_numbers, commits, writes
+
+
+def test_migration_rewrites_string_amounts(migration, monkeypatch):
+    from google.cloud.firestore_v1 import DELETE_FIELD
+
+    amounts_to_numbers, commits, writes = migration
+    monkeypatch.setattr(amounts_to_numbers, 'db', FakeQuery([
+        FakeDoc('tx-1', {'amount': '12.50'}, 'user-1'),
+        FakeDoc('tx-2', {'amount': 3.0}, 'user-1'),
+        FakeDoc('tx-3', {'amount': 'n/a'}, 'user-2'),
+        FakeDoc('tx-4', {}, 'user-2'),
+    ]))
+
+    changed = amounts_to_numbers.migrate(page_size=3)
+
+    assert changed == 2
+    assert [(ref.id, data) for batch in commits for ref, data, _ in batch] == [
+        ('tx-1', {'amount': 12.5}), ('tx-3', {'amount': DELETE_FIELD})]
+    assert sorted(writes) == ['user-1', 'user-2']
+
+
+def test_migration_dry_run_writes_nothing(migration, monkeypatch):
+    amounts_to_numbers, commits, writes = migration
+    monkeypatch.setattr(amounts_to_numbers, 'db', FakeQuery([FakeDoc('tx-1', {'amount': '12.50'})]))
+
+    assert amounts_to_numbers.migrate(dry_run=True) == 1
+    assert commits == []
+    assert writes == []
@@ -0,0 +1,48 @@
+import json
+
+from models.user import User
+
+STORED_USER = {
+    'user_id': 'user-1',
+    'email': 'ada@example.com',
+    'first_name': 'Ada',
+    'last_name': 'Lovelace',
+    'admin': False,
+    'categories': [{'category_id': 'cat-1', 'category_name': 'Meals'}],
+    'transactions': [{'transaction_id': 'tx-1', 'vendor': 'starbucks', 'category_name': 'meals', 'amount': 4.5,
+                      'created_at': '2024-01-15'}],
+}
+
+
+def get_body(user: User) -> dict:
+    # What GET /user sends, as the client receives it.
+    return json.loads(json.dumps({**user.serialize(True), 'update_time': '2024-01-15T10:00:00.000000Z'}, default=str))
+
+
+def test_get_body_round_trips_through_update():
+    stored = User(STORED_USER)
+    body = get_body(stored)
+    body['first_name'] = 'Augusta'
+
+    stored.apply_changes(body)
+
+    assert stored.first_name == 'Augusta'
+    assert stored.update_time is None
+    assert [t.transaction_id for t in stored.transactions] == ['tx-1']
+
+
+def test_get_body_round_trips_through_create():
+    user = User(get_body(User(STORED_USER)))
+
+    assert user.user_id == 'user-1'
+    assert user.email == 'ada@example.com'
+    assert user.transactions[0].amount == 4.5
+    assert user.update_time is None
+
+
+def test_unknown_fields_are_ignored():
+    user = User({**STORED_USER, 'not_a_field': 1})
+    user.apply_changes({'another_unknown': 2})
+
+    assert not hasattr(user, 'not_a_field')
+    assert not hasattr(user, 'another_unknown')